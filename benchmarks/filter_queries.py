@@ -0,0 +1,162 @@
+"""Hard-constraint filtering of get_filtered_experiments at scale, before and after the typed descriptions.
+
+Inside one transaction that is rolled back at the end, generates synthetic active experiments with
+numerical and categorical descriptions, then times get_filtered_experiments for a few call_mdp
+filters in three states:
+
+    typed      the function of migrations/002_typed_description_values.sql, with its indexes
+    legacy     the function of migrations/001_experiment_rating_stats.sql, same indexes
+    baseline   the function of migrations/001_experiment_rating_stats.sql, without the 002 indexes
+
+and prints the EXPLAIN ANALYZE plan of every typed query. The database is the one of the DB_* environment
+variables with the migrations applied. Nothing is kept, but dropping the indexes locks the tables
+until the rollback, so use a scratch database. Run from the repository root:
+
+    PYTHONPATH=src python -m benchmarks.filter_queries --experiments 200000 --output filters.json
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+
+from src.apps.database.connection import open_connection
+
+MIGRATIONS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'queries', 'migrations')
+TYPED_INDEXES = ['experiment_descriptions_experiment_type_idx', 'experiment_descriptions_type_numeric_idx',
+                 'experiment_descriptions_type_value_idx', 'experiments_active_filter_idx']
+DOMAINS = ['bench_domain_a', 'bench_domain_b', 'bench_domain_c', 'bench_domain_d']
+
+
+def legacy_function():
+    # get_filtered_experiments as 001 created it, as pg_temp.legacy_filtered_experiments
+    with open(os.path.join(MIGRATIONS, '001_experiment_rating_stats.sql')) as file:
+        source = file.read()
+    start = source.index('CREATE OR REPLACE FUNCTION get_filtered_experiments(')
+    end = source.index('$$ LANGUAGE plpgsql;', start) + len('$$ LANGUAGE plpgsql;')
+    return source[start:end].replace('get_filtered_experiments(', 'pg_temp.legacy_filtered_experiments(', 1)
+
+
+def generate(cursor, experiments, numerical, categorical):
+    # description type ids of the synthetic numerical and categorical descriptions
+    cursor.execute("""
+        INSERT INTO experiment_description_types (name, type)
+        SELECT 'bench_numerical_' || k, 'numerical' FROM generate_series(1, %s) AS k
+        UNION ALL
+        SELECT 'bench_categorical_' || k, 'categorical' FROM generate_series(1, %s) AS k
+        RETURNING description_type_id, type;""", (numerical, categorical))
+    types = cursor.fetchall()
+    numerical_ids = sorted(type_id for type_id, kind in types if kind == 'numerical')
+    categorical_ids = sorted(type_id for type_id, kind in types if kind == 'categorical')
+
+    cursor.execute("""
+        INSERT INTO experiments (title, domain, intent, algorithm, method, model, status, date)
+        SELECT 'bench ' || i, (%s::VARCHAR[])[1 + i %% %s], 'bench_intent_' || (i %% 3), 'bench_algorithm_' || (i %% 7),
+               'bench_method', 'bench_model_' || (i %% 11), 'active', CURRENT_DATE
+        FROM generate_series(1, %s) AS i
+        RETURNING experiment_id;""", (DOMAINS, len(DOMAINS), experiments))
+    first_id = min(row[0] for row in cursor.fetchall())
+
+    # numerical values uniform on [0, 1000), categorical ones among 20 labels
+    cursor.execute("""
+        INSERT INTO experiment_descriptions (experiment_id, description_type_id, value)
+        SELECT e.experiment_id, t.type_id, round((random() * 1000)::NUMERIC, 2)::VARCHAR
+        FROM generate_series(%s, %s) AS e(experiment_id), unnest(%s::INT[]) AS t(type_id);""",
+                   (first_id, first_id + experiments - 1, numerical_ids))
+    cursor.execute("""
+        INSERT INTO experiment_descriptions (experiment_id, description_type_id, value)
+        SELECT e.experiment_id, t.type_id, 'label_' || floor(random() * 20)::INT
+        FROM generate_series(%s, %s) AS e(experiment_id), unnest(%s::INT[]) AS t(type_id);""",
+                   (first_id, first_id + experiments - 1, categorical_ids))
+    cursor.execute("ANALYZE experiments; ANALYZE experiment_descriptions;")
+    return numerical_ids, categorical_ids
+
+
+def cases(numerical_ids, categorical_ids):
+    # name -> (domain, hard constraints)
+    def numerical(type_id, operator, value):
+        return {'description_type_id': type_id, 'value': str(value), 'comparison_type': 'numerical', 'operator': operator}
+
+    def categorical(type_id, value):
+        return {'description_type_id': type_id, 'value': value, 'comparison_type': 'categorical'}
+
+    return {
+        'domain': (DOMAINS[0], []),
+        'domain + numerical 1%': (DOMAINS[0], [numerical(numerical_ids[0], '>=', 990)]),
+        'numerical 1%': (None, [numerical(numerical_ids[0], '>=', 990)]),
+        'numerical 10% + 10%': (None, [numerical(numerical_ids[0], '<=', 100), numerical(numerical_ids[1], '>=', 900)]),
+        'categorical 5%': (None, [categorical(categorical_ids[0], 'label_3')]),
+        'domain + numerical + categorical': (DOMAINS[1], [numerical(numerical_ids[0], '>=', 500),
+                                                          categorical(categorical_ids[0], 'label_7')]),
+    }
+
+
+def timed(cursor, function, domain, filters, repeat):
+    # (median seconds, candidates)
+    durations = []
+    candidates = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        cursor.execute(f"SELECT {function}(%s, NULL, NULL, NULL, %s)::text;", (domain, json.dumps(filters)))
+        candidates = len(json.loads(cursor.fetchone()[0]))
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations), candidates
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--experiments', type=int, default=100000, help='synthetic experiments generated')
+    parser.add_argument('--numerical', type=int, default=4, help='numerical descriptions per experiment')
+    parser.add_argument('--categorical', type=int, default=4, help='categorical descriptions per experiment')
+    parser.add_argument('--repeat', type=int, default=5, help='timed calls per case and state')
+    parser.add_argument('--no-baseline', action='store_true',
+                        help='skip the state without indexes, whose time grows with the square of --experiments')
+    parser.add_argument('--no-explain', action='store_true', help='do not print the plans')
+    parser.add_argument('--output', help='JSON report (default: stdout only)')
+    args = parser.parse_args()
+
+    connection = open_connection()
+    try:
+        with connection.cursor() as cursor:
+            start = time.perf_counter()
+            numerical_ids, categorical_ids = generate(cursor, args.experiments, max(args.numerical, 2), max(args.categorical, 1))
+            print(f"generated {args.experiments} experiments in {time.perf_counter() - start:.1f}s")
+            cursor.execute(legacy_function())
+
+            benchmark_cases = cases(numerical_ids, categorical_ids)
+            report = {'experiments': args.experiments, 'numerical': args.numerical, 'categorical': args.categorical,
+                      'repeat': args.repeat, 'cases': {name: {} for name in benchmark_cases}}
+            for state, function in (('typed', 'get_filtered_experiments'), ('legacy', 'pg_temp.legacy_filtered_experiments')):
+                for name, (domain, filters) in benchmark_cases.items():
+                    seconds, candidates = timed(cursor, function, domain, filters, args.repeat)
+                    report['cases'][name][state] = {'median_ms': round(seconds * 1000, 3), 'candidates': candidates}
+
+            if not args.no_explain:
+                for name, (domain, filters) in benchmark_cases.items():
+                    cursor.execute("SELECT filtered_experiments_query(%s, NULL, NULL, NULL, %s);", (domain, json.dumps(filters)))
+                    cursor.execute("EXPLAIN (ANALYZE, BUFFERS, COSTS OFF) " + cursor.fetchone()[0])
+                    print(f"\n-- {name}\n" + "\n".join(row[0] for row in cursor.fetchall()))
+
+            if not args.no_baseline:
+                for index in TYPED_INDEXES:
+                    cursor.execute(f"DROP INDEX IF EXISTS {index};")
+                for name, (domain, filters) in benchmark_cases.items():
+                    seconds, candidates = timed(cursor, 'pg_temp.legacy_filtered_experiments', domain, filters, args.repeat)
+                    report['cases'][name]['baseline'] = {'median_ms': round(seconds * 1000, 3), 'candidates': candidates}
+    finally:
+        connection.rollback()
+        connection.close()
+
+    print(f"\n{'case':<34} {'candidates':>10} {'baseline':>11} {'legacy':>11} {'typed':>11}")
+    for name, result in report['cases'].items():
+        print(f"{name:<34} {result['typed']['candidates']:>10} "
+              + " ".join(f"{result[state]['median_ms']:>8.1f} ms" if state in result else f"{'-':>11}"
+                         for state in ('baseline', 'legacy', 'typed')))
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
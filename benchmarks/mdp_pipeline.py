@@ -0,0 +1,253 @@
+"""Stage-by-stage benchmark of the call_mdp ranking pipeline, without Postgres.
+
+Replays the KPI1.2 use cases and synthetic scale-ups of one of them through the same steps as
+/experiment/call_mdp (decoding the candidate rows, transition model, GraphWorld, solve, path utilities,
+ranking, JSON encoding), timing every stage and measuring its peak traced memory. The report is JSON,
+so that runs on two commits can be compared. Run from the repository root:
+
+    PYTHONPATH=src python -m benchmarks.mdp_pipeline --output before.json
+    PYTHONPATH=src python -m benchmarks.mdp_pipeline --scale 1000000 --output after.json --compare before.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from src.apps.MDP import generate_initial_transition_model, GraphWorld, PolicyIteration
+from src.apps.api.logics import (build_mdp_frames, create_reward_from_soft_constraints, frame_to_json,
+                                 leafs_to_frame, make_soft_constraints)
+
+KPI_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'KPI1.2')
+USE_CASES = ['UC1', 'UC2', 'UC3', 'UC4', 'UC5']
+COLUMNS = ['title', 'domain', 'intent', 'method', 'algorithm', 'model']
+MODEL_ARCHITECTURE = ['intent', 'algorithm', 'model_id']
+STAGES = ['frames', 'transition_model', 'graph_world', 'utility_values', 'path_utility', 'sort', 'serialize']
+
+
+def load_use_case(name):
+    # candidate rows shaped like get_filtered_experiments returns them: VARCHAR values, typed descriptions
+    data = pd.read_csv(os.path.join(KPI_FOLDER, f'{name}.csv'), dtype=str, keep_default_na=False)
+    data = data.replace({'': None, 'NA': None})
+    with open(os.path.join(KPI_FOLDER, f'{name}_semantic_model.json')) as file:
+        properties = json.load(file).get('properties', {})
+
+    descriptions = [column for column in data.columns if column not in COLUMNS]
+    types = {column: description_type(data[column], properties.get(column)) for column in descriptions}
+    records = []
+    for row, item in enumerate(data.to_dict(orient='records')):
+        record = {column: item.get(column) for column in COLUMNS}
+        record['experiment_id'] = row + 1
+        record['title'] = record['title'] or record['domain']
+        record['descriptions'] = [{'name': column, 'value': item[column], 'type': types[column]}
+                                  for column in descriptions]
+        records.append(record)
+    return records
+
+
+def description_type(values, semantic_property=None):
+    # the semantic model wins where it describes the column, otherwise numerical when every value parses
+    if semantic_property is not None and semantic_property.get('type') in ('number', 'integer'):
+        return 'numerical'
+    if semantic_property is not None and semantic_property.get('type') == 'string':
+        return 'categorical'
+    present = values.dropna()
+    if len(present) > 0 and pd.to_numeric(present, errors='coerce').notna().all():
+        return 'numerical'
+    return 'categorical'
+
+
+def scale_records(template, rows, intents, algorithms, seed=0):
+    # rows experiments cycling over the template, spread over intents x algorithms branches, with the
+    # numerical descriptions jittered by up to 10% so that the ranking has no artificial ties
+    rng = np.random.default_rng(seed)
+    source = rng.integers(0, len(template), rows)
+    intent = rng.integers(0, intents, rows)
+    algorithm = rng.integers(0, algorithms, rows)
+    jitter = rng.uniform(0.9, 1.1, rows)
+    records = []
+    for i in range(rows):
+        item = template[source[i]]
+        record = {column: item[column] for column in COLUMNS}
+        record['experiment_id'] = i + 1
+        record['intent'] = f"{item['intent']}_{intent[i]}"
+        record['algorithm'] = f"{item['algorithm']}_{algorithm[i]}"
+        record['model'] = str(item['model'])
+        record['descriptions'] = [jittered(description, jitter[i]) for description in item['descriptions']]
+        records.append(record)
+    return records
+
+
+def jittered(description, factor):
+    if description['type'] != 'numerical' or description['value'] is None:
+        return description
+    try:
+        value = float(description['value']) * factor
+    except ValueError:
+        return description
+    return {**description, 'value': repr(value)}
+
+
+def select_records(records, fraction=0.1, seed=0):
+    # the clicked experiments with their click counts, as get_selected_experiments returns them
+    rng = np.random.default_rng(seed)
+    rows = np.flatnonzero(rng.random(len(records)) < fraction)
+    counts = rng.integers(1, 20, len(rows))
+    return [{**records[row], 'experiment_count': int(count)} for row, count in zip(rows, counts)]
+
+
+def default_soft_constraints(records, count=3):
+    # the first numerical descriptions, preferring values between their median and their maximum
+    soft_constraints = []
+    for description in records[0]['descriptions']:
+        if description['type'] != 'numerical' or len(soft_constraints) >= count:
+            continue
+        values = pd.to_numeric(pd.Series([next(d['value'] for d in record['descriptions']
+                                                if d['name'] == description['name']) for record in records[:1000]]),
+                               errors='coerce').dropna()
+        if len(values) == 0:
+            continue
+        soft_constraints.append({'name': description['name'], 'type': 'numerical',
+                                 'min': float(values.median()), 'max': float(values.max())})
+    return soft_constraints
+
+
+def run_pipeline(case, measure):
+    # the uncached path of calculate_mdp, one measured call per stage
+    data_frame, selected_df, feedback_df = measure('frames', lambda: build_mdp_frames(case['records'], case['selected']))
+    transition_model = measure('transition_model', lambda: generate_initial_transition_model(
+        data_frame, selected_df, feedback_df=feedback_df, modelArchitecture=MODEL_ARCHITECTURE,
+        modelName=case['model_name']))
+    graph_world = measure('graph_world', lambda: GraphWorld(
+        data_frame, MODEL_ARCHITECTURE, transition_model,
+        make_soft_constraints(case['soft_constraints']), create_reward_from_soft_constraints(case['soft_constraints'])))
+    solver = PolicyIteration(graph_world, 0.9, 0.005)
+    utility_values = measure('utility_values', solver.get_utility_values)
+    path_values = measure('path_utility', lambda: solver.path_utility(utility_values))
+    ranked = measure('sort', lambda: graph_world.rank_leafs(case['limit'], 0, scores=path_values))
+    leaf_utilities = utility_values[graph_world.inner_node_num:]
+    measure('serialize', lambda: frame_to_json(leafs_to_frame(
+        data_frame, graph_world.leaf_rows[ranked], leaf_utilities[ranked], path_values[ranked])))
+    return {'experiments': len(data_frame), 'states': int(graph_world.num_states), 'leafs': len(graph_world.leafs)}
+
+
+def benchmark(case, repeat):
+    timings = {stage: [] for stage in STAGES}
+
+    def timed(stage, function):
+        start = time.perf_counter()
+        result = function()
+        timings[stage].append(time.perf_counter() - start)
+        return result
+
+    peaks = {}
+
+    def traced(stage, function):
+        # peak above what was allocated when the stage started
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        result = function()
+        peaks[stage] = tracemalloc.get_traced_memory()[1] - before
+        return result
+
+    for _ in range(repeat):
+        sizes = run_pipeline(case, timed)
+    tracemalloc.start()
+    try:
+        run_pipeline(case, traced)
+        total_peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    stages = {stage: {'best': min(timings[stage]), 'median': statistics.median(timings[stage]),
+                      'peak_bytes': peaks[stage]} for stage in STAGES}
+    totals = [sum(timings[stage][i] for stage in STAGES) for i in range(repeat)]
+    return {'case': case['name'], **sizes, 'stages': stages,
+            'total': {'best': min(totals), 'median': statistics.median(totals), 'peak_bytes': total_peak}}
+
+
+def make_cases(args):
+    use_cases = {name: load_use_case(name) for name in set(args.use_cases) | {args.template}}
+    cases = []
+    for name in args.use_cases:
+        records = use_cases[name]
+        cases.append({'name': name, 'records': records})
+    for rows in args.scale:
+        for branching in args.branching:
+            intents, algorithms = (int(value) for value in branching.split('x'))
+            records = scale_records(use_cases[args.template], rows, intents, algorithms)
+            cases.append({'name': f'{args.template}-{rows}-{branching}', 'records': records})
+    for case in cases:
+        case['selected'] = select_records(case['records'])
+        case['soft_constraints'] = default_soft_constraints(case['records'])
+        case['model_name'] = args.model_name
+        case['limit'] = args.limit
+    return cases
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit, 'python': platform.python_version(), 'numpy': np.__version__,
+            'pandas': pd.__version__, 'platform': platform.platform(), 'cpus': os.cpu_count()}
+
+
+def compare(report, baseline):
+    # best time of every stage relative to the baseline report, for the cases both have
+    previous = {case['case']: case for case in baseline['cases']}
+    print(f"\n{'case':<24} {'stage':<18} {'before (s)':>11} {'after (s)':>11} {'ratio':>7}", file=sys.stderr)
+    for case in report['cases']:
+        if case['case'] not in previous:
+            continue
+        for stage in STAGES + ['total']:
+            after = case['stages'][stage]['best'] if stage != 'total' else case['total']['best']
+            old = previous[case['case']]
+            before = old['stages'][stage]['best'] if stage != 'total' else old['total']['best']
+            ratio = after / before if before > 0 else float('nan')
+            print(f"{case['case']:<24} {stage:<18} {before:>11.4f} {after:>11.4f} {ratio:>7.2f}", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--use-cases', nargs='*', default=USE_CASES, help='KPI1.2 use cases replayed as they are')
+    parser.add_argument('--template', default='UC5', help='use case the synthetic cases are scaled from')
+    parser.add_argument('--scale', type=int, nargs='*', default=[100, 1_000, 10_000, 100_000],
+                        help='numbers of synthetic experiments')
+    parser.add_argument('--branching', nargs='*', default=['5x10', '20x100'],
+                        help='intents x algorithms of the synthetic cases')
+    parser.add_argument('--model-name', default='MDP_2')
+    parser.add_argument('--limit', type=int, default=100, help='page size ranked and serialized')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='write the JSON report to this file instead of stdout')
+    parser.add_argument('--compare', help='JSON report of an earlier run to compare against')
+    args = parser.parse_args()
+
+    report = {'environment': environment(), 'repeat': args.repeat, 'stages': STAGES, 'cases': []}
+    print(f"{'case':<24} {'experiments':>11} {'states':>9} {'total (s)':>10} {'peak (MB)':>10}", file=sys.stderr)
+    for case in make_cases(args):
+        result = benchmark(case, args.repeat)
+        report['cases'].append(result)
+        print(f"{result['case']:<24} {result['experiments']:>11} {result['states']:>9} "
+              f"{result['total']['best']:>10.4f} {result['total']['peak_bytes'] / 1e6:>10.1f}", file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+    if args.compare:
+        with open(args.compare) as file:
+            compare(report, json.load(file))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""Throughput of the read endpoints that forward the JSON built by Postgres, against a live database.
+
+For get_experiment, get_experiment_description_types, get_domains_with_counts and
+get_selected_experiments it times, per request:
+
+    decoded      call_function() + response_handler(data=...): psycopg2 decodes the json into Python
+                 objects that json.dumps encodes again (how the routes answered before)
+    passthrough  call_function(raw=True) + response_handler(raw_data=...): the server's text is spliced
+                 into the envelope as it is, and streamed when it is large
+    http         the route itself through the Flask test client (JWT check, hooks, passthrough)
+
+The database is the one of the DB_* environment variables and must already hold experiments (e.g. the
+KPI1.2 use cases uploaded through /experiment/add-uc5-dataset) with some search history, since
+get_selected_experiments only returns experiments that were searched. Run from the repository root:
+
+    PYTHONPATH=src python -m benchmarks.passthrough_throughput --requests 200 --output passthrough.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import statistics
+import time
+
+from flask_jwt_extended import create_access_token
+
+from src.apps.api import create_flask
+from src.apps.api.utils import response_handler
+from src.apps.database.connection import PostgreSQLConnection, get_pool
+
+
+def experiment_ids(limit):
+    # the searched experiments, which get_selected_experiments returns
+    connection = get_pool().getconn()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT DISTINCT experiment_id FROM search_history ORDER BY experiment_id LIMIT %s;", (limit,))
+            return [row[0] for row in cursor.fetchall()]
+    finally:
+        get_pool().putconn(connection)
+
+
+def endpoints(ids):
+    # name -> (function, arguments, route request arguments)
+    return {
+        'get_experiment': ('get_experiment', (ids[0],),
+                           ('GET', f'/experiment/get_experiment?experiment_id={ids[0]}', None)),
+        'get_experiment_description_types': ('get_all_experiment_description_types', (),
+                                             ('GET', '/experiment/get_experiment_description_types', None)),
+        'get_domains_with_counts': ('get_domains_with_counts', (),
+                                    ('GET', '/experiment/get_domains_with_counts', None)),
+        'get_selected_experiments': ('get_experiments_with_count', (ids,),
+                                     ('POST', '/experiment/get_selected_experiments',
+                                      json.dumps({'experiment_ids': [{'id': id} for id in ids]}))),
+    }
+
+
+def body_size(response):
+    return sum(len(chunk) for chunk in response.response) if response.is_streamed else len(response.get_data())
+
+
+def timed(function, requests):
+    # (per request seconds, bytes of the last body)
+    durations = []
+    size = 0
+    for _ in range(requests):
+        start = time.perf_counter()
+        size = function()
+        durations.append(time.perf_counter() - start)
+    return durations, size
+
+
+def summary(durations, size):
+    median = statistics.median(durations)
+    return {
+        'median_ms': round(median * 1000, 3),
+        'p95_ms': round(sorted(durations)[int(len(durations) * 0.95) - 1] * 1000, 3),
+        'requests_per_second': round(1 / median, 1),
+        'megabytes_per_second': round(size / median / 1e6, 1),
+        'body_bytes': size,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=100, help='timed requests per endpoint and path')
+    parser.add_argument('--selected', type=int, default=1000, help='experiments sent to get_selected_experiments')
+    parser.add_argument('--output', help='JSON report (default: stdout only)')
+    args = parser.parse_args()
+
+    app = create_flask()
+    client = app.test_client()
+    with app.app_context():
+        headers = {'Authorization': f'Bearer {create_access_token(identity=json.dumps({"user_id": 1}))}'}
+
+    ids = experiment_ids(args.selected)
+    if not ids:
+        parser.error("the database holds no searched experiments")
+
+    report = {'experiments_selected': len(ids), 'requests': args.requests, 'endpoints': {}}
+    for name, (function, function_args, (method, url, data)) in endpoints(ids).items():
+        def decoded():
+            value = PostgreSQLConnection().call_function(function, *function_args)
+            with app.test_request_context():
+                return body_size(response_handler(value))
+
+        def passthrough():
+            value = PostgreSQLConnection().call_function(function, *function_args, raw=True)
+            with app.test_request_context():
+                return body_size(response_handler(raw_data=value))
+
+        def http():
+            response = client.open(url, method=method, headers=headers, data=data)
+            if response.status_code != 200:
+                raise RuntimeError(f"{url} answered {response.status_code}")
+            return len(response.get_data())
+
+        results = {}
+        # the endpoints print what they return
+        with contextlib.redirect_stdout(io.StringIO()):
+            for path, function_to_time in (('decoded', decoded), ('passthrough', passthrough), ('http', http)):
+                function_to_time()
+                results[path] = summary(*timed(function_to_time, args.requests))
+        report['endpoints'][name] = results
+
+        print(f"{name} ({results['passthrough']['body_bytes']} bytes)")
+        for path, result in results.items():
+            print(f"  {path:<12} {result['median_ms']:>9.3f} ms  {result['requests_per_second']:>8.1f} req/s"
+                  f"  {result['megabytes_per_second']:>7.1f} MB/s")
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
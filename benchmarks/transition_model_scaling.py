@@ -0,0 +1,56 @@
+"""Scaling benchmark for generate_initial_transition_model.
+
+Run from the repository root:
+
+    python -m benchmarks.transition_model_scaling --rows 1000 10000 100000 1000000
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.apps.MDP import generate_initial_transition_model
+
+
+def make_experiments(rows, intents=5, algorithms=50, seed=0):
+    rng = np.random.default_rng(seed)
+    data = pd.DataFrame({
+        'experiment_id': np.arange(1, rows + 1),
+        'intent': rng.choice([f'intent_{i}' for i in range(intents)], rows),
+        'algorithm': rng.choice([f'algorithm_{i}' for i in range(algorithms)], rows),
+        'model': rng.choice([f'model_{i}' for i in range(200)], rows),
+    })
+    data['model_id'] = data['model'] + "_" + data['experiment_id'].astype(str)
+    return data
+
+
+def make_selected(data, fraction=0.1, seed=0):
+    selected_df = data.sample(frac=fraction, random_state=seed).copy()
+    selected_df['experiment_count'] = np.random.default_rng(seed).integers(1, 20, len(selected_df))
+    return selected_df
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[1_000, 10_000, 100_000, 1_000_000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    modelArchitecture = ['intent', 'algorithm', 'model_id']
+    print(f"{'rows':>10} {'states':>10} {'best (s)':>10} {'rows/s':>12}")
+    for rows in args.rows:
+        data = make_experiments(rows)
+        selected_df = make_selected(data)
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            transition_model = generate_initial_transition_model(
+                data, selected_df, feedback_df=[], modelArchitecture=modelArchitecture, modelName="MDP_2")
+            timings.append(time.perf_counter() - start)
+        best = min(timings)
+        print(f"{rows:>10} {transition_model.num_states:>10} {best:>10.3f} {rows / best:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
+-- Superseded by migrations/003_keyset_pagination.sql, which adds keyset pagination
 CREATE OR REPLACE FUNCTION get_experiments_with_count(p_experiment_ids INT[])
 RETURNS JSON AS $$
 DECLARE
@@ -1,3 +1,4 @@
+-- Superseded by migrations/001_experiment_rating_stats.sql, 002_typed_description_values.sql and 003_keyset_pagination.sql
 CREATE OR REPLACE FUNCTION get_filtered_experiments(
     p_domain VARCHAR DEFAULT NULL,
     p_intent VARCHAR DEFAULT NULL,
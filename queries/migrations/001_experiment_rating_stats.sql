@@ -0,0 +1,138 @@
+-- Per-experiment rating aggregates, kept up to date by a trigger on user_ratings so that
+-- get_filtered_experiments can return them with the candidates without aggregating per request.
+-- Safe to run more than once.
+
+CREATE TABLE IF NOT EXISTS experiment_rating_stats (
+    experiment_id INT PRIMARY KEY,
+    rating_sum FLOAT NOT NULL DEFAULT 0,
+    rating_count INT NOT NULL DEFAULT 0,
+    FOREIGN KEY (experiment_id) REFERENCES experiments(experiment_id)
+        ON DELETE CASCADE
+);
+
+CREATE OR REPLACE FUNCTION update_experiment_rating_stats()
+RETURNS TRIGGER AS $$
+BEGIN
+    -- Remove the old rating from its experiment
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.rating IS NOT NULL AND OLD.experiment_id IS NOT NULL THEN
+        UPDATE experiment_rating_stats
+        SET rating_sum = rating_sum - OLD.rating,
+            rating_count = rating_count - 1
+        WHERE experiment_id = OLD.experiment_id;
+    END IF;
+
+    -- Add the new rating to its experiment
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.rating IS NOT NULL AND NEW.experiment_id IS NOT NULL THEN
+        INSERT INTO experiment_rating_stats (experiment_id, rating_sum, rating_count)
+        VALUES (NEW.experiment_id, NEW.rating, 1)
+        ON CONFLICT (experiment_id) DO UPDATE
+        SET rating_sum = experiment_rating_stats.rating_sum + EXCLUDED.rating_sum,
+            rating_count = experiment_rating_stats.rating_count + 1;
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS user_ratings_stats_trigger ON user_ratings;
+CREATE TRIGGER user_ratings_stats_trigger
+AFTER INSERT OR UPDATE OF rating, experiment_id OR DELETE ON user_ratings
+FOR EACH ROW EXECUTE FUNCTION update_experiment_rating_stats();
+
+-- Backfill (or repair) the aggregates from the existing ratings
+INSERT INTO experiment_rating_stats (experiment_id, rating_sum, rating_count)
+SELECT ur.experiment_id, SUM(ur.rating), COUNT(ur.rating)
+FROM user_ratings ur
+JOIN experiments e ON e.experiment_id = ur.experiment_id
+WHERE ur.rating IS NOT NULL
+GROUP BY ur.experiment_id
+ON CONFLICT (experiment_id) DO UPDATE
+SET rating_sum = EXCLUDED.rating_sum,
+    rating_count = EXCLUDED.rating_count;
+
+UPDATE experiment_rating_stats s
+SET rating_sum = 0, rating_count = 0
+WHERE NOT EXISTS (
+    SELECT 1 FROM user_ratings ur
+    WHERE ur.experiment_id = s.experiment_id AND ur.rating IS NOT NULL
+);
+
+-- Same as queries/get_experiments_list.sql, plus the rating aggregates of every candidate
+-- (rewritten by 002_typed_description_values.sql)
+CREATE OR REPLACE FUNCTION get_filtered_experiments(
+    p_domain VARCHAR DEFAULT NULL,
+    p_intent VARCHAR DEFAULT NULL,
+    p_algorithm VARCHAR DEFAULT NULL,
+    p_method VARCHAR DEFAULT NULL,
+    p_description_filters JSON DEFAULT NULL -- JSON array of description_type_id, value, and comparison_type
+) RETURNS JSON AS $$
+BEGIN
+    RETURN (
+        SELECT COALESCE(json_agg(
+            json_build_object(
+                'experiment_id', e.experiment_id,
+                'title', e.title,
+                'domain', e.domain,
+                'intent', e.intent,
+                'algorithm', e.algorithm,
+                'method', e.method,
+                'model', e.model,
+                'status', e.status,
+                'date', e.date,
+                'rating_mean', CASE WHEN rs.rating_count > 0 THEN rs.rating_sum / rs.rating_count END,
+                'rating_count', COALESCE(rs.rating_count, 0),
+                'descriptions', (
+                    SELECT COALESCE(json_agg(
+                        json_build_object(
+                            'name', edt.name,
+                            'value', ed.value,
+                            'type', edt.type
+                        )
+                    ), '[]'::JSON)
+                    FROM experiment_descriptions ed
+                    INNER JOIN experiment_description_types edt
+                        ON ed.description_type_id = edt.description_type_id
+                    WHERE ed.experiment_id = e.experiment_id
+                )
+            )
+        ), '[]'::JSON) -- Ensure empty array instead of NULL
+        FROM experiments e
+        LEFT JOIN experiment_rating_stats rs ON rs.experiment_id = e.experiment_id
+        WHERE 
+            (e.status = 'active') AND
+            (p_domain IS NULL OR e.domain = p_domain) AND
+            (p_intent IS NULL OR e.intent = p_intent) AND
+            (p_algorithm IS NULL OR e.algorithm = p_algorithm) AND
+            (p_method IS NULL OR e.method = p_method) AND
+            (
+                p_description_filters IS NULL OR NOT EXISTS (
+                    SELECT 1
+                    FROM json_array_elements(p_description_filters) AS filter
+                    WHERE NOT EXISTS (
+                        SELECT 1
+                        FROM experiment_descriptions ed
+                        WHERE ed.experiment_id = e.experiment_id
+                          AND ed.description_type_id = (filter->>'description_type_id')::INT
+                          AND (
+                              -- Compare numerical values
+                              CASE 
+                                  WHEN (filter->>'comparison_type') = 'numerical' THEN
+                                      CASE
+                                          WHEN (filter->>'operator') = '>=' THEN ed.value::NUMERIC >= (filter->>'value')::NUMERIC
+                                          WHEN (filter->>'operator') = '<=' THEN ed.value::NUMERIC <= (filter->>'value')::NUMERIC
+                                          WHEN (filter->>'operator') = '=' THEN ed.value::NUMERIC = (filter->>'value')::NUMERIC
+                                          ELSE FALSE
+                                      END
+                                  -- Compare categorical values
+                                  WHEN (filter->>'comparison_type') = 'categorical' THEN
+                                      ed.value = (filter->>'value')
+                                  ELSE
+                                      FALSE
+                              END
+                          )
+                    )
+                )
+            )
+    );
+END;
+$$ LANGUAGE plpgsql;
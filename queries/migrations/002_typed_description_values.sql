@@ -0,0 +1,141 @@
+-- Typed numeric copy of the description values, the indexes of the call_mdp filters, and a
+-- get_filtered_experiments that only writes the conditions it was given, so that each hard
+-- constraint can be planned as an index range scan instead of casting every VARCHAR value.
+-- Safe to run more than once.
+
+-- The number a description value holds, NULL when it is not one (where ::NUMERIC would raise)
+CREATE OR REPLACE FUNCTION description_numeric_value(p_value VARCHAR)
+RETURNS NUMERIC AS $$
+    SELECT CASE
+        WHEN p_value ~ '^\s*[-+]?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][-+]?[0-9]{1,3})?\s*$' THEN p_value::NUMERIC
+    END;
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE;
+
+-- Kept in step with value by Postgres itself, so the writers of experiment_descriptions do not change
+ALTER TABLE experiment_descriptions
+    ADD COLUMN IF NOT EXISTS numeric_value NUMERIC
+    GENERATED ALWAYS AS (description_numeric_value(value)) STORED;
+
+-- Descriptions of one experiment (and the per-experiment lookups of the filter)
+CREATE INDEX IF NOT EXISTS experiment_descriptions_experiment_type_idx
+    ON experiment_descriptions (experiment_id, description_type_id);
+
+-- Numerical hard constraints: range scan on (type, value)
+CREATE INDEX IF NOT EXISTS experiment_descriptions_type_numeric_idx
+    ON experiment_descriptions (description_type_id, numeric_value, experiment_id)
+    WHERE numeric_value IS NOT NULL;
+
+-- Categorical hard constraints: equality on (type, value)
+CREATE INDEX IF NOT EXISTS experiment_descriptions_type_value_idx
+    ON experiment_descriptions (description_type_id, value, experiment_id);
+
+-- Only active experiments are ever candidates
+CREATE INDEX IF NOT EXISTS experiments_active_filter_idx
+    ON experiments (domain, intent, algorithm, method)
+    WHERE status = 'active';
+
+ANALYZE experiments;
+ANALYZE experiment_descriptions;
+
+-- The candidate query of get_filtered_experiments for these arguments, with the given
+-- filters written in as literals (EXPLAIN it to see the plan a call_mdp request gets)
+CREATE OR REPLACE FUNCTION filtered_experiments_query(
+    p_domain VARCHAR DEFAULT NULL,
+    p_intent VARCHAR DEFAULT NULL,
+    p_algorithm VARCHAR DEFAULT NULL,
+    p_method VARCHAR DEFAULT NULL,
+    p_description_filters JSON DEFAULT NULL -- JSON array of description_type_id, value, and comparison_type
+) RETURNS TEXT AS $$
+DECLARE
+    v_conditions TEXT := '';
+    v_filter JSON;
+    v_operator TEXT;
+BEGIN
+    IF p_domain IS NOT NULL THEN
+        v_conditions := v_conditions || format(' AND e.domain = %L', p_domain);
+    END IF;
+    IF p_intent IS NOT NULL THEN
+        v_conditions := v_conditions || format(' AND e.intent = %L', p_intent);
+    END IF;
+    IF p_algorithm IS NOT NULL THEN
+        v_conditions := v_conditions || format(' AND e.algorithm = %L', p_algorithm);
+    END IF;
+    IF p_method IS NOT NULL THEN
+        v_conditions := v_conditions || format(' AND e.method = %L', p_method);
+    END IF;
+
+    -- Every hard constraint must be met by one of the experiment's descriptions
+    IF p_description_filters IS NOT NULL THEN
+        FOR v_filter IN SELECT * FROM json_array_elements(p_description_filters) LOOP
+            v_operator := v_filter->>'operator';
+            IF (v_filter->>'comparison_type') = 'numerical' AND v_operator IN ('>=', '<=', '=') THEN
+                v_conditions := v_conditions || format(
+                    ' AND EXISTS (SELECT 1 FROM experiment_descriptions ed'
+                    ' WHERE ed.experiment_id = e.experiment_id AND ed.description_type_id = %L'
+                    ' AND ed.numeric_value %s %L)',
+                    (v_filter->>'description_type_id')::INT, v_operator, (v_filter->>'value')::NUMERIC);
+            ELSIF (v_filter->>'comparison_type') = 'categorical' THEN
+                v_conditions := v_conditions || format(
+                    ' AND EXISTS (SELECT 1 FROM experiment_descriptions ed'
+                    ' WHERE ed.experiment_id = e.experiment_id AND ed.description_type_id = %L'
+                    ' AND ed.value = %L)',
+                    (v_filter->>'description_type_id')::INT, v_filter->>'value');
+            ELSE
+                -- Unknown comparisons or operators match nothing
+                v_conditions := v_conditions || ' AND FALSE';
+            END IF;
+        END LOOP;
+    END IF;
+
+    RETURN $query$
+        SELECT COALESCE(json_agg(
+            json_build_object(
+                'experiment_id', e.experiment_id,
+                'title', e.title,
+                'domain', e.domain,
+                'intent', e.intent,
+                'algorithm', e.algorithm,
+                'method', e.method,
+                'model', e.model,
+                'status', e.status,
+                'date', e.date,
+                'rating_mean', CASE WHEN rs.rating_count > 0 THEN rs.rating_sum / rs.rating_count END,
+                'rating_count', COALESCE(rs.rating_count, 0),
+                'descriptions', (
+                    SELECT COALESCE(json_agg(
+                        json_build_object(
+                            'name', edt.name,
+                            'value', ed.value,
+                            'type', edt.type
+                        )
+                    ), '[]'::JSON)
+                    FROM experiment_descriptions ed
+                    INNER JOIN experiment_description_types edt
+                        ON ed.description_type_id = edt.description_type_id
+                    WHERE ed.experiment_id = e.experiment_id
+                )
+            )
+        ), '[]'::JSON) -- Ensure empty array instead of NULL
+        FROM experiments e
+        LEFT JOIN experiment_rating_stats rs ON rs.experiment_id = e.experiment_id
+        WHERE e.status = 'active'$query$ || v_conditions;
+END;
+$$ LANGUAGE plpgsql STABLE;
+
+-- Same results as migrations/001_experiment_rating_stats.sql, planned per call for the given filters
+-- (paginated by 003_keyset_pagination.sql)
+CREATE OR REPLACE FUNCTION get_filtered_experiments(
+    p_domain VARCHAR DEFAULT NULL,
+    p_intent VARCHAR DEFAULT NULL,
+    p_algorithm VARCHAR DEFAULT NULL,
+    p_method VARCHAR DEFAULT NULL,
+    p_description_filters JSON DEFAULT NULL -- JSON array of description_type_id, value, and comparison_type
+) RETURNS JSON AS $$
+DECLARE
+    v_result JSON;
+BEGIN
+    EXECUTE filtered_experiments_query(p_domain, p_intent, p_algorithm, p_method, p_description_filters)
+    INTO v_result;
+    RETURN v_result;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,213 @@
+-- Keyset pagination for get_filtered_experiments and get_experiments_with_count: pages in
+-- experiment_id order, p_after_id being the last experiment_id of the previous page. Both are
+-- built on one-row-per-experiment queries, which the API reads through server-side cursors in
+-- fixed-size batches instead of receiving one json_agg value. Safe to run more than once.
+
+-- Calls without the new arguments would be ambiguous between the old and the new signatures
+DROP FUNCTION IF EXISTS get_filtered_experiments(VARCHAR, VARCHAR, VARCHAR, VARCHAR, JSON);
+DROP FUNCTION IF EXISTS filtered_experiments_query(VARCHAR, VARCHAR, VARCHAR, VARCHAR, JSON);
+DROP FUNCTION IF EXISTS get_experiments_with_count(INT[]);
+
+-- Counting the searches of the selected experiments
+CREATE INDEX IF NOT EXISTS search_history_experiment_idx
+    ON search_history (experiment_id);
+
+-- The WHERE conditions on experiments e after status = 'active', with the given filters written in as literals
+CREATE OR REPLACE FUNCTION filtered_experiments_conditions(
+    p_domain VARCHAR DEFAULT NULL,
+    p_intent VARCHAR DEFAULT NULL,
+    p_algorithm VARCHAR DEFAULT NULL,
+    p_method VARCHAR DEFAULT NULL,
+    p_description_filters JSON DEFAULT NULL -- JSON array of description_type_id, value, and comparison_type
+) RETURNS TEXT AS $$
+DECLARE
+    v_conditions TEXT := '';
+    v_filter JSON;
+    v_operator TEXT;
+BEGIN
+    IF p_domain IS NOT NULL THEN
+        v_conditions := v_conditions || format(' AND e.domain = %L', p_domain);
+    END IF;
+    IF p_intent IS NOT NULL THEN
+        v_conditions := v_conditions || format(' AND e.intent = %L', p_intent);
+    END IF;
+    IF p_algorithm IS NOT NULL THEN
+        v_conditions := v_conditions || format(' AND e.algorithm = %L', p_algorithm);
+    END IF;
+    IF p_method IS NOT NULL THEN
+        v_conditions := v_conditions || format(' AND e.method = %L', p_method);
+    END IF;
+
+    -- Every hard constraint must be met by one of the experiment's descriptions (a JSON null means none)
+    IF p_description_filters IS NOT NULL AND json_typeof(p_description_filters) = 'array' THEN
+        FOR v_filter IN SELECT * FROM json_array_elements(p_description_filters) LOOP
+            v_operator := v_filter->>'operator';
+            IF (v_filter->>'comparison_type') = 'numerical' AND v_operator IN ('>=', '<=', '=') THEN
+                v_conditions := v_conditions || format(
+                    ' AND EXISTS (SELECT 1 FROM experiment_descriptions ed'
+                    ' WHERE ed.experiment_id = e.experiment_id AND ed.description_type_id = %L'
+                    ' AND ed.numeric_value %s %L)',
+                    (v_filter->>'description_type_id')::INT, v_operator, (v_filter->>'value')::NUMERIC);
+            ELSIF (v_filter->>'comparison_type') = 'categorical' THEN
+                v_conditions := v_conditions || format(
+                    ' AND EXISTS (SELECT 1 FROM experiment_descriptions ed'
+                    ' WHERE ed.experiment_id = e.experiment_id AND ed.description_type_id = %L'
+                    ' AND ed.value = %L)',
+                    (v_filter->>'description_type_id')::INT, v_filter->>'value');
+            ELSE
+                -- Unknown comparisons or operators match nothing
+                v_conditions := v_conditions || ' AND FALSE';
+            END IF;
+        END LOOP;
+    END IF;
+
+    RETURN v_conditions;
+END;
+$$ LANGUAGE plpgsql STABLE;
+
+-- One (experiment_id, experiment) row per candidate, in experiment_id order: the query the API
+-- streams through a server-side cursor
+CREATE OR REPLACE FUNCTION filtered_experiment_rows_query(
+    p_domain VARCHAR DEFAULT NULL,
+    p_intent VARCHAR DEFAULT NULL,
+    p_algorithm VARCHAR DEFAULT NULL,
+    p_method VARCHAR DEFAULT NULL,
+    p_description_filters JSON DEFAULT NULL, -- JSON array of description_type_id, value, and comparison_type
+    p_after_id INT DEFAULT NULL, -- only experiments after this experiment_id
+    p_limit INT DEFAULT NULL -- at most this many experiments (all of them when NULL)
+) RETURNS TEXT AS $$
+BEGIN
+    RETURN $query$
+        SELECT
+            e.experiment_id,
+            json_build_object(
+                'experiment_id', e.experiment_id,
+                'title', e.title,
+                'domain', e.domain,
+                'intent', e.intent,
+                'algorithm', e.algorithm,
+                'method', e.method,
+                'model', e.model,
+                'status', e.status,
+                'date', e.date,
+                'rating_mean', CASE WHEN rs.rating_count > 0 THEN rs.rating_sum / rs.rating_count END,
+                'rating_count', COALESCE(rs.rating_count, 0),
+                'descriptions', (
+                    SELECT COALESCE(json_agg(
+                        json_build_object(
+                            'name', edt.name,
+                            'value', ed.value,
+                            'type', edt.type
+                        )
+                    ), '[]'::JSON)
+                    FROM experiment_descriptions ed
+                    INNER JOIN experiment_description_types edt
+                        ON ed.description_type_id = edt.description_type_id
+                    WHERE ed.experiment_id = e.experiment_id
+                )
+            ) AS experiment
+        FROM experiments e
+        LEFT JOIN experiment_rating_stats rs ON rs.experiment_id = e.experiment_id
+        WHERE e.status = 'active'$query$
+        || filtered_experiments_conditions(p_domain, p_intent, p_algorithm, p_method, p_description_filters)
+        || CASE WHEN p_after_id IS NOT NULL THEN format(' AND e.experiment_id > %L', p_after_id) ELSE '' END
+        || ' ORDER BY e.experiment_id'
+        || CASE WHEN p_limit IS NOT NULL THEN format(' LIMIT %L', p_limit) ELSE '' END;
+END;
+$$ LANGUAGE plpgsql STABLE;
+
+-- The query of get_filtered_experiments for these arguments (EXPLAIN it to see the plan a call_mdp request gets)
+CREATE OR REPLACE FUNCTION filtered_experiments_query(
+    p_domain VARCHAR DEFAULT NULL,
+    p_intent VARCHAR DEFAULT NULL,
+    p_algorithm VARCHAR DEFAULT NULL,
+    p_method VARCHAR DEFAULT NULL,
+    p_description_filters JSON DEFAULT NULL,
+    p_after_id INT DEFAULT NULL,
+    p_limit INT DEFAULT NULL
+) RETURNS TEXT AS $$
+BEGIN
+    RETURN 'SELECT COALESCE(json_agg(page.experiment ORDER BY page.experiment_id), ''[]''::JSON) FROM ('
+        || filtered_experiment_rows_query(p_domain, p_intent, p_algorithm, p_method, p_description_filters, p_after_id, p_limit)
+        || ') AS page';
+END;
+$$ LANGUAGE plpgsql STABLE;
+
+-- Same results as migrations/002_typed_description_values.sql, in experiment_id order, one page at a time when
+-- p_limit is given
+CREATE OR REPLACE FUNCTION get_filtered_experiments(
+    p_domain VARCHAR DEFAULT NULL,
+    p_intent VARCHAR DEFAULT NULL,
+    p_algorithm VARCHAR DEFAULT NULL,
+    p_method VARCHAR DEFAULT NULL,
+    p_description_filters JSON DEFAULT NULL, -- JSON array of description_type_id, value, and comparison_type
+    p_after_id INT DEFAULT NULL, -- only experiments after this experiment_id
+    p_limit INT DEFAULT NULL -- at most this many experiments (all of them when NULL)
+) RETURNS JSON AS $$
+DECLARE
+    v_result JSON;
+BEGIN
+    EXECUTE filtered_experiments_query(p_domain, p_intent, p_algorithm, p_method, p_description_filters, p_after_id, p_limit)
+    INTO v_result;
+    RETURN v_result;
+END;
+$$ LANGUAGE plpgsql;
+
+-- One (experiment_id, experiment) row per selected experiment that was searched, in experiment_id order
+CREATE OR REPLACE FUNCTION experiments_with_count_rows(
+    p_experiment_ids INT[],
+    p_after_id INT DEFAULT NULL, -- only experiments after this experiment_id
+    p_limit INT DEFAULT NULL -- at most this many experiments (all of them when NULL)
+) RETURNS TABLE (experiment_id INT, experiment JSON) AS $$
+    SELECT
+        e.experiment_id,
+        json_build_object(
+            'experiment_id', e.experiment_id,
+            'user_id', e.user_id,
+            'title', e.title,
+            'domain', e.domain,
+            'intent', e.intent,
+            'algorithm', e.algorithm,
+            'method', e.method,
+            'model', e.model,
+            'status', e.status,
+            'date', e.date,
+            'descriptions', COALESCE((
+                SELECT json_agg(
+                    json_build_object(
+                        'value', ed.value,
+                        'name', edt.name,
+                        'type', edt.type
+                    )
+                )
+                FROM experiment_descriptions ed
+                JOIN experiment_description_types edt
+                ON ed.description_type_id = edt.description_type_id
+                WHERE ed.experiment_id = e.experiment_id
+            ), '[]'::JSON),
+            'experiment_count', c.experiment_count
+        )
+    FROM (
+        -- Count the occurrences of each experiment_id in search_history
+        SELECT sh.experiment_id, COUNT(*) AS experiment_count
+        FROM search_history sh
+        WHERE sh.experiment_id = ANY (p_experiment_ids)
+          AND (p_after_id IS NULL OR sh.experiment_id > p_after_id)
+        GROUP BY sh.experiment_id
+    ) c
+    JOIN experiments e ON e.experiment_id = c.experiment_id
+    WHERE e.status != 'deleted'
+    ORDER BY e.experiment_id
+    LIMIT p_limit;
+$$ LANGUAGE sql STABLE;
+
+-- Same as queries/get_experiment_count_by_ids.sql, in experiment_id order, one page at a time when p_limit is given
+CREATE OR REPLACE FUNCTION get_experiments_with_count(
+    p_experiment_ids INT[],
+    p_after_id INT DEFAULT NULL,
+    p_limit INT DEFAULT NULL
+) RETURNS JSON AS $$
+    -- NULL when none of them was searched
+    SELECT json_agg(r.experiment ORDER BY r.experiment_id)
+    FROM experiments_with_count_rows(p_experiment_ids, p_after_id, p_limit) r;
+$$ LANGUAGE sql STABLE;
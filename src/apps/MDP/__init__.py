@@ -1,3 +1,5 @@
 from .policy_iteration import PolicyIteration
 from .graph_world import GraphWorld
 from .initial_transition_generator import generate_initial_transition_model
+from .transition_model import TransitionModel
+from .maintained_graph import MaintainedGraph
\ No newline at end of file
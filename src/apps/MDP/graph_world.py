@@ -1,75 +1,128 @@
+import copy
+
 import numpy as np
 import pandas as pd
 import networkx as nx
 import matplotlib.pyplot as plt
 
+from .initial_transition_generator import encode_level
+
 class GraphWorld():
     def __init__(
             self,
             data, 
             modelArchitecture,
-            probability_file_name,
+            transition_model,
             constraints,
             reward_values
         ):
 
-        print("REWARD_VALUES:", reward_values)
-
-        self.data = data.sort_values(modelArchitecture[-1])
-        self.probability_matrix = pd.read_csv(probability_file_name , index_col=0)
-        self.num_states = self.probability_matrix.shape[0]
+        self.data = data
         self.modelArchitecture = modelArchitecture
+        self.transition_model = transition_model
+        # struct of arrays: per state its level and reward (utilities once solved);
+        # leaves point at a row of data instead of holding a copy of it
+        self.level_values, level_codes = self.__encode_levels__()
+        self.level_offsets = np.concatenate(([0], np.cumsum([len(values) for values in self.level_values])))
         self.inner_node_num = self.__get_inner_nodes_num__()
-        self.reward_function = self.get_reward_function(self.data , constraints , reward_values)
-        self.transition_model = self.probability_matrix.to_numpy()
-        
-        # self.states = self.__get_states__()
-        self.states = self.__create_graph__()
-        self.leafs = self.__get_leafs__()
-
-    def __create_graph__(self):
-        graph_states = []
-        item_count = 0
-        for i in range(len(self.modelArchitecture)):
-            column = self.modelArchitecture[i]
-            columns_values = list(self.data[column].value_counts().index)
-            columns_values.sort(key=str.lower)
-            for value in columns_values:
-                children = None
-                type_ = column
-                data_ = None
-                if i < len(self.modelArchitecture) - 1:
-                    children = self.data[self.modelArchitecture[i+1]][self.data[self.modelArchitecture[i]] == value].value_counts().keys().to_numpy()
-                else:    
-                    data_ = self.data[self.data[column] == value].iloc[0]
-                state = GraphState(
-                    item_count,
-                    children if children is not None else [],
-                    value,
-                    reward=self.reward_function[item_count],
-                    type_ = type_,
-                    data=data_,)
-                graph_states.append(state)
-                item_count += 1            
-        for state in graph_states:
-            children_states = []
-            for child in state.children:
-                for s in graph_states:
-                    if s.value == child:
-                        children_states.append(s)
-                        break
-            state.children = children_states
-        return graph_states
-    
-    def __get_inner_nodes_num__(self):
-        inner_node_num = 0
-        for i in range(len(self.modelArchitecture)-1):
-            children = list(self.data[self.modelArchitecture[i]].value_counts().index)
-            inner_node_num += len(children)
-        return inner_node_num
+        self.num_states = self.transition_model.num_states
+        self.levels = np.repeat(np.arange(len(self.level_values)), np.diff(self.level_offsets))
+        # first source row of every leaf, in leaf state order
+        self.leaf_rows = self.__get_first_rows__(level_codes[-1])
+        self.leaf_paths = self.__get_leaf_paths__(level_codes)
+        self.reward_function = self.get_reward_function(self.data.iloc[self.leaf_rows] , constraints , reward_values)
+        self.utility_values = np.zeros(self.num_states)
+        self.path_utility_values = np.zeros(self.num_states - self.inner_node_num)
+        self.__level_bytes = None
+
+    @property
+    def states(self):
+        return GraphStates(self, 0, self.num_states)
+
+    @property
+    def leafs(self):
+        return GraphStates(self, self.inner_node_num, self.num_states)
+
+    def __encode_levels__(self):
+        level_values, level_codes = [], []
+        for i, column in enumerate(self.modelArchitecture):
+            if self.transition_model.levels is not None:
+                values = self.transition_model.levels[i]
+                codes = values.get_indexer(self.data[column])
+            else:
+                values, codes = encode_level(self.data[column])
+            level_values.append(values)
+            level_codes.append(codes)
+        return level_values, level_codes
+
+    def __get_first_rows__(self, codes):
+        rows = np.flatnonzero(codes >= 0)
+        _, first = np.unique(codes[rows], return_index=True)
+        return rows[first]
+
+    def get_leaf_rows(self, data):
+        # first row of every leaf in another frame over the same candidates (e.g. a cache hit)
+        codes = self.level_values[-1].get_indexer(data[self.modelArchitecture[-1]])
+        rows = np.flatnonzero(codes >= 0)
+        leaf_codes, first = np.unique(codes[rows], return_index=True)
+        if len(leaf_codes) != len(self.level_values[-1]):
+            raise ValueError("The data does not contain every leaf of the graph!")
+        return rows[first]
 
-    def __get_leafs__(self):
-        return [state for state in self.states if state.get_type() == self.modelArchitecture[-1]]
+    def with_transition_model(self, transition_model):
+        # same graph over a re-weighted transition model (e.g. after new clicks); this one stays untouched
+        graph_world = copy.copy(self)
+        graph_world.transition_model = transition_model
+        return graph_world
+
+    def without_descriptions(self):
+        # copy to keep in a cache: of the rows only their architecture values are kept, as codes into the
+        # level values (the rewards and the response are made from each request's own rows)
+        graph_world = copy.copy(self)
+        graph_world.data = pd.DataFrame(
+            {column: pd.Categorical.from_codes(values.get_indexer(self.data[column]), categories=values)
+             for column, values in zip(self.modelArchitecture, self.level_values)},
+            index=self.data.index)
+        return graph_world
+
+    @property
+    def nbytes(self):
+        # footprint used to bound the solver cache; the level values (the only strings) are measured once
+        if self.__level_bytes is None:
+            self.__level_bytes = sum(int(values.memory_usage(deep=True)) for values in self.level_values)
+        arrays = [self.leaf_rows, self.leaf_paths, self.levels, self.reward_function, self.level_offsets,
+                  self.utility_values, self.path_utility_values]
+        # categorical rows share their strings with the level values
+        deep = any(dtype == object for dtype in self.data.dtypes)
+        return (self.transition_model.nbytes
+                + sum(array.nbytes for array in arrays)
+                + self.__level_bytes
+                + int(self.data.memory_usage(index=True, deep=deep).sum()))
+
+    def __get_leaf_paths__(self, level_codes):
+        # (levels x leaves) state of every level on the path of each leaf, read from the leaf's own row
+        # (-1 where the row has no value at that level); a state may be shared by several paths
+        codes = np.stack([codes[self.leaf_rows] for codes in level_codes])
+        return np.where(codes >= 0, codes + self.level_offsets[:-1, None], -1)
+
+    def get_state_key(self, column, value):
+        # level-qualified lookup: the same name may be used by an intent, an algorithm and a model
+        i = self.modelArchitecture.index(column)
+        return int(self.level_offsets[i]) + self.level_values[i].get_loc(value)
+
+    def get_children(self, key):
+        children, _ = self.transition_model.row(key)
+        return children[children != key]
+
+    def get_value(self, key):
+        i = self.levels[key]
+        return self.level_values[i][key - self.level_offsets[i]]
+
+    def get_leaf_data(self, key):
+        return self.data.iloc[self.leaf_rows[key - self.inner_node_num]]
+
+    def __get_inner_nodes_num__(self):
+        return int(self.level_offsets[-2]) if len(self.modelArchitecture) > 1 else 0
 
 
     def __get_tree_structure__(self):
@@ -92,28 +145,9 @@ class GraphWorld():
         return tree_structure
 
     def get_inner_nodes(self):
-        inner_nodes = []
-        for state in self.states:
-            if state.get_type() is not self.modelArchitecture[-1] \
-            and  state.get_type() is not self.modelArchitecture[0]:
-                    inner_nodes.append(state)    
-        return inner_nodes
-
-    def __get_states__(self):
-#        inner_node_num = self.num_states - len(self.data)
-        states_array = []
-        i, c = np.where(self.probability_matrix.apply(lambda x: x != 0))
-        print(len(i), len(c))
-        a = list(zip(i, c))
-        a = [(int(i) , int(j)) for (i , j) in a ]
-        
-        for item in range(self.num_states):
-            value = None if item < self.__get_inner_nodes_num__() else self.data.iloc[item-self.__get_inner_nodes_num__()]
-            reward = self.reward_function[item]
-            state = GraphState(item , [ j for ( i , j) in a if i == item] , value , reward)
-            states_array.append(state)
-        
-        return states_array
+        # states strictly between the first and the last level
+        first_inner = int(self.level_offsets[1]) if len(self.modelArchitecture) > 1 else 0
+        return GraphStates(self, first_inner, self.inner_node_num)
 
     def get_reward_function(self , data , constraints , reward_values):
         #inner_node_num = self.num_states - len(data)
@@ -125,27 +159,35 @@ class GraphWorld():
         return reward_function
     
 
-    def rewards_num_calc(self , data, constraints=(None, None), rewards=(0, 1)):
-        data = np.array(data, dtype=float)
-        if constraints[0] is None:
-            constraints = (data.min(), constraints[1])
-        if constraints[1] is None:
-            constraints = (constraints[0], data.max())
-
-        reward_array = np.full(len(data), rewards[0], dtype=float)
-        reward_array[(data >= constraints[0]) & (data <= constraints[1])] = rewards[1]
+    def get_reward_matrix(self , profiles, leaf_data=None):
+        # one reward column per (constraints, reward_values) profile, in state order
+        if leaf_data is None:
+            leaf_data = self.data.iloc[self.leaf_rows]
+        return np.column_stack(
+            [self.get_reward_function(leaf_data , constraints , reward_values) for constraints, reward_values in profiles])
 
-        return reward_array
-
-    def rewards_cat_calc(self , data, categories=None, rewards=(0, 1)):
-        data = np.array(data, dtype=str)
-        reward_array = np.full(len(data), rewards[0], dtype=float)
-        reward_array[np.isin(data, categories)] = rewards[1]
-        return reward_array
+    def numeric_column(self , column):
+        if pd.api.types.is_float_dtype(column.dtype):
+            return column.to_numpy()
+        return pd.to_numeric(column.astype(object), errors='coerce').to_numpy(dtype='float64')
 
+    def category_matches(self , column, category):
+        # rows equal to the category: a code comparison on categorical columns, a numeric one on float columns
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            if category not in column.cat.categories:
+                return np.zeros(len(column), dtype=bool)
+            return column.cat.codes.to_numpy() == column.cat.categories.get_loc(category)
+        if pd.api.types.is_float_dtype(column.dtype):
+            try:
+                return column.to_numpy() == float(category)
+            except ValueError:
+                return np.zeros(len(column), dtype=bool)
+        return np.asarray(column, dtype=str) == category
 
     def get_rewards(self , data, constraints=None, reward_values=None):
-        cumulative_rewards = np.zeros(len(data))
+        # every soft constraint in one pass: a (rows x constraints) matrix of matches, then one weighted sum.
+        # Numeric bounds left as None are unbounded.
+        matches, lower, upper = [], [], []
         for col in data.columns:
             if col in constraints:
                 constraint = constraints.get(col)
@@ -153,66 +195,144 @@ class GraphWorld():
                     continue
                 reward = reward_values.get(col, (0, 1))
 
-                print("Processing column:", constraint, "with reward:", isinstance(constraint, str))
                 if isinstance(constraint, str):  # Categorical constraint
-                    cumulative_rewards += self.rewards_cat_calc(data[col], categories=[constraint], rewards=reward)
+                    matches.append(self.category_matches(data[col], constraint))
                 elif isinstance(constraint, tuple) and len(constraint) == 2:  # Numeric constraint
-                    cumulative_rewards += self.rewards_num_calc(data[col], constraints=constraint, rewards=reward)
+                    values = self.numeric_column(data[col])
+                    minimum = -np.inf if constraint[0] is None else float(constraint[0])
+                    maximum = np.inf if constraint[1] is None else float(constraint[1])
+                    matches.append((values >= minimum) & (values <= maximum))
                 else:
                     raise ValueError(f"Invalid constraint for column {col}: {constraint}")
+                lower.append(reward[0])
+                upper.append(reward[1])
 
-        return cumulative_rewards
+        if len(matches) == 0:
+            return np.zeros(len(data))
+        return np.where(np.column_stack(matches), upper, lower).astype('float64').sum(axis=1)
 
     def set_utility_values(self , utility_values):
         if len(utility_values) != self.num_states:
             raise ValueError(f"The length of the utility_values array and states array are not the same!")
-        for item in self.states:
-            item.utility_value = utility_values[item.key]
+        self.utility_values = np.asarray(utility_values, dtype='float64')
 
     def set_path_utility(self , path_utility):
         if len(path_utility) != len(self.leafs):
             raise ValueError(f"The length of the utility_values array and states array are not the same!")
-        counter = 0
-        for item in self.leafs:
-            item.utility_path = path_utility[counter]
-            counter += 1
+        self.path_utility_values = np.asarray(path_utility, dtype='float64')
+
+    def rank_leafs(self, limit=None, offset=0, scores=None):
+        # leaf positions ordered by descending path utility (ties keep state order), without a full sort when
+        # only the first offset + limit are needed
+        if scores is None:
+            scores = self.path_utility_values
+        total = len(scores)
+        end = total if limit is None else min(offset + limit, total)
+        if end <= offset:
+            return np.array([], dtype=np.int64)
+        if end < total:
+            kth = np.partition(scores, total - end)[total - end]
+            candidates = np.flatnonzero(scores >= kth)
+        else:
+            candidates = np.arange(total)
+        ranked = candidates[np.lexsort((candidates, -scores[candidates]))]
+        return ranked[offset:end]
+
+    def get_ranked_leafs(self, limit=None, offset=0):
+        # views over the requested page of leaves; their data is read from the source rows on access
+        leafs = self.leafs
+        return [leafs[i] for i in self.rank_leafs(limit, offset)]
 
 
     def set_states_rewards(self , reward_function):
         if len(reward_function) != self.num_states:
             raise ValueError(f"The length of the reward array and states array are not the same!")
-        
-        for item in self.states:
-            item.reward = reward_function[item.key]
-    
+        self.reward_function = np.asarray(reward_function, dtype='float64')
+
+
+class GraphStates():
+    # read-only sequence of GraphState views over a range of state keys
+    def __init__(self, graph, start, stop):
+        self.graph = graph
+        self.start = start
+        self.stop = stop
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            return GraphStates(self.graph, self.start + start, self.start + max(start, stop))
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("state index out of range")
+        return GraphState(self.graph, self.start + int(index))
+
+    def __iter__(self):
+        for key in range(self.start, self.stop):
+            yield GraphState(self.graph, key)
+
 class GraphState():
-    def __init__(
-            self,key,
-            children,
-            value : pd.Series = None,
-            reward = None, 
-            type_ = None,
-            utility_value = 0.0, 
-            utility_path=0.0,
-            data=None,
-        ):
-        self.children = children
-        self.key = key  
-        self.reward = reward
-        self.utility_value = utility_value
-        self.utility_path = utility_path
-        self.value = value
-        self.type_ = type_
-        self.data = data
+    # view of one state of a GraphWorld; the values live in the graph's arrays
+    __slots__ = ('graph', 'key')
+
+    def __init__(self, graph, key):
+        self.graph = graph
+        self.key = key
+
+    @property
+    def children(self):
+        return [GraphState(self.graph, int(key)) for key in self.graph.get_children(self.key)]
+
+    @property
+    def value(self):
+        return self.graph.get_value(self.key)
+
+    @property
+    def type_(self):
+        return self.graph.modelArchitecture[self.graph.levels[self.key]]
+
+    @property
+    def reward(self):
+        return self.graph.reward_function[self.key]
+
+    @property
+    def utility_value(self):
+        return self.graph.utility_values[self.key]
+
+    @utility_value.setter
+    def utility_value(self, value):
+        self.graph.utility_values[self.key] = value
+
+    @property
+    def utility_path(self):
+        if self.key < self.graph.inner_node_num:
+            return 0.0
+        return self.graph.path_utility_values[self.key - self.graph.inner_node_num]
+
+    @utility_path.setter
+    def utility_path(self, value):
+        self.graph.path_utility_values[self.key - self.graph.inner_node_num] = value
+
+    @property
+    def data(self):
+        if self.key < self.graph.inner_node_num:
+            return None
+        return self.graph.get_leaf_data(self.key)
 
     def get_action_number(self):
-        return len(self.children)
+        return len(self.graph.get_children(self.key))
     
     def get_type(self):
         return self.type_
 
     def __str__(self):
-        return str(self.__dict__)
+        return str({"key": self.key, "value": self.value, "type_": self.type_, "reward": self.reward,
+                    "utility_value": self.utility_value, "utility_path": self.utility_path})
     
 
     def __lt__(self, other):
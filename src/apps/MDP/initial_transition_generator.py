@@ -1,96 +1,262 @@
+import copy
+
 import numpy as np
-import pandas as pd 
+import pandas as pd
+
+from .transition_model import TransitionModel
 
 
-def generate_initial_transition_model(data: pd.DataFrame, 
+def generate_initial_transition_model(data: pd.DataFrame,
                                     selected_df : pd.DataFrame,
                                     feedback_df: pd.DataFrame,
                                     modelArchitecture :list,
-                                    file_name: str = "data/graph_world00.csv",
+                                    file_name: str = None,
                                     modelName: str = "MDP_3"):
-    
+
+    # states are laid out level by level, each level sorted case-insensitively
     data_array = []
-    state_pos_dic = {}
+    data_codes = []
+    offsets = []
     pos = 0
     for item in modelArchitecture:
-        children = list(data[item].value_counts().index)
-        children.sort(key=str.lower)
-        for child in children:
-            state_pos_dic[child] = pos
-            pos+=1
+        children, codes = encode_level(data[item])
         data_array.append(children)
-    
-    total_states = sum([len(x) for x in data_array])
-    initial_transitions = np.zeros((total_states , total_states))
+        data_codes.append(codes)
+        offsets.append(pos)
+        pos += len(children)
+
+    total_states = pos
+    has_clicks = len(selected_df) > 0
+    counts = TransitionCounts(modelArchitecture, data_array, offsets, modelName)
+    counts.selected = selected_snapshot(selected_df, modelArchitecture)
+    rows, cols, probabilities = [], [], []
 
     for i in range(len(data_array)-1):
-        for j in range(len(data_array[i])):
-            parent = data_array[i][j]
-            children = data[modelArchitecture[i+1]][data[modelArchitecture[i]] == parent].value_counts().keys().to_numpy()
-            parent_pos = state_pos_dic[parent]
-
-            
-            if len(selected_df) > 0:
-                selected_parent_child_df = selected_df[selected_df[modelArchitecture[i]] == parent].groupby(modelArchitecture[i+1])['experiment_count'].sum()
-                total_length = len(data[modelArchitecture[i+1]][data[modelArchitecture[i]] == parent])  + selected_parent_child_df.sum() #len(children)  +
-            else:
-                total_length = len(data[modelArchitecture[i+1]][data[modelArchitecture[i]] == parent]) 
-            
-            for child in children:                
-                child_count = len(data[modelArchitecture[i+1]][(data[modelArchitecture[i]] == parent) & (data[modelArchitecture[i+1]] == child)])
-                if len(selected_df) > 0:
-                    prob = (child_count+selected_parent_child_df.get(child , default=0))/total_length
-                else:
-                    prob = (child_count)/total_length
-                child_pos = state_pos_dic[child]
-                initial_transitions[parent_pos][child_pos] = prob
-                if i == len(data_array)-2:
-                    try:
-                        feedback = feedback_df[feedback_df[modelArchitecture[-1]] == child]['feedback'].values[0]
-                        feedback_count = feedback_df[feedback_df[modelArchitecture[-1]] == child]['count'].values[0]
-                        max_number = feedback_df['count'].max()
-
-                        transition_value = combine_probablity_with_feedback(prob,
-                                                            feedback,
-                                                            feedback_count,
-                                                            max_number,
-                                                            alpha=0.5)
-                    except:
-                        transition_value = combine_probablity_with_feedback(prob,
-                                                            0,
-                                                            0,
-                                                            0,
-                                                            alpha=0.5)
-                        
-                    if modelName == "MDP_3":
-                        initial_transitions[child_pos][child_pos] = transition_value
-                    elif modelName == "MDP_2":
-                        initial_transitions[child_pos][child_pos] = prob
-                    else:   
-                        initial_transitions[child_pos][child_pos] = 1.0
-
-    ## assign 1.0 probability to each leaf
-    # for i in range(len(data_array[-1])):
-    #         leaf = data_array[len(data_array)-1][i]
-    #         leaf_pos = state_pos_dic[leaf]
-    #         initial_transitions[leaf_pos][leaf_pos] = 1.0
-
-
-    columns = dict((v,k) for k,v in state_pos_dic.items())
-    df = pd.DataFrame(initial_transitions , columns=[columns[i] for i  in range(initial_transitions.shape[0])] \
-                    ,index=[columns[i] for i  in range(initial_transitions.shape[0])])
-    df.to_csv(file_name)
-
-
-    # sdf = df.astype(pd.SparseDtype("float", 0.0))
-
-    # print('dense : {:0.2f} bytes'.format(df.memory_usage().sum() / 1e3))
-    # print('sparse: {:0.2f} bytes'.format(sdf.memory_usage().sum() / 1e3))
+        parent_codes, child_codes = data_codes[i], data_codes[i+1]
+        child_num = len(data_array[i+1])
+
+        # one grouped pass per level over integer codes: rows per (parent, child) and rows per parent
+        known = (parent_codes >= 0) & (child_codes >= 0)
+        pair_keys, numerator = np.unique(parent_codes[known] * child_num + child_codes[known], return_counts=True)
+        parents, children = np.divmod(pair_keys, child_num)
+        totals = np.bincount(parent_codes[parent_codes >= 0], minlength=len(data_array[i]))
+
+        # blend in the click counts of the selected experiments
+        if has_clicks:
+            selected_totals, selected_counts = count_clicks(selected_df, counts, i, pair_keys)
+            numerator = numerator + selected_counts
+            totals = totals + selected_totals
+
+        prob = numerator / totals[parents]
+        parent_pos = offsets[i] + parents
+        child_pos = offsets[i+1] + children
+        rows.append(parent_pos)
+        cols.append(child_pos)
+        probabilities.append(prob)
+        counts.add_level(parents, children, numerator, totals)
+
+        if i == len(data_array)-2:
+            # a leaf reached from several parents keeps the self-loop of its last parent
+            leaf_edges = pd.DataFrame({'leaf': child_pos, 'edge': np.arange(len(child_pos))}).drop_duplicates('leaf', keep='last')
+            leaf_pos = leaf_edges['leaf'].to_numpy()
+            counts.self_loop_edges = leaf_edges['edge'].to_numpy()
+            counts.self_loop_factor = get_self_loop_factor(modelName, feedback_df, modelArchitecture[-1], data_array[-1][leaf_pos - offsets[-1]])
+            rows.append(leaf_pos)
+            cols.append(leaf_pos)
+            probabilities.append(counts.get_self_loops(prob[counts.self_loop_edges]))
 
+    states = [state for level in data_array for state in level]
+    initial_transitions = TransitionModel(
+        total_states,
+        np.concatenate(rows) if rows else [],
+        np.concatenate(cols) if cols else [],
+        np.concatenate(probabilities) if probabilities else [],
+        states=states,
+        levels=data_array,
+        counts=counts)
+    counts.locate_entries(initial_transitions)
+    if file_name is not None:
+        initial_transitions.save(file_name)
 
     return initial_transitions
 
 
+def update_transition_model(transition_model: TransitionModel, selected_df: pd.DataFrame, feedback_df: pd.DataFrame = None):
+    # Applies the clicks (and, for MDP_3, the ratings) that changed since the model was built. Only the rows
+    # of parents with new clicks are renormalized. Returns the updated copy and the states whose rows changed.
+    counts = transition_model.counts
+    if counts.self_loop_entries is None:
+        # a single level has no edges, so neither clicks nor ratings change it
+        return transition_model, np.array([], dtype=np.int64)
+    delta = click_delta(counts.selected, selected_snapshot(selected_df, counts.modelArchitecture), counts.modelArchitecture)
+    self_loop_factor = counts.self_loop_factor
+    if feedback_df is not None and counts.modelName == "MDP_3":
+        leaves = counts.levels[-1][transition_model.indices[counts.self_loop_entries] - counts.offsets[-1]]
+        self_loop_factor = get_self_loop_factor(counts.modelName, feedback_df, counts.modelArchitecture[-1], leaves)
+    feedback_changed = np.flatnonzero(self_loop_factor != counts.self_loop_factor) \
+        if self_loop_factor is not None else np.array([], dtype=np.int64)
+    if len(delta) == 0 and len(feedback_changed) == 0:
+        return transition_model, np.array([], dtype=np.int64)
+
+    new_counts = counts.copy()
+    new_counts.selected = selected_snapshot(selected_df, counts.modelArchitecture)
+    new_counts.self_loop_factor = self_loop_factor
+    probabilities = transition_model.probabilities.copy()
+    changed = [transition_model.indices[counts.self_loop_entries[feedback_changed]]]
+    last = len(counts.levels) - 2
+    for i in range(last + 1):
+        parents, children = counts.parents[i], counts.children[i]
+        pair_keys = parents * len(counts.levels[i+1]) + children
+        selected_totals, selected_counts = count_clicks(delta, counts, i, pair_keys) if len(delta) > 0 else (None, None)
+        affected = np.flatnonzero(selected_totals) if selected_totals is not None else np.array([], dtype=np.int64)
+        if len(affected) > 0:
+            new_counts.numerators[i] = counts.numerators[i] + selected_counts
+            new_counts.totals[i] = counts.totals[i] + selected_totals
+            # pairs are sorted by parent, so each affected row is one contiguous run of edges
+            edges = np.concatenate([np.arange(start, end) for start, end in
+                                    zip(np.searchsorted(parents, affected), np.searchsorted(parents, affected + 1))])
+            prob = new_counts.numerators[i][edges] / new_counts.totals[i][parents[edges]]
+            probabilities[counts.entries[i][edges]] = prob
+            changed.append(counts.offsets[i] + affected)
+        if i == last:
+            loops = np.flatnonzero(np.isin(counts.self_loop_edges, edges)) if len(affected) > 0 else np.array([], dtype=np.int64)
+            loops = np.union1d(loops, feedback_changed)
+            if len(loops) > 0:
+                edge_prob = probabilities[counts.entries[i][counts.self_loop_edges[loops]]]
+                probabilities[counts.self_loop_entries[loops]] = new_counts.get_self_loops(edge_prob, loops)
+                changed.append(transition_model.indices[counts.self_loop_entries[loops]])
+
+    return transition_model.with_probabilities(probabilities, new_counts), np.unique(np.concatenate(changed))
+
+
+class TransitionCounts():
+    # per level pair: the distinct (parent, child) codes with their row + click counts and the per-parent
+    # totals, plus where each edge and leaf self-loop sits in the CSR arrays
+    def __init__(self, modelArchitecture, levels, offsets, modelName):
+        self.modelArchitecture = modelArchitecture
+        self.levels = levels
+        self.offsets = offsets
+        self.modelName = modelName
+        self.parents, self.children, self.numerators, self.totals, self.entries = [], [], [], [], []
+        self.self_loop_edges = None
+        self.self_loop_entries = None
+        self.self_loop_factor = None
+        self.selected = None
+        # measured once: counts are not changed after their model is built (updates work on a copy)
+        self.__nbytes = None
+
+    def add_level(self, parents, children, numerator, totals):
+        self.parents.append(parents)
+        self.children.append(children)
+        self.numerators.append(np.asarray(numerator, dtype='float64'))
+        self.totals.append(np.asarray(totals, dtype='float64'))
+
+    def locate_entries(self, transition_model):
+        num_states = transition_model.num_states
+        keys = transition_model.rows * num_states + transition_model.indices
+        for i in range(len(self.parents)):
+            edge_keys = (self.offsets[i] + self.parents[i]) * num_states + self.offsets[i+1] + self.children[i]
+            self.entries.append(np.searchsorted(keys, edge_keys))
+        if self.self_loop_edges is not None:
+            leaves = self.offsets[-1] + self.children[-1][self.self_loop_edges]
+            self.self_loop_entries = np.searchsorted(keys, leaves * num_states + leaves)
+
+    def get_self_loops(self, prob, loops=slice(None)):
+        if self.self_loop_factor is None:
+            return np.ones(len(prob))
+        return prob * self.self_loop_factor[loops]
+
+    def copy(self):
+        counts = copy.copy(self)
+        counts.numerators = list(self.numerators)
+        counts.totals = list(self.totals)
+        counts.__nbytes = None
+        return counts
+
+    @property
+    def nbytes(self):
+        if self.__nbytes is None:
+            arrays = self.parents + self.children + self.numerators + self.totals + self.entries
+            arrays += [array for array in (self.self_loop_edges, self.self_loop_entries, self.self_loop_factor) if array is not None]
+            self.__nbytes = (sum(np.asarray(array).nbytes for array in arrays)
+                             + (int(self.selected.memory_usage(index=True, deep=True).sum()) if self.selected is not None else 0))
+        return self.__nbytes
+
+
+def count_clicks(selected_df, counts, i, pair_keys):
+    # clicks per parent (every click whose child is set) and per existing (parent, child) pair of level i
+    levels, modelArchitecture = counts.levels, counts.modelArchitecture
+    child_num = len(levels[i+1])
+    selected_parents = levels[i].get_indexer(selected_df[modelArchitecture[i]])
+    selected_children = levels[i+1].get_indexer(selected_df[modelArchitecture[i+1]])
+    clicks = selected_df['experiment_count'].to_numpy(dtype='float64')
+    clicked = (selected_parents >= 0) & selected_df[modelArchitecture[i+1]].notna().to_numpy()
+    selected_totals = np.bincount(selected_parents[clicked], weights=clicks[clicked], minlength=len(levels[i]))
+    clicked &= selected_children >= 0
+    selected_keys = selected_parents[clicked] * child_num + selected_children[clicked]
+    selected_counts = pd.Series(clicks[clicked]).groupby(selected_keys).sum()
+    return selected_totals, selected_counts.reindex(pair_keys, fill_value=0).to_numpy()
+
+
+def selected_snapshot(selected_df, modelArchitecture):
+    columns = ['experiment_id'] + list(modelArchitecture) + ['experiment_count']
+    if not isinstance(selected_df, pd.DataFrame) or len(selected_df) == 0:
+        return pd.DataFrame(columns=columns)
+    return selected_df[columns].copy()
+
+
+def click_delta(old_selected, new_selected, modelArchitecture):
+    # per experiment, the change in its click count since the last snapshot (unchanged experiments dropped)
+    keys = ['experiment_id'] + list(modelArchitecture)
+    old_selected = old_selected.assign(experiment_count=-old_selected['experiment_count'].astype('float64'))
+    frames = [frame for frame in (new_selected, old_selected) if len(frame) > 0]
+    if len(frames) == 0:
+        return new_selected
+    delta = pd.concat(frames).groupby(keys, dropna=False, sort=False)['experiment_count'].sum().reset_index()
+    return delta[delta['experiment_count'] != 0]
+
+
+def get_self_loop_factor(modelName, feedback_df, leaf_column, leaves):
+    # what the probability of reaching a leaf is multiplied by on its self-loop (None: the self-loop is 1)
+    if modelName == "MDP_3":
+        feedback, feedback_count, max_number = get_leaf_feedback(feedback_df, leaf_column, leaves)
+        return combine_probablity_with_feedback(np.ones(len(leaves)),
+                                                feedback,
+                                                feedback_count,
+                                                max_number,
+                                                alpha=0.5)
+    elif modelName == "MDP_2":
+        return np.ones(len(leaves))
+    return None
+
+
+def encode_level(column: pd.Series):
+    # distinct values sorted case-insensitively (ties: most frequent first) and each row's position among them
+    codes, values = pd.factorize(column)
+    if len(values) == 0:
+        return pd.Index(values), np.full(len(codes), -1, dtype=np.int64)
+    counts = np.bincount(codes[codes >= 0], minlength=len(values))
+    by_count = np.argsort(-counts, kind='stable')
+    lower = pd.Series(values[by_count], dtype=object).str.lower().tolist()
+    order = by_count[sorted(range(len(lower)), key=lower.__getitem__)]
+    ranks = np.empty(len(values), dtype=np.int64)
+    ranks[order] = np.arange(len(values))
+    return pd.Index(values[order]), np.where(codes >= 0, ranks[codes], -1)
+
+
+def get_leaf_feedback(feedback_df, leaf_column, leaves):
+    # aligns the (feedback, count) columns with the given leaves; unknown leaves get no feedback
+    if not isinstance(feedback_df, pd.DataFrame) or len(feedback_df) == 0:
+        return np.zeros(len(leaves)), np.zeros(len(leaves)), 0
+    feedback_by_leaf = feedback_df.drop_duplicates(leaf_column).set_index(leaf_column)
+    known = leaves.isin(feedback_by_leaf.index)
+    feedback = feedback_by_leaf['feedback'].reindex(leaves).to_numpy(dtype='float64')
+    feedback_count = feedback_by_leaf['count'].reindex(leaves).to_numpy(dtype='float64')
+    feedback[~known] = 0
+    feedback_count[~known] = 0
+    return feedback, feedback_count, feedback_df['count'].max()
+
+
 def combine_probablity_with_feedback(prob, feedback, feedback_count, max_number, alpha=0.5):
     if feedback is None:
         f_hat = 0.5
@@ -100,4 +266,3 @@ def combine_probablity_with_feedback(prob, feedback, feedback_count, max_number,
     F_i = alpha * f_hat * w_i + (1 - alpha)
     P_tilde = prob * F_i
     return P_tilde
-
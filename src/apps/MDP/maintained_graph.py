@@ -0,0 +1,77 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from .initial_transition_generator import update_transition_model
+from .policy_iteration import PolicyIteration
+
+
+class MaintainedGraph():
+    # A GraphWorld kept current with click/rating deltas instead of being rebuilt, plus the last utilities
+    # solved per reward vector, so that a click only re-solves the states it can affect.
+    # Snapshots are never modified: a request keeps using the graph world it started with.
+    def __init__(self, graph_world, max_solutions=8, max_changes=64):
+        self.graph_world = graph_world
+        self.version = 0
+        # version -> states whose transition rows changed to reach it
+        self.changes = OrderedDict()
+        # reward digest -> (version, utilities)
+        self.solutions = OrderedDict()
+        self.max_solutions = max_solutions
+        self.max_changes = max_changes
+        self.lock = threading.Lock()
+
+    @property
+    def nbytes(self):
+        # everything the entry keeps: the current graph world, the change log and the solved utilities
+        with self.lock:
+            return (self.graph_world.nbytes
+                    + sum(changed.nbytes for changed in self.changes.values())
+                    + sum(utilities.nbytes for _, utilities in self.solutions.values()))
+
+    def update(self, selected_df, feedback_df=None):
+        with self.lock:
+            transition_model, changed = update_transition_model(self.graph_world.transition_model, selected_df, feedback_df)
+            if len(changed) > 0:
+                self.graph_world = self.graph_world.with_transition_model(transition_model)
+                self.version += 1
+                self.changes[self.version] = changed
+                while len(self.changes) > self.max_changes:
+                    self.changes.popitem(last=False)
+            return self.graph_world, self.version
+
+    def solve(self, graph_world, version, reward_function, gamma, theta, **solver_options):
+        # utilities, path utilities, solver iterations (0 when reused) and Bellman residual (None unless solved
+        # from scratch) of a snapshot returned by update(); solver_options go to PolicyIteration
+        reward_function = np.nan_to_num(np.asarray(reward_function, dtype='float64'))
+        digest = hashlib.sha1(str(reward_function.shape).encode() + reward_function.tobytes()).hexdigest()
+        solver = PolicyIteration(graph_world, gamma, theta, reward_function=reward_function, **solver_options)
+        with self.lock:
+            solved_version, utilities = self.solutions.get(digest, (None, None))
+            changed = self.__changes_between__(solved_version, version) if utilities is not None else None
+
+        if changed is None:
+            utilities = solver.get_utility_values()
+        elif len(changed) > 0:
+            utilities = solver.refresh_utility_values(utilities, changed)
+        iterations = solver.iterations
+
+        with self.lock:
+            if digest not in self.solutions or self.solutions[digest][0] <= version:
+                self.solutions[digest] = (version, utilities)
+                self.solutions.move_to_end(digest)
+            while len(self.solutions) > self.max_solutions:
+                self.solutions.popitem(last=False)
+        return utilities, solver.path_utility(utilities), iterations, solver.residual
+
+    def __changes_between__(self, old_version, new_version):
+        # states changed after old_version up to new_version; None when the log no longer covers that range
+        if old_version > new_version:
+            return None
+        if old_version == new_version:
+            return np.array([], dtype=np.int64)
+        if old_version + 1 not in self.changes:
+            return None
+        return np.unique(np.concatenate([self.changes[v] for v in range(old_version + 1, new_version + 1)]))
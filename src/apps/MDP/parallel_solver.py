@@ -0,0 +1,90 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from .transition_model import csr_backward_pass
+
+_executor = None
+_executor_workers = 0
+_executor_lock = threading.Lock()
+
+
+def get_executor(workers):
+    # one pool per process, created on first use; spawn keeps the workers clear of the server's threads
+    global _executor, _executor_workers
+    with _executor_lock:
+        if _executor is None or _executor_workers != workers:
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            _executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+            _executor_workers = workers
+        return _executor
+
+
+def parallel_backward_pass(transition_model, rewards, generations, gamma, workers, min_chunk=50000):
+    # The states of one generation only depend on later generations, so each generation is split into
+    # chunks solved by the pool while the earlier ones wait. The CSR arrays, rewards and the output live
+    # in shared memory, with the states in solving order so that a chunk is sent as a pair of offsets;
+    # generations too small to be worth the round trip are solved here on the same arrays.
+    generations = generations[::-1]
+    bounds = np.cumsum([0] + [len(states) for states in generations])
+    arrays = {
+        'order': np.concatenate(generations) if generations else np.array([], dtype=np.int64),
+        'indptr': transition_model.indptr,
+        'indices': transition_model.indices,
+        'probabilities': transition_model.probabilities,
+        'self_loops': transition_model.diagonal(),
+        'rewards': np.ascontiguousarray(rewards, dtype='float64'),
+        'utilities': np.zeros(np.shape(rewards)),
+    }
+    handles, spec, shared = {}, {}, None
+    try:
+        for name, array in arrays.items():
+            handles[name] = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, dtype=array.dtype, buffer=handles[name].buf)[...] = array
+            spec[name] = (handles[name].name, array.shape, array.dtype.str)
+        shared = attach_arrays(spec, handles)
+
+        executor = None
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            chunks = min(workers, (stop - start) // min_chunk)
+            if chunks < 2:
+                backward_pass(shared, start, stop, gamma)
+                continue
+            executor = executor or get_executor(workers)
+            edges = np.linspace(start, stop, chunks + 1).astype(np.int64)
+            futures = [executor.submit(solve_chunk, spec, int(a), int(b), gamma) for a, b in zip(edges[:-1], edges[1:])]
+            for future in futures:
+                future.result()
+        return shared['utilities'].copy()
+    finally:
+        # views into the buffers have to go before the segments can be closed
+        shared = None
+        for handle in handles.values():
+            handle.close()
+            handle.unlink()
+
+
+def solve_chunk(spec, start, stop, gamma):
+    # runs in a pool worker: attaches to the shared arrays and solves one chunk of a generation
+    handles = {name: shared_memory.SharedMemory(name=shm_name) for name, (shm_name, _, _) in spec.items()}
+    shared = attach_arrays(spec, handles)
+    try:
+        backward_pass(shared, start, stop, gamma)
+    finally:
+        shared = None
+        for handle in handles.values():
+            handle.close()
+
+
+def attach_arrays(spec, handles):
+    return {name: np.ndarray(shape, dtype=dtype, buffer=handles[name].buf) for name, (_, shape, dtype) in spec.items()}
+
+
+def backward_pass(shared, start, stop, gamma):
+    # states order[start:stop], which belong to a single generation
+    csr_backward_pass(shared['indptr'], shared['indices'], shared['probabilities'], shared['self_loops'],
+                      shared['rewards'], shared['utilities'], [shared['order'][start:stop]], gamma)
@@ -1,29 +1,107 @@
 import numpy as np
 from .graph_world import GraphWorld
+from .parallel_solver import parallel_backward_pass
+from .transition_model import csr_backward_pass
 class PolicyIteration:
-    def __init__(self, graph_world: GraphWorld, gamma , theta):
+    def __init__(self, graph_world: GraphWorld, gamma , theta, method="auto", max_iterations=10000, reward_function=None,
+                 workers=1, parallel_min_states=200000):
         self.graph = graph_world
-        self.reward_function = np.nan_to_num(graph_world.reward_function)
+        # reward_function may be a (num_states, profiles) matrix to solve several reward profiles at once
+        self.reward_function = np.nan_to_num(graph_world.reward_function if reward_function is None else reward_function)
         self.probability_matrix = graph_world.transition_model
         self.gamma = gamma
         self.theta = theta
+        self.method = method
+        self.max_iterations = max_iterations
         self.data = graph_world.data
         self.modelArchitecture = graph_world.modelArchitecture
+        self.iterations = 0
+        self.residual = None
+        # "auto" splits the generations of the DAG pass over this many processes for graphs this large
+        self.workers = workers
+        self.parallel_min_states = parallel_min_states
 
     def get_utility_values(self):
-        utilities = np.zeros(self.graph.num_states)
-        converge = False
-        counter = 0
-        while not converge:
-            temp_utilities = utilities.copy()
-            for i in range(self.graph.num_states):
-                utilities[i] = self.reward_function[i] +  (self.gamma  * np.sum(self.probability_matrix[i, :] * temp_utilities))
-            delta = np.max(np.abs(temp_utilities - utilities))
-            if delta < self. theta:
-                converge = True
-            counter += 1
-        print(f"Policy Iteration converged in {counter} iterations.")
+        method = self.method
+        generations = None
+        if method in ("auto", "dag", "parallel"):
+            generations = self.probability_matrix.topological_generations()
+            if generations is None:
+                if method != "auto":
+                    raise ValueError("The transition graph has cycles other than self-loops")
+                method = "jacobi"
+            elif method == "auto":
+                parallel = self.workers > 1 and self.graph.num_states >= self.parallel_min_states
+                method = "parallel" if parallel else "dag"
+
+        if method == "dag":
+            utilities = self.__dag_backward_pass__(generations)
+        elif method == "parallel":
+            utilities = self.__parallel_backward_pass__(generations)
+        elif method == "jacobi":
+            utilities = self.__jacobi_sweeps__()
+        elif method == "direct":
+            utilities = self.__direct_solve__()
+        else:
+            raise ValueError(f"Unknown solver method: {self.method}")
+        self.residual = self.get_residual(utilities)
+        return utilities
+
+    def __dag_backward_pass__(self, generations):
+        # Children are solved before their parents, so every state is final after one visit
+        utilities = np.zeros(self.reward_function.shape)
+        model = self.probability_matrix
+        csr_backward_pass(model.indptr, model.indices, model.probabilities, model.diagonal(),
+                          self.reward_function, utilities, generations, self.gamma)
+        self.iterations = 1
+        return utilities
+
+    def __parallel_backward_pass__(self, generations):
+        # same back substitution, each large generation split over the process pool
+        utilities = parallel_backward_pass(self.probability_matrix, self.reward_function, generations,
+                                           self.gamma, self.workers)
+        self.iterations = 1
+        return utilities
+
+    def refresh_utility_values(self, utilities, changed_states):
+        # utilities solved before the rows of changed_states were modified: only those states and the states
+        # that can reach them are recomputed, with the same backward pass
+        generations = self.probability_matrix.topological_generations()
+        if generations is None or self.method not in ("auto", "dag"):
+            return self.get_utility_values()
+        stale = self.probability_matrix.ancestors(changed_states)
+        utilities = np.array(utilities, dtype='float64')
+        model = self.probability_matrix
+        csr_backward_pass(model.indptr, model.indices, model.probabilities, model.diagonal(),
+                          self.reward_function, utilities, [states[stale[states]] for states in generations], self.gamma)
+        self.iterations = 1
         return utilities
+
+    def __jacobi_sweeps__(self):
+        # U_{k+1} = R + gamma * P @ U_k, one whole sweep per matrix-vector product
+        utilities = np.zeros(self.reward_function.shape)
+        self.iterations = 0
+        while self.iterations < self.max_iterations:
+            temp_utilities = utilities
+            utilities = self.reward_function + self.gamma * (self.probability_matrix @ temp_utilities)
+            self.iterations += 1
+            if np.max(np.abs(temp_utilities - utilities)) < self.theta:
+                break
+        return utilities
+
+    def __direct_solve__(self):
+        # exact fixed point of the Bellman equation: (I - gamma * P) U = R, densified for LAPACK
+        system = np.eye(self.graph.num_states) - self.gamma * self.probability_matrix.to_dense()
+        self.iterations = 1
+        return np.linalg.solve(system, self.reward_function)
+
+    def __column__(self, values):
+        # per-state values broadcast against one or many reward profiles
+        return values.reshape((-1,) + (1,) * (self.reward_function.ndim - 1))
+
+    def get_residual(self, utilities):
+        bellman = self.reward_function + self.gamma * (self.probability_matrix @ utilities)
+        return float(np.max(np.abs(bellman - utilities))) if len(utilities) > 0 else 0.0
     
 
     def calculate_utility_values(self):
@@ -33,33 +111,18 @@ class PolicyIteration:
         pass
 
     
-    def path_utility(self):
-        # def get_child_utility(state):
-        #     if state.children is None or len(state.children) == 0:
-        #         return utilities[state.key]
-        #     else:
-        #         child_values = np.array([])
-        #         for item in state.children:
-        #             child_values = np.append(child_values , utilities[state.key] + get_child_utility(item))
-        #             print(item.value , child_values)
-        #         return child_values
-            
-        # utilities = self.get_utility_values()
-        # return get_child_utility(self.graph.states[0])
-
-        #TODO:CHANGE TO RECURSIVE FUNCTION
-        path_utilility = np.zeros(len(self.graph.leafs))
-        inner_nodes_children = [item.get_action_number() for item in self.graph.get_inner_nodes()]
-
-        utilities = self.get_utility_values()
-        cummod = np.concatenate([[0], np.cumsum(inner_nodes_children)])
-        
-        inner_nodes_number = len(inner_nodes_children)
-
-        for i in range(inner_nodes_number):
-            j = np.arange(cummod[i], cummod[i + 1])
-            path_utilility[j] = utilities[0] + utilities[i + 1] + utilities[inner_nodes_number+j+1]
-        return path_utilility
+    def path_utility(self, utilities=None):
+        # utility of the whole intent -> ... -> model path of every leaf, for any architecture depth:
+        # the utilities of the states on the leaf's own row summed level by level, so that a state shared
+        # by several paths (e.g. one algorithm under two intents) adds to each of them
+        if utilities is None:
+            utilities = self.get_utility_values()
+        paths = self.graph.leaf_paths
+        path_values = np.zeros((paths.shape[1],) + utilities.shape[1:])
+        for states in paths:
+            on_path = self.__column__(states >= 0)
+            path_values += np.where(on_path, utilities[np.maximum(states, 0)], 0.0)
+        return path_values
 
 
     def path_order(self , data, modelArchitecture):
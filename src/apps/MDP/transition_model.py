@@ -0,0 +1,184 @@
+import copy
+
+import numpy as np
+
+
+class TransitionModel():
+    # CSR transition matrix: the model tree has about one non-zero entry per state
+    def __init__(self, num_states, rows, cols, probabilities, states=None, levels=None, counts=None):
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        probabilities = np.asarray(probabilities, dtype='float64')
+        order = np.lexsort((cols, rows))
+
+        self.num_states = int(num_states)
+        self.shape = (self.num_states, self.num_states)
+        self.rows = rows[order]
+        self.indices = cols[order]
+        self.probabilities = probabilities[order]
+        self.indptr = np.concatenate(([0], np.cumsum(np.bincount(self.rows, minlength=self.num_states))))
+        self.states = states
+        # distinct values of each architecture level, in state order (set by the generator)
+        self.levels = levels
+        # counts the probabilities were computed from, kept to apply click deltas (set by the generator)
+        self.counts = counts
+        self.__generations = None
+        self.__generations_computed = False
+        self.__predecessors = None
+
+    @property
+    def nnz(self):
+        return len(self.probabilities)
+
+    @property
+    def nbytes(self):
+        # everything the model keeps but the strings of its states, which are the graph world's level values
+        arrays = [self.rows, self.indices, self.probabilities, self.indptr]
+        arrays += self.__generations or []
+        arrays += list(self.__predecessors or [])
+        return (sum(array.nbytes for array in arrays)
+                + (8 * len(self.states) if self.states is not None else 0)
+                + (self.counts.nbytes if self.counts is not None else 0))
+
+    def dot(self, utilities):
+        utilities = np.asarray(utilities, dtype='float64')
+        result = np.zeros((self.num_states,) + utilities.shape[1:])
+        if self.nnz == 0:
+            return result
+        weights = self.probabilities.reshape((-1,) + (1,) * (utilities.ndim - 1))
+        products = weights * utilities[self.indices]
+        non_empty = np.diff(self.indptr) > 0
+        result[non_empty] = np.add.reduceat(products, self.indptr[:-1][non_empty], axis=0)
+        return result
+
+    def dot_rows(self, states, utilities, skip_self_loops=False):
+        # (P @ U)[states] without touching the other rows
+        return csr_dot_rows(self.indptr, self.indices, self.probabilities, states, utilities, skip_self_loops)
+
+    def topological_generations(self):
+        # the elimination order only depends on the structure, so it is computed once per model
+        if not self.__generations_computed:
+            self.__generations = self.__compute_generations__()
+            self.__generations_computed = True
+        return self.__generations
+
+    def __compute_generations__(self):
+        # Kahn's algorithm one generation at a time, ignoring self-loops.
+        # Returns None when the graph has any other cycle.
+        off_diagonal = self.rows != self.indices
+        targets = self.indices[off_diagonal]
+        in_degree = np.bincount(targets, minlength=self.num_states)
+        off_indptr = np.concatenate(([0], np.cumsum(np.bincount(self.rows[off_diagonal], minlength=self.num_states))))
+
+        generations = []
+        frontier = np.flatnonzero(in_degree == 0)
+        visited = 0
+        while len(frontier) > 0:
+            generations.append(frontier)
+            visited += len(frontier)
+            children = targets[segment_entries(off_indptr, frontier)[0]]
+            in_degree -= np.bincount(children, minlength=self.num_states)
+            frontier = np.unique(children[in_degree[children] == 0])
+        if visited < self.num_states:
+            return None
+        return generations
+
+    def ancestors(self, states):
+        # mask of the given states and of every state that can reach them, walking the edges backwards
+        if self.__predecessors is None:
+            off_diagonal = self.rows != self.indices
+            order = np.argsort(self.indices[off_diagonal], kind='stable')
+            self.__predecessors = (
+                np.concatenate(([0], np.cumsum(np.bincount(self.indices[off_diagonal], minlength=self.num_states)))),
+                self.rows[off_diagonal][order])
+        indptr, sources = self.__predecessors
+        mask = np.zeros(self.num_states, dtype=bool)
+        frontier = np.unique(np.asarray(states, dtype=np.int64))
+        while len(frontier) > 0:
+            mask[frontier] = True
+            frontier = np.unique(sources[segment_entries(indptr, frontier)[0]])
+            frontier = frontier[~mask[frontier]]
+        return mask
+
+    def with_probabilities(self, probabilities, counts=None):
+        # same structure (and cached solver order) with new edge weights, leaving this model untouched
+        model = copy.copy(self)
+        model.probabilities = probabilities
+        model.counts = counts
+        return model
+
+    def __matmul__(self, utilities):
+        return self.dot(utilities)
+
+    def diagonal(self):
+        diagonal = np.zeros(self.num_states)
+        self_loops = self.rows == self.indices
+        diagonal[self.rows[self_loops]] = self.probabilities[self_loops]
+        return diagonal
+
+    def row(self, state):
+        start, end = self.indptr[state], self.indptr[state + 1]
+        return self.indices[start:end], self.probabilities[start:end]
+
+    def to_dense(self):
+        dense = np.zeros(self.shape)
+        dense[self.rows, self.indices] = self.probabilities
+        return dense
+
+    def save(self, file_name):
+        # compact binary export of the non-zero entries, for debugging only
+        np.savez_compressed(
+            file_name,
+            num_states=self.num_states,
+            rows=self.rows,
+            cols=self.indices,
+            probabilities=self.probabilities,
+            states=np.array(self.states if self.states is not None else [], dtype=str))
+
+    @classmethod
+    def load(cls, file_name):
+        with np.load(file_name) as archive:
+            states = archive['states'].tolist()
+            return cls(
+                int(archive['num_states']),
+                archive['rows'],
+                archive['cols'],
+                archive['probabilities'],
+                states=states if len(states) > 0 else None)
+
+
+def csr_dot_rows(indptr, indices, probabilities, states, utilities, skip_self_loops=False):
+    # row-subset product on bare CSR arrays, so that it also runs on arrays in shared memory
+    states = np.asarray(states, dtype=np.int64)
+    utilities = np.asarray(utilities, dtype='float64')
+    result = np.zeros((len(states),) + utilities.shape[1:])
+    entries, lengths = segment_entries(indptr, states)
+    if len(entries) == 0:
+        return result
+    weights = probabilities[entries]
+    if skip_self_loops:
+        weights = np.where(indices[entries] == np.repeat(states, lengths), 0.0, weights)
+    products = weights.reshape((-1,) + (1,) * (utilities.ndim - 1)) * utilities[indices[entries]]
+    non_empty = lengths > 0
+    segment_starts = (np.cumsum(lengths) - lengths)[non_empty]
+    result[non_empty] = np.add.reduceat(products, segment_starts, axis=0)
+    return result
+
+
+def csr_backward_pass(indptr, indices, probabilities, self_loops, rewards, utilities, generations, gamma):
+    # back substitution of (I - gamma * P) U = R in reverse topological order, writing into utilities:
+    # U_i = (R_i + gamma * sum_{j != i} P_ij U_j) / (1 - gamma * P_ii)
+    self_loops = self_loops.reshape((-1,) + (1,) * (rewards.ndim - 1))
+    for states in reversed(generations):
+        if len(states) == 0:
+            continue
+        children_value = csr_dot_rows(indptr, indices, probabilities, states, utilities, skip_self_loops=True)
+        utilities[states] = (rewards[states] + gamma * children_value) / (1 - gamma * self_loops[states])
+    return utilities
+
+
+def segment_entries(indptr, states):
+    # positions of the CSR entries of the given rows, concatenated in row order, and the row lengths
+    starts = indptr[states]
+    lengths = indptr[states + 1] - starts
+    return np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum()), lengths
@@ -1,6 +1,7 @@
 from .MDP import PolicyIteration
 from .MDP import GraphWorld
 from .MDP import generate_initial_transition_model
+from .MDP import MaintainedGraph
 
 from .api import create_flask
 from .utils import Utils
\ No newline at end of file
@@ -0,0 +1,216 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from config import Config
+
+
+class LRUCache():
+    # thread-safe LRU bounded by entry count and by the approximate bytes of its values
+    def __init__(self, max_entries=32, max_bytes=512 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # counters live outside the entries so that they are never evicted
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size=0):
+        with self.lock:
+            if key in self.entries:
+                self.current_bytes -= self.entries.pop(key)[1]
+            if self.max_entries <= 0 or size > self.max_bytes:
+                return False
+            self.entries[key] = (value, size)
+            self.current_bytes += size
+            while len(self.entries) > self.max_entries or self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+            return True
+
+    def resize(self, key, size):
+        # new size of an entry that grew or shrank since it was put, evicting the least recently used to fit
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return False
+            self.current_bytes += size - entry[1]
+            self.entries[key] = (entry[0], size)
+            self.entries.move_to_end(key)
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+            return key in self.entries
+
+    def pop(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                return None
+            self.current_bytes -= entry[1]
+            return entry[0]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.current_bytes = 0
+
+    def get_counter(self, key):
+        with self.lock:
+            return self.counters.get(key, 0)
+
+    def incr(self, key):
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + 1
+            return self.counters[key]
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "backend": "memory",
+                "entries": len(self.entries),
+                "bytes": self.current_bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / lookups if lookups > 0 else 0.0,
+            }
+
+
+class RedisCache():
+    # shared store so that several workers see the same entries; any client with get/set/incr works
+    # (e.g. fakeredis in tests). Sizes are ignored, the server's maxmemory policy bounds the store.
+    def __init__(self, url=None, client=None, prefix="xp:", ttl=None):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def get(self, key):
+        try:
+            value = self.client.get(self.prefix + key)
+        except Exception as error:
+            print("REDIS CACHE GET FAILED:", error)
+            self.errors += 1
+            value = None
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value.decode() if isinstance(value, bytes) else value
+
+    def put(self, key, value, size=0):
+        try:
+            self.client.set(self.prefix + key, value, ex=self.ttl)
+            return True
+        except Exception as error:
+            print("REDIS CACHE SET FAILED:", error)
+            self.errors += 1
+            return False
+
+    def get_counter(self, key):
+        try:
+            value = self.client.get(self.prefix + key)
+        except Exception as error:
+            print("REDIS CACHE GET FAILED:", error)
+            self.errors += 1
+            return None
+        return int(value) if value is not None else 0
+
+    def incr(self, key):
+        try:
+            return int(self.client.incr(self.prefix + key))
+        except Exception as error:
+            print("REDIS CACHE INCR FAILED:", error)
+            self.errors += 1
+            return None
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "backend": "redis",
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_ratio": self.hits / lookups if lookups > 0 else 0.0,
+        }
+
+
+class ResponseCache():
+    # API responses keyed by the normalized request and the data version. Every write bumps the version,
+    # so entries computed from older data are never read again and simply age out of the backend.
+    VERSION_KEY = "data_version"
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def data_version(self):
+        return self.backend.get_counter(self.VERSION_KEY)
+
+    def bump_data_version(self):
+        return self.backend.incr(self.VERSION_KEY)
+
+    def make_key(self, name, *request_parts):
+        version = self.data_version()
+        if version is None:
+            return None
+        digest = hashlib.sha1(json.dumps(request_parts, sort_keys=True, default=str).encode()).hexdigest()
+        return f"{name}:{version}:{digest}"
+
+    def get(self, key):
+        # (raw JSON data, meta) of a cached response, or None
+        if key is None:
+            return None
+        value = self.backend.get(key)
+        if value is None:
+            return None
+        meta, raw_data = value.split("\n", 1)
+        return raw_data, json.loads(meta)
+
+    def put(self, key, raw_data, meta):
+        if key is None:
+            return False
+        value = json.dumps(meta) + "\n" + raw_data
+        return self.backend.put(key, value, len(value))
+
+    def stats(self):
+        stats = self.backend.stats()
+        stats["data_version"] = self.data_version()
+        return stats
+
+
+def create_response_cache():
+    if Config.RESPONSE_CACHE_URL:
+        return ResponseCache(RedisCache(Config.RESPONSE_CACHE_URL, ttl=Config.RESPONSE_CACHE_TTL))
+    return ResponseCache(LRUCache(Config.RESPONSE_CACHE_MAX_ENTRIES, Config.RESPONSE_CACHE_MAX_BYTES))
+
+
+# built graph worlds (transition model + solver order) keyed by the fingerprint of their candidate set
+mdp_cache = LRUCache(Config.MDP_CACHE_MAX_ENTRIES, Config.MDP_CACHE_MAX_BYTES)
+
+response_cache = create_response_cache()
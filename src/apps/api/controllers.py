@@ -1,13 +1,12 @@
 from ..database import PostgreSQLConnection
+from .cache import response_cache
 import json
 
 
 def LOGIN(email:str , password:str)-> json:
     connection = PostgreSQLConnection()
     user_info = connection.call_function('login' ,email , password)
-    if user_info == None:
-        return None
-    return json.loads(user_info)[0]['login']
+    return user_info
 
 def REGISTER(
         name: str, 
@@ -33,9 +32,7 @@ def REGISTER(
         birth_date,
         educational_level,
         educational_field)
-    if user_info == None:
-        return None
-    return json.loads(user_info)[0]['register']
+    return user_info
 
 
 #TODO GET USER BY ID
@@ -73,17 +70,20 @@ def ADD_EXPERIENCE(
         'add_experiment',userId,title,domain,intent,algorithm,method,model,postgres_descriptions
     )
 
-    return json.loads(experiment_info)[0]['add_experiment']
+    response_cache.bump_data_version()
+    return experiment_info
 
 #TODO GET ADD USER_ID
 def GET_EXPERIENCE(
-        experimentId: int
+        experimentId: int,
+        raw: bool = False
 ):
+    # raw: the JSON text built by Postgres, for routes that only forward it
     connection = PostgreSQLConnection()
     experiment_info = connection.call_function(
-        'get_experiment', experimentId
+        'get_experiment', experimentId, raw=raw
     )
-    return json.loads(experiment_info)[0]['get_experiment']
+    return experiment_info
 
 #TODO GET ADD USER_ID
 def EDIT_EXPERIMENT(
@@ -100,7 +100,8 @@ def EDIT_EXPERIMENT(
     experiment_info = connection.call_function(
         'edit_experiment',experimentId, title,domain,intent,algorithm,method,model,json.dumps(descriptions)
     )
-    return json.loads(experiment_info)[0]['edit_experiment']
+    response_cache.bump_data_version()
+    return experiment_info
 
 
 #TODO GET ADD USER_ID
@@ -109,7 +110,8 @@ def DELETE_EXPERIMENT(experimentId: int) -> json:
     experiment_info = connection.call_function(
         'delete_experiment',experimentId
     )
-    return json.loads(experiment_info)[0]['delete_experiment']
+    response_cache.bump_data_version()
+    return experiment_info
 
 #TODO GET ADD USER_ID
 def ADD_EXPERIENCE_DESCRIPTION_TYPE(
@@ -121,7 +123,8 @@ def ADD_EXPERIENCE_DESCRIPTION_TYPE(
         'add_experiment_description_type',name,type
     )
 
-    return json.loads(experiment_info)[0]['add_experiment_description_type'] if experiment_info else None
+    response_cache.bump_data_version()
+    return experiment_info
 
 #TODO GET ADD USER_ID
 def DELETE_EXPERIMENT_DESCRIPTION_TYPE(
@@ -131,18 +134,18 @@ def DELETE_EXPERIMENT_DESCRIPTION_TYPE(
     experiment_info = connection.call_function(
         'delete_experiment_description_type',description_type_id
     )
-    return json.loads(experiment_info)[0]['delete_experiment_description_type']
+    response_cache.bump_data_version()
+    return experiment_info
 
 #TODO GET ADD USER_ID
-def GET_ALL_EXPERIENCE_DESCRIPTION_TYPES() -> json:
+def GET_ALL_EXPERIENCE_DESCRIPTION_TYPES(raw: bool = False) -> json:
     connection = PostgreSQLConnection()
     experiment_info = connection.call_function(
-        'get_all_experiment_description_types'
+        'get_all_experiment_description_types', raw=raw
     )
 
-    response = json.loads(experiment_info)[0]['get_all_experiment_description_types']
-    if response:
-        return response
+    if experiment_info or raw:
+        return experiment_info
     return []     
 
 #TODO GET ADD USER_ID
@@ -156,14 +159,17 @@ def EDIT_EXPERIMENT_DESCRIPTION_TYPE(
     experiment_info = connection.call_function(
         'edit_experiment_description_type',description_type_id,name,type,reward
     )
-    return json.loads(experiment_info)[0]['edit_experiment_description_type']
+    response_cache.bump_data_version()
+    return experiment_info
 
 def GET_FILTERED_EXPERIENCES(
         domain:str,
         intent:str,
         algorithm:str,
         method:str,
-        description_filters: list
+        description_filters: list,
+        after_id: int = None,
+        limit: int = None
 ) -> json:
     connection = PostgreSQLConnection()
     experiment_info = connection.call_function(
@@ -172,12 +178,40 @@ def GET_FILTERED_EXPERIENCES(
         intent,
         algorithm,
         method,
-        json.dumps(description_filters)
+        json.dumps(description_filters),
+        after_id,
+        limit
     )
+    return experiment_info
 
-    print("GET_FILTERED_EXPERIENCES result:" , experiment_info)
-    
-    return json.loads(experiment_info)[0]['get_filtered_experiments']
+def STREAM_FILTERED_EXPERIENCES(
+        domain:str,
+        intent:str,
+        algorithm:str,
+        method:str,
+        description_filters: list,
+        batch_size: int = 1000,
+        after_id: int = None,
+        limit: int = None,
+        raw: bool = False
+):
+    # the (experiment_id, experiment) rows of GET_FILTERED_EXPERIENCES in experiment_id order, batch_size at a time
+    connection = PostgreSQLConnection()
+    query = connection.call_function(
+        'filtered_experiment_rows_query',
+        domain,
+        intent,
+        algorithm,
+        method,
+        json.dumps(description_filters),
+        after_id,
+        limit
+    )
+    # the filters could not be applied (e.g. a numerical value that is not a number): no experiments, as before
+    if query is None:
+        return
+
+    yield from PostgreSQLConnection().stream('filtered_experiments', query, batch_size=batch_size, raw=raw)
 
 def ADD_SEARCH_EXPERIMENT_HISTORY(
         user_id: int,
@@ -190,23 +224,37 @@ def ADD_SEARCH_EXPERIMENT_HISTORY(
         experiment_id
     )
 
-    return json.loads(result)[0]['add_search_history']
+    response_cache.bump_data_version()
+    return result
 
-def GET_SELECTED_EXPERIMENTS(ids: list):
+def GET_SELECTED_EXPERIMENTS(ids: list, raw: bool = False, after_id: int = None, limit: int = None):
     connection = PostgreSQLConnection()
     result = connection.call_function(
         'get_experiments_with_count',
-        ids
+        ids,
+        after_id,
+        limit,
+        raw=raw
+    )
+    return result
+
+def STREAM_SELECTED_EXPERIMENTS(ids: list, batch_size: int = 1000, after_id: int = None, limit: int = None, raw: bool = False):
+    # the (experiment_id, experiment) rows of GET_SELECTED_EXPERIMENTS in experiment_id order, batch_size at a time
+    yield from PostgreSQLConnection().stream(
+        'selected_experiments',
+        "SELECT experiment_id, experiment FROM experiments_with_count_rows(%s::INT[], %s, %s);",
+        (ids, after_id, limit),
+        batch_size=batch_size,
+        raw=raw
     )
-    # return json.loads(result)[0]['get_selected_experiment_count_by_ids']
-    return json.loads(result)[0]['get_experiments_with_count']
     
 def DELETE_EXPERIMENT(experimentId: int) -> json:
     connection = PostgreSQLConnection()
     result = connection.call_function(
         'delete_experiment',experimentId
     )
-    return json.loads(result)[0]['delete_experiment']
+    response_cache.bump_data_version()
+    return result
 
 def ADD_USER_FEEDBACK(user_id: int , experiment_id: int , rating: float):
     connection = PostgreSQLConnection()
@@ -216,7 +264,8 @@ def ADD_USER_FEEDBACK(user_id: int , experiment_id: int , rating: float):
         experiment_id,
         rating
     )
-    return json.loads(result)[0]['add_user_rating']
+    response_cache.bump_data_version()
+    return result
 
 def DELETE_EXPERIMENT_DESCRIPTION_TYPE(
         description_type_id: int
@@ -227,11 +276,12 @@ def DELETE_EXPERIMENT_DESCRIPTION_TYPE(
     )
 
     print("DELETE_EXPERIMENT_DESCRIPTION_TYPE result:" , result)
-    return json.loads(result)[0]['delete_experiment_description_type']
+    response_cache.bump_data_version()
+    return result
 
-def GET_DOMAINS_WITH_COUNTS():
+def GET_DOMAINS_WITH_COUNTS(raw: bool = False):
     connection = PostgreSQLConnection()
     result = connection.call_function(
-        'get_domains_with_counts'
+        'get_domains_with_counts', raw=raw
     )
-    return json.loads(result)[0]['get_domains_with_counts']
\ No newline at end of file
+    return result
\ No newline at end of file
@@ -1,5 +1,6 @@
-from flask import Flask, render_template_string , abort , send_from_directory
+from flask import Flask, render_template_string , abort , send_from_directory , request , g , Response
 import os
+import time
 import markdown
 from flask_jwt_extended import JWTManager
 from flask_cors import CORS
@@ -9,6 +10,7 @@ from dotenv import load_dotenv
 
 from src.config import Config
 from .utils import response_handler 
+from .. import metrics
 
 
 #TODO: LOG table
@@ -36,6 +38,36 @@ def create_swagger(app):
     def serve_static(filename):
         return send_from_directory(os.path.join(app.root_path, 'docs'), filename)
 
+def create_metrics(app):
+    # per-request stage timings go out as a Server-Timing header, the histograms on /metrics
+    @app.before_request
+    def start_timings():
+        g.request_start = time.perf_counter()
+        g.request_timings_token = metrics.start_request_timings()
+
+    @app.after_request
+    def add_server_timing(response):
+        timings = metrics.request_timings()
+        if timings:
+            response.headers['Server-Timing'] = metrics.server_timing_header(timings)
+        if 'request_start' in g:
+            metrics.REQUEST_SECONDS.observe(
+                time.perf_counter() - g.request_start,
+                method=request.method,
+                endpoint=request.url_rule.rule if request.url_rule is not None else "unmatched",
+                status=response.status_code)
+        return response
+
+    @app.teardown_request
+    def stop_timings(error=None):
+        token = g.pop('request_timings_token', None)
+        if token is not None:
+            metrics.stop_request_timings(token)
+
+    @app.route('/metrics', methods=['GET'])
+    def prometheus_metrics():
+        return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
 def create_flask(config_class=Config):
 
     load_dotenv()
@@ -49,6 +81,8 @@ def create_flask(config_class=Config):
     # Create Swagger UI
     create_swagger(app)
 
+    create_metrics(app)
+
     @app.errorhandler(400)
     def handle_400(error):
         error=error.description if error.description else "Bad Request"
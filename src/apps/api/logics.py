@@ -1,13 +1,19 @@
 
 from ..utils import Utils
 from src.apps import GraphWorld
-from src.apps import PolicyIteration
 from src.apps import generate_initial_transition_model
+from src.apps import MaintainedGraph
+from .cache import mdp_cache
+from ..metrics import stage, MDP_CANDIDATES, MDP_SOLVER_ITERATIONS, MDP_SOLVER_RESIDUAL
+from config import Config
 
 import pandas as pd
+import hashlib
 import json
 import numpy as np
-import os
+
+# user ratings are given on a 1-5 scale
+MAX_RATING = 5
 
 def make_soft_constraints(soft_constraints):
     constraints = {}
@@ -22,22 +28,50 @@ def make_soft_constraints(soft_constraints):
 
 
 def create_dataset_from_experience(json_data):
-    # rewards = {}
+    # one typed column per description: float64 for numerical types, category for categorical ones, so that
+    # rewards never have to parse the VARCHAR values again
     columns = ["experiment_id", "title", "domain", "intent", "algorithm", "method", "model"]
     if json_data is not None and len(json_data) > 0:
-        for item in json_data[0]['descriptions']:
-            columns.append(item['name'])
-            # rewards[item['name']] = (0  ,item['reward'])
-
-        data = []
-        for item in json_data:
-            row = [item['experiment_id'], item['title'], item['domain'], item['intent'], item['algorithm'], item['method'], item['model']]
+        dataFrame = pd.DataFrame([[item[column] for column in columns] for item in json_data], columns=columns)
+        values, types = {}, {}
+        for row, item in enumerate(json_data):
             for description in item['descriptions']:
-                row.append(description['value'])
-            data.append(row)
-        dataFrame = pd.DataFrame(data, columns=columns)
-        return dataFrame #, rewards
-    return pd.DataFrame([] , columns=columns) #, rewards
+                name = description['name']
+                if name not in values:
+                    values[name] = [None] * len(json_data)
+                    types[name] = description.get('type')
+                values[name][row] = description['value']
+        numerical = {}
+        for name, column in values.items():
+            dataFrame[name] = typed_description_column(column, types[name])
+            if types[name] == "numerical":
+                numerical[name] = unparsed_numbers(column, dataFrame[name].to_numpy())
+        dataFrame.attrs['numerical_descriptions'] = numerical
+        return dataFrame
+    return pd.DataFrame([] , columns=columns)
+
+
+def typed_description_column(values, type_):
+    if type_ == "numerical":
+        return pd.to_numeric(pd.Series(values, dtype=object), errors='coerce').astype('float64').to_numpy()
+    if type_ == "categorical":
+        return pd.Categorical(values)
+    return values
+
+def unparsed_numbers(values, numbers):
+    # row -> value of the numerical descriptions that are not numbers, answered to the clients as they were given
+    return {int(row): values[row] for row in np.flatnonzero(np.isnan(numbers)) if values[row] is not None}
+
+
+def described_numbers(numbers, rows, unparsed):
+    # a numerical description column of the given rows as the clients know it: whole numbers as ints,
+    # values that are not numbers as they were given
+    values = numbers.astype(object)
+    whole = np.isfinite(numbers) & (numbers == np.round(numbers)) & (np.abs(numbers) < 2**53)
+    values[whole] = numbers[whole].astype(np.int64).tolist()
+    for i in np.flatnonzero(np.isnan(numbers)):
+        values[i] = unparsed.get(int(rows[i]))
+    return values
 
 def create_reward_from_soft_constraints(soft_constraints):
     rewards = {}
@@ -47,33 +81,153 @@ def create_reward_from_soft_constraints(soft_constraints):
         counter -= 1
 
     return rewards
-def calculate_mdp(data_frame , selected_ex_df , soft_constraints , reward_values , modelArchitecture=['intent' , 'algorithm' , 'model']):
-
-    probability_file_name = f'data/probability_{os.getpid()}.csv'
-    if not os.path.exists('data'):
-        os.makedirs('data')
-
-    print("GENERATING PROBABILITY MATRIX...")
-    generate_initial_transition_model(
-        data_frame,
-        selected_ex_df, 
-        feedback_df=[],
-        modelArchitecture=modelArchitecture,
-        file_name=probability_file_name, modelName="MDP_2")
-
-    print("CREATING THE GRAPH WORLD...")
-    problem = GraphWorld(data_frame , modelArchitecture, probability_file_name , soft_constraints , reward_values)
-
-    print("RUNNING MDP...")
-    solver = PolicyIteration(problem, gamma=0.9 ,theta=0.005)
-    # print(solver.get_utility_values())
-    problem.set_utility_values(solver.get_utility_values())
-    problem.set_path_utility(solver.path_utility())
-    
-
-    os.remove(probability_file_name)
-
-    return sorted(problem.leafs)
+def build_mdp_frames(filtered_response, selected_response):
+    data_frame  = create_dataset_from_experience(filtered_response)
+    #to avoid duplicate models
+    data_frame['model_id'] = data_frame['model'] + "_" + data_frame['experiment_id'].astype(str)
+
+    selected_df =  create_dataset_from_experience(selected_response)
+    if selected_df is not None and len(selected_df) > 0:
+        selected_df['experiment_count'] = [item['experiment_count'] for item in selected_response]
+        #to avoid duplicate models
+        selected_df['model_id'] = selected_df['model'] + "_" + selected_df['experiment_id'].astype(str)
+    return data_frame, selected_df, create_feedback_from_ratings(filtered_response)
+
+
+def check_model_architecture(data_frame , modelArchitecture):
+    # every candidate needs a value at every level: a NULL would leave its leaf without that part of its path
+    for level in modelArchitecture:
+        missing = int(data_frame[level].isna().sum()) if level in data_frame.columns else len(data_frame)
+        if missing > 0:
+            raise ValueError(f"model_architecture level '{level}' has no value for {missing} of the {len(data_frame)} candidates")
+
+
+def create_feedback_from_ratings(json_data):
+    # per-experiment (leaf) feedback for MDP_3 from the rating aggregates returned with the candidates:
+    # the mean rating scaled to [0, 1] and the number of ratings
+    rated = [item for item in json_data if item.get('rating_count')]
+    return pd.DataFrame({
+        'model_id': [item['model'] + "_" + str(item['experiment_id']) for item in rated],
+        'feedback': np.array([item['rating_mean'] for item in rated], dtype='float64') / MAX_RATING,
+        'count': np.array([item['rating_count'] for item in rated], dtype='float64'),
+    })
+
+
+def build_graph_world(data_frame , selected_ex_df , soft_constraints , reward_values , modelArchitecture, export_file_name=None, feedback_df=None, modelName="MDP_2"):
+    with stage("transition"):
+        transition_model = generate_initial_transition_model(
+            data_frame,
+            selected_ex_df, 
+            feedback_df=feedback_df if feedback_df is not None else [],
+            modelArchitecture=modelArchitecture,
+            file_name=export_file_name, modelName=modelName)
+
+    with stage("graph"):
+        return GraphWorld(data_frame , modelArchitecture, transition_model , soft_constraints , reward_values)
+
+
+def candidate_fingerprint(data_frame , modelArchitecture):
+    # the graph structure depends only on the candidates' architecture columns; clicks are applied as deltas
+    fingerprint = hashlib.sha1(json.dumps(list(modelArchitecture)).encode())
+    candidates = data_frame.sort_values('experiment_id', kind='stable')
+    fingerprint.update(candidates['experiment_id'].to_numpy(dtype=np.int64).tobytes())
+    fingerprint.update(pd.util.hash_pandas_object(candidates[modelArchitecture], index=False).to_numpy().tobytes())
+    return fingerprint.hexdigest()
+
+
+def get_maintained_graph(data_frame , selected_ex_df , soft_constraints , reward_values , modelArchitecture, export_file_name=None, feedback_df=None, modelName="MDP_2"):
+    # cached graphs are shared between requests; new clicks and ratings are applied to them instead of rebuilding.
+    # Returns the graph and its cache key (None when it is not cached)
+    if export_file_name is not None:
+        return MaintainedGraph(build_graph_world(data_frame , selected_ex_df , soft_constraints , reward_values , modelArchitecture, export_file_name, feedback_df, modelName)), None
+    key = candidate_fingerprint(data_frame , modelArchitecture) + ":" + modelName
+    maintained = mdp_cache.get(key)
+    if maintained is not None:
+        return maintained, key
+    graph_world = build_graph_world(data_frame , selected_ex_df , soft_constraints , reward_values , modelArchitecture, None, feedback_df, modelName)
+    maintained = MaintainedGraph(graph_world.without_descriptions())
+    # the exact solver's elimination order is part of what gets reused
+    with stage("solver_order"):
+        maintained.graph_world.transition_model.topological_generations()
+    mdp_cache.put(key, maintained, maintained.nbytes)
+    return maintained, key
+
+
+def update_cached_size(maintained, key):
+    # the entry also keeps the changes and solutions of the request that just used it
+    if key is not None:
+        mdp_cache.resize(key, maintained.nbytes)
+
+
+def observe_solver(iterations, residual):
+    MDP_SOLVER_ITERATIONS.observe(iterations)
+    if residual is not None:
+        MDP_SOLVER_RESIDUAL.observe(residual)
+
+
+def solver_options():
+    return {"workers": Config.MDP_PARALLEL_WORKERS, "parallel_min_states": Config.MDP_PARALLEL_MIN_STATES}
+
+def calculate_mdp(data_frame , selected_ex_df , soft_constraints , reward_values , modelArchitecture=['intent' , 'algorithm' , 'model'], export_file_name=None, limit=None, offset=0, feedback_df=None, modelName="MDP_2"):
+    MDP_CANDIDATES.observe(len(data_frame))
+    maintained, key = get_maintained_graph(data_frame , selected_ex_df , soft_constraints , reward_values , modelArchitecture, export_file_name, feedback_df, modelName)
+    with stage("transition_update"):
+        problem, version = maintained.update(selected_ex_df, feedback_df)
+    leaf_rows = problem.get_leaf_rows(data_frame)
+
+    with stage("rewards"):
+        reward_function = problem.get_reward_function(data_frame.iloc[leaf_rows] , soft_constraints , reward_values)
+    with stage("solve"):
+        utility_values, path_values, iterations, residual = maintained.solve(problem, version, reward_function, gamma=0.9, theta=0.005, **solver_options())
+    observe_solver(iterations, residual)
+    update_cached_size(maintained, key)
+
+    with stage("rank"):
+        ranked = problem.rank_leafs(limit, offset, scores=path_values)
+    return leafs_to_frame(data_frame, leaf_rows[ranked], utility_values[problem.inner_node_num:][ranked], path_values[ranked]), len(problem.leafs)
+
+
+def calculate_mdp_batch(data_frame , selected_ex_df , profiles , modelArchitecture=['intent' , 'algorithm' , 'model'], limit=None, offset=0, feedback_df=None, modelName="MDP_2"):
+    # profiles: list of (soft_constraints, reward_values). The graph depends only on the candidate set,
+    # so it is built once and all reward vectors are solved together as one (states x profiles) matrix.
+    MDP_CANDIDATES.observe(len(data_frame))
+    maintained, key = get_maintained_graph(data_frame , selected_ex_df , profiles[0][0] , profiles[0][1] , modelArchitecture, None, feedback_df, modelName)
+    with stage("transition_update"):
+        problem, version = maintained.update(selected_ex_df, feedback_df)
+    leaf_rows = problem.get_leaf_rows(data_frame)
+
+    with stage("rewards"):
+        reward_matrix = problem.get_reward_matrix(profiles, data_frame.iloc[leaf_rows])
+    with stage("solve"):
+        utility_values, path_values, iterations, residual = maintained.solve(problem, version, reward_matrix, gamma=0.9, theta=0.005, **solver_options())
+    observe_solver(iterations, residual)
+    update_cached_size(maintained, key)
+    leaf_utilities = utility_values[problem.inner_node_num:]
+
+    rankings = []
+    with stage("rank"):
+        for k in range(len(profiles)):
+            ranked = problem.rank_leafs(limit, offset, scores=path_values[:, k])
+            rankings.append(leafs_to_frame(data_frame, leaf_rows[ranked], leaf_utilities[ranked, k], path_values[ranked, k]))
+    return rankings, len(problem.leafs)
+
+
+def leafs_to_frame(data_frame, rows, leaf_utilities, leaf_path_utilities):
+    # the ranked page as one slice of the candidates, with the utilities attached as columns
+    page = data_frame.iloc[rows].drop(columns=['model_id'])
+    for name, unparsed in data_frame.attrs.get('numerical_descriptions', {}).items():
+        page[name] = described_numbers(page[name].to_numpy(dtype='float64'), rows, unparsed)
+    page['utility_value'] = np.asarray(leaf_utilities, dtype='float64')
+    page['path_utility'] = np.asarray(leaf_path_utilities, dtype='float64')
+    return page
+
+
+def frame_to_json(page, result_format="records"):
+    # encoded in one pass; "columnar" lists the column names once and then one array of values per column
+    if result_format == "columnar":
+        values = [page[column].to_json(orient='values', double_precision=15) for column in page.columns]
+        return '{"columns": ' + json.dumps(list(page.columns)) + ', "values": [' + ', '.join(values) + ']}'
+    return page.to_json(orient='records', double_precision=15)
 
 
 # def add_unavaiable_description_types(file_name , all_description_types):
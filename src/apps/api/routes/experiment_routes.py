@@ -1,9 +1,8 @@
 import json
 from pathlib import Path
 import os
-import pandas as pd
 
-from flask import Blueprint , request , abort
+from flask import Blueprint , request , abort , Response
 from flask_jwt_extended import jwt_required, get_jwt_identity
 
 from werkzeug.utils import secure_filename
@@ -15,8 +14,10 @@ from ..controllers import (
     ADD_EXPERIENCE_DESCRIPTION_TYPE, 
     GET_ALL_EXPERIENCE_DESCRIPTION_TYPES, 
     GET_FILTERED_EXPERIENCES,
+    STREAM_FILTERED_EXPERIENCES,
     ADD_SEARCH_EXPERIMENT_HISTORY,
     GET_SELECTED_EXPERIMENTS,
+    STREAM_SELECTED_EXPERIMENTS,
     ADD_USER_FEEDBACK,
     GET_DOMAINS_WITH_COUNTS,
     DELETE_EXPERIMENT_DESCRIPTION_TYPE,
@@ -24,19 +25,28 @@ from ..controllers import (
 )
 
 from ..logics import (
-    create_dataset_from_experience,
     make_soft_constraints,
     calculate_mdp, 
+    calculate_mdp_batch,
+    build_mdp_frames,
+    check_model_architecture,
+    frame_to_json,
     convert_uc5_to_json,
     add_unavaiable_description_types,
     create_reward_from_soft_constraints
 )
 
-from ..utils import response_handler , allowed_file
+from ..utils import response_handler , allowed_file , is_empty_json
+from ..cache import mdp_cache, response_cache
+from ...metrics import stage
 import uuid
 
 bp = Blueprint('experiment', __name__)
 
+DEFAULT_MODEL_ARCHITECTURE = ['intent' , 'algorithm' , 'model_id']
+RESULT_FORMATS = ['records', 'columnar']
+MODEL_ARCHITECTURE_LEVELS = ['domain', 'intent', 'method', 'algorithm', 'model', 'model_id']
+
 
 #TODO: CALL MDP constraints
 #TODO: EDIT EXPERIENCE
@@ -82,9 +92,9 @@ def add_experiment():
 def get_experience():
     if request.method == 'GET':
         experiment_id = request.args.get('experiment_id')
-        response = GET_EXPERIENCE(experiment_id)
-        if response:
-            return response_handler(response)
+        response = GET_EXPERIENCE(experiment_id, raw=True)
+        if not is_empty_json(response):
+            return response_handler(raw_data=response)
         else:    
             abort(404 , description="Experiment not found")
 
@@ -106,78 +116,268 @@ def add_experiment_description_type():
 @jwt_required()
 def get_description_types():
     if request.method == 'GET':
-        response = GET_ALL_EXPERIENCE_DESCRIPTION_TYPES()
-        if response:
-            return response_handler(response)
+        response = GET_ALL_EXPERIENCE_DESCRIPTION_TYPES(raw=True)
+        if not is_empty_json(response):
+            return response_handler(raw_data=response)
         else:
             abort(404)
 
 
 
+def is_integer(value):
+    # JSON true/false arrive as bool, which is a subclass of int
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def parse_mdp_request(json_data):
+    # shared validation of call_mdp and call_mdp_batch; raises ValueError with the message for the client
+    options = {
+        'domain': json_data['domain'],
+        'intent': json_data['intent'],
+        'algorithm': json_data['algorithm'],
+        'method': json_data['method'],
+        'hard_constraints': json_data['hard_constraints'],
+    }
+    for key in ('algorithm', 'method'):
+        if options[key] is not None and options[key].strip() == "":
+            options[key] = None
+
+    model_architecture = json_data.get('model_architecture') or DEFAULT_MODEL_ARCHITECTURE
+    if not isinstance(model_architecture, list) or any(not isinstance(level, str) for level in model_architecture) or \
+        model_architecture[-1] != 'model_id' or len(set(model_architecture)) != len(model_architecture) or \
+        any(level not in MODEL_ARCHITECTURE_LEVELS for level in model_architecture):
+            raise ValueError(f"model_architecture must be distinct levels of {MODEL_ARCHITECTURE_LEVELS} ending with 'model_id'")
+    options['model_architecture'] = model_architecture
+
+    limit = json_data.get('limit')
+    offset = json_data.get('offset')
+    offset = 0 if offset is None else offset
+    if (limit is not None and (not is_integer(limit) or limit < 0)) or \
+        not is_integer(offset) or offset < 0:
+            raise ValueError("limit and offset must be non-negative integers")
+    options['limit'] = limit
+    options['offset'] = offset
+
+    result_format = json_data.get('format') or "records"
+    if result_format not in RESULT_FORMATS:
+        raise ValueError(f"format must be one of {RESULT_FORMATS}")
+    options['format'] = result_format
+
+    if options['intent'] is None and options['domain'] is None and options['algorithm'] is None and \
+        options['method'] is None and (options['hard_constraints'] is None or len(options['hard_constraints']) == 0):
+            raise ValueError("At least one hard constraints are required")
+    return options
+
+
+def normalize_mdp_options(options):
+    # requests that differ only in the order of their hard constraints share a cache entry
+    normalized = dict(options)
+    if options['hard_constraints'] is not None:
+        normalized['hard_constraints'] = sorted(options['hard_constraints'], key=lambda item: json.dumps(item, sort_keys=True))
+    return normalized
+
+
+def load_mdp_frames(options):
+    with stage("db_fetch"):
+        # MDP_FETCH_BATCH_SIZE > 0 reads the candidates through server-side cursors instead of one json_agg value
+        batch_size = Config.MDP_FETCH_BATCH_SIZE
+        if batch_size > 0:
+            filtered_response = [experiment for batch in STREAM_FILTERED_EXPERIENCES(
+                options['domain'],
+                options['intent'],
+                options['algorithm'],
+                options['method'],
+                options['hard_constraints'],
+                batch_size=batch_size
+            ) for _, experiment in batch]
+        else:
+            filtered_response = GET_FILTERED_EXPERIENCES(
+                options['domain'],
+                options['intent'],
+                options['algorithm'],
+                options['method'],
+                options['hard_constraints']
+            )
+        if filtered_response is None or len(filtered_response) == 0:
+            return None, None, None
+
+        experiment_ids_list =  [item['experiment_id'] for item in filtered_response]
+        if batch_size > 0:
+            selected_response = [experiment for batch in STREAM_SELECTED_EXPERIMENTS(experiment_ids_list, batch_size=batch_size)
+                                 for _, experiment in batch]
+        else:
+            selected_response = GET_SELECTED_EXPERIMENTS(experiment_ids_list)
+    with stage("frame_build"):
+        return build_mdp_frames(filtered_response, selected_response)
+
+
+def parse_page_request(json_data):
+    # keyset page of the listing routes: experiments after `after_id` (an experiment_id), at most `limit` of them
+    after_id = json_data.get('after_id')
+    limit = json_data.get('limit')
+    if (after_id is not None and not is_integer(after_id)) or \
+        (limit is not None and (not is_integer(limit) or limit <= 0)):
+            raise ValueError("after_id must be an integer and limit a positive integer")
+    return after_id, limit
+
+
+def page_response(rows, after_id, limit):
+    # rows: (experiment_id, experiment JSON text) in experiment_id order; a full page gives the cursor of the next one
+    next_after_id = rows[-1][0] if limit is not None and len(rows) == limit else None
+    raw_data = '[' + ', '.join(experiment for _, experiment in rows) + ']'
+    return response_handler(raw_data=raw_data, meta={"after_id": after_id, "limit": limit, "next_after_id": next_after_id})
+
+
+@bp.route('/get_filtered_experiments', methods=['POST'])
+@jwt_required()
+def get_filtered_experiments():
+    if request.method == 'POST':
+        json_data = json.loads(request.get_data(as_text=True))
+        try:
+            after_id, limit = parse_page_request(json_data)
+        except ValueError as error:
+            return response_handler(error=str(error), status_code=400)
+
+        rows = [row for batch in STREAM_FILTERED_EXPERIENCES(
+            json_data.get('domain'),
+            json_data.get('intent'),
+            json_data.get('algorithm'),
+            json_data.get('method'),
+            json_data.get('hard_constraints'),
+            batch_size=limit or Config.EXPORT_BATCH_SIZE,
+            after_id=after_id,
+            limit=limit,
+            raw=True
+        ) for row in batch]
+        return page_response(rows, after_id, limit)
+    else:
+        abort(405)
+
+
+@bp.route('/export_experiments', methods=['POST'])
+@jwt_required()
+def export_experiments():
+    # every filtered experiment as JSON lines, read EXPORT_BATCH_SIZE at a time while the response is sent
+    if request.method == 'POST':
+        json_data = json.loads(request.get_data(as_text=True))
+        batches = STREAM_FILTERED_EXPERIENCES(
+            json_data.get('domain'),
+            json_data.get('intent'),
+            json_data.get('algorithm'),
+            json_data.get('method'),
+            json_data.get('hard_constraints'),
+            batch_size=Config.EXPORT_BATCH_SIZE,
+            raw=True
+        )
+
+        def generate():
+            for batch in batches:
+                yield ''.join(experiment + '\n' for _, experiment in batch)
+
+        return Response(generate(), mimetype='application/x-ndjson')
+    else:
+        abort(405)
+
+
 @bp.route('/call_mdp', methods=['POST'])
 @jwt_required()
 def call_mdp():
     if request.method == 'POST':
         json_data = json.loads(request.get_data(as_text=True))
-        domain = json_data['domain']
-        intent = json_data['intent']
-        algorithm = json_data['algorithm']
-        method = json_data['method']
-        if algorithm is not None and algorithm.strip() == "":
-            algorithm = None
-        if method is not None and method.strip() == "":
-            method = None
-        hard_constraints = json_data['hard_constraints']
+        try:
+            options = parse_mdp_request(json_data)
+        except ValueError as error:
+            return response_handler(error=str(error), status_code=400)
         soft_constraints = json_data['soft_constraints']
-        if intent is None and domain is None and algorithm is None and method is None and \
-            (hard_constraints is None or len(hard_constraints) == 0):
-                return response_handler(error="At least one hard constraints are required", status_code=400)
         
         if soft_constraints is None or len(soft_constraints) == 0:
             return response_handler(error="At least one soft constraints are required", status_code=400)
         
+        # soft constraint order sets the reward weights, so only the hard constraints are order-free
+        cache_key = response_cache.make_key('call_mdp', normalize_mdp_options(options), soft_constraints)
+        with stage("response_cache"):
+            cached = response_cache.get(cache_key)
+        if cached is not None:
+            return response_handler(raw_data=cached[0], meta=cached[1])
 
-        filtered_response = GET_FILTERED_EXPERIENCES(
-            domain,
-            intent,
-            algorithm,
-            method,
-            hard_constraints
-        )
-        
-        experiment_ids_list =  [item['experiment_id'] for item in filtered_response]
-        selected_response = GET_SELECTED_EXPERIMENTS(experiment_ids_list)
-        if filtered_response is not None:
-            if len(filtered_response) == 0:
-                return response_handler(error="No experiences found with the given constraints", status_code=404)
-            data_frame  = create_dataset_from_experience(filtered_response)
-            
-            #to avoid duplicate models
-            data_frame['model_id'] = data_frame['model'] + "_" + data_frame['experiment_id'].astype(str)
-            
-            selected_df =  create_dataset_from_experience(selected_response)
-            if selected_df is not None and len(selected_df) > 0:
-                selected_df['experiment_count'] = [item['experiment_count'] for item in selected_response]
-                #to avoid duplicate models
-                selected_df['model_id'] = selected_df['model'] + "_" + selected_df['experiment_id'].astype(str)
-            rewards = create_reward_from_soft_constraints(soft_constraints)
-
-            print("rewards:", rewards)
-            sorted_graph = calculate_mdp(data_frame ,selected_df,
-                                        make_soft_constraints(soft_constraints),
-                                        rewards,
-                                        ['intent' , 'algorithm' , 'model_id'])
-            json_array = []
-            for item in sorted_graph:
-                temp = item.data.to_dict()
-                temp['utility_value'] = item.utility_value
-                temp['path_utility'] = item.utility_path
-                del temp['model_id']
-                json_array.append(temp)
-
-            print("MDP calculation completed.", len(json_array), "results found.")
-            # print(json.dumps(json_array , indent=4))
-            return response_handler(json_array)
+        data_frame, selected_df, feedback_df = load_mdp_frames(options)
+        if data_frame is None:
+            return response_handler(error="No experiences found with the given constraints", status_code=404)
+        try:
+            check_model_architecture(data_frame, options['model_architecture'])
+        except ValueError as error:
+            return response_handler(error=str(error), status_code=400)
+
+        rewards = create_reward_from_soft_constraints(soft_constraints)
+        export_file_name = None
+        if Config.MDP_EXPORT_FOLDER:
+            Path(Config.MDP_EXPORT_FOLDER).mkdir(parents=True, exist_ok=True)
+            export_file_name = os.path.join(Config.MDP_EXPORT_FOLDER, f'transition_{uuid.uuid4().hex}.npz')
+        result, total = calculate_mdp(data_frame ,selected_df,
+                                    make_soft_constraints(soft_constraints),
+                                    rewards,
+                                    options['model_architecture'],
+                                    export_file_name=export_file_name,
+                                    limit=options['limit'],
+                                    offset=options['offset'],
+                                    feedback_df=feedback_df,
+                                    modelName=Config.MDP_MODEL_NAME)
+
+        with stage("serialize"):
+            raw_data = frame_to_json(result, options['format'])
+        meta = {"total": total, "offset": options['offset'], "limit": options['limit'], "format": options['format']}
+        response_cache.put(cache_key, raw_data, meta)
+        return response_handler(raw_data=raw_data, meta=meta)
+
+
+@bp.route('/call_mdp_batch', methods=['POST'])
+@jwt_required()
+def call_mdp_batch():
+    if request.method == 'POST':
+        json_data = json.loads(request.get_data(as_text=True))
+        try:
+            options = parse_mdp_request(json_data)
+        except ValueError as error:
+            return response_handler(error=str(error), status_code=400)
+        profiles = json_data.get('soft_constraint_profiles')
+        if not isinstance(profiles, list) or len(profiles) == 0 or \
+            any(not isinstance(profile, list) or len(profile) == 0 for profile in profiles):
+                return response_handler(error="soft_constraint_profiles must be a list of non-empty soft constraint lists", status_code=400)
+
+        cache_key = response_cache.make_key('call_mdp_batch', normalize_mdp_options(options), profiles)
+        with stage("response_cache"):
+            cached = response_cache.get(cache_key)
+        if cached is not None:
+            return response_handler(raw_data=cached[0], meta=cached[1])
+
+        data_frame, selected_df, feedback_df = load_mdp_frames(options)
+        if data_frame is None:
+            return response_handler(error="No experiences found with the given constraints", status_code=404)
+        try:
+            check_model_architecture(data_frame, options['model_architecture'])
+        except ValueError as error:
+            return response_handler(error=str(error), status_code=400)
+
+        rankings, total = calculate_mdp_batch(data_frame, selected_df,
+                                    [(make_soft_constraints(profile), create_reward_from_soft_constraints(profile)) for profile in profiles],
+                                    options['model_architecture'],
+                                    limit=options['limit'],
+                                    offset=options['offset'],
+                                    feedback_df=feedback_df,
+                                    modelName=Config.MDP_MODEL_NAME)
+
+        with stage("serialize"):
+            raw_data = '[' + ', '.join(frame_to_json(ranking, options['format']) for ranking in rankings) + ']'
+        meta = {"total": total, "offset": options['offset'], "limit": options['limit'], "format": options['format']}
+        response_cache.put(cache_key, raw_data, meta)
+        return response_handler(raw_data=raw_data, meta=meta)
+
+
+@bp.route('/mdp_cache_stats', methods=['GET'])
+@jwt_required()
+def mdp_cache_stats():
+    if request.method == 'GET':
+        return response_handler({"graph_cache": mdp_cache.stats(), "response_cache": response_cache.stats()})
 
 @bp.route('/select_experiment' ,  methods=['GET'])
 @jwt_required()
@@ -204,16 +404,28 @@ def click_experiment():
 @jwt_required()
 def get_selected_experiments():
     if request.method == "POST":
-        experiment_ids = json.loads(request.get_data(as_text=True))['experiment_ids']
+        json_data = json.loads(request.get_data(as_text=True))
+        experiment_ids = json_data['experiment_ids']
         if experiment_ids is None or len(experiment_ids) == 0:
             abort(404 , "missing experiment_ids")
         
+        try:
+            after_id, limit = parse_page_request(json_data)
+        except ValueError as error:
+            return response_handler(error=str(error), status_code=400)
+
         list_ids = [item['id'] for item in experiment_ids]
-        response = GET_SELECTED_EXPERIMENTS(list_ids)
-        if response is not None:
-            return response_handler(response)
-        else:
+        rows = [row for batch in STREAM_SELECTED_EXPERIMENTS(
+            list_ids,
+            batch_size=limit or Config.EXPORT_BATCH_SIZE,
+            after_id=after_id,
+            limit=limit,
+            raw=True
+        ) for row in batch]
+        # none of them was searched; a page past the last one is just empty
+        if len(rows) == 0 and after_id is None:
             abort(404)
+        return page_response(rows, after_id, limit)
     else:
         abort(405)
 
@@ -291,9 +503,9 @@ def add_uc5():
 @jwt_required()
 def get_domains_with_counts():
     if request.method == 'GET':
-        response = GET_DOMAINS_WITH_COUNTS()
-        if response is not None:
-            return response_handler(response)
+        response = GET_DOMAINS_WITH_COUNTS(raw=True)
+        if response is not None and response != 'null':
+            return response_handler(raw_data=response)
         else:
             abort(404)
     else:
@@ -1,6 +1,12 @@
 import json
-from flask import make_response
-def response_handler(data=None, status_code=200, error=None, message=None):
+from flask import make_response, Response
+
+# raw JSON larger than this is streamed in chunks instead of being copied into one body string
+RAW_STREAM_THRESHOLD = 1024 * 1024
+RAW_STREAM_CHUNK = 64 * 1024
+
+def response_handler(data=None, status_code=200, error=None, message=None, meta=None, raw_data=None):
+        # raw_data: "data" already encoded as JSON text, spliced into the body without decoding it again
         response = {
             "status": "success" if error is None else "error",
             "status_code": status_code
@@ -12,11 +18,28 @@ def response_handler(data=None, status_code=200, error=None, message=None):
             response["message"] = message
         if data is not None:
             response["data"] = data
+        if meta is not None:
+            response["meta"] = meta
 
-        res = make_response(json.dumps(response))
+        body = json.dumps(response)
+        if raw_data is not None and len(raw_data) > RAW_STREAM_THRESHOLD:
+            return Response(stream_raw_data(body[:-1] + ', "data": ', raw_data), mimetype='application/json')
+        if raw_data is not None:
+            body = body[:-1] + ', "data": ' + raw_data + '}'
+        res = make_response(body)
         res.mimetype = 'application/json'
         return res
 
+def stream_raw_data(prefix, raw_data):
+    yield prefix
+    for start in range(0, len(raw_data), RAW_STREAM_CHUNK):
+        yield raw_data[start:start + RAW_STREAM_CHUNK]
+    yield '}'
+
+def is_empty_json(raw_data):
+    # raw JSON that the decoded routes treated as "nothing found": missing, null or an empty array/object
+    return raw_data is None or (len(raw_data) < 16 and raw_data.strip() in ('null', '[]', '{}', ''))
+
 def allowed_file(filename , file_type):
     return '.' in filename and \
         filename.rsplit('.', 1)[1].lower() in file_type
\ No newline at end of file
@@ -1,6 +1,70 @@
 import psycopg2
+import psycopg2.extras
 import json
 import os
+import threading
+import time
+
+from ..metrics import DB_CALL_SECONDS, record_timing, registry
+from .pool import ConnectionPool
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    # one pool per process, opened by the first call; a forked worker replaces the one it inherited
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.pid != os.getpid():
+            _pool = ConnectionPool(
+                open_connection,
+                min_size=int(os.getenv("DB_POOL_MIN_SIZE", 1)),
+                max_size=int(os.getenv("DB_POOL_MAX_SIZE", 10)),
+                timeout=float(os.getenv("DB_POOL_TIMEOUT", 30)),
+                max_lifetime=float(os.getenv("DB_POOL_MAX_LIFETIME", 1800)),
+                check_interval=float(os.getenv("DB_POOL_CHECK_INTERVAL", 30)))
+            _pool.open()
+        return _pool
+
+
+def current_pool():
+    # the pool if this process has opened one, without opening it
+    pool = _pool
+    return pool if pool is not None and pool.pid == os.getpid() else None
+
+
+def pool_stat(name, *keys):
+    # gauge callback over the stats of this process's pool (nothing until a first query opened it)
+    def read():
+        pool = current_pool()
+        if pool is None:
+            return None
+        stats = pool.stats()
+        if not keys:
+            return stats[name]
+        return [((key,), stats[key]) for key in keys]
+    return read
+
+
+registry.gauge("xp_db_pool_connections", "Pooled PostgreSQL connections by state",
+               pool_stat(None, "in_use", "idle"), ("state",))
+registry.gauge("xp_db_pool_waiting", "Requests waiting for a pooled PostgreSQL connection", pool_stat("waiting"))
+registry.gauge("xp_db_pool_timeouts_total", "Connection requests that gave up waiting for the pool",
+               pool_stat("timeouts"), metric_type="counter")
+
+
+def open_connection():
+    connection = psycopg2.connect(
+        dbname=os.getenv("DB_NAME"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        host=os.getenv("DB_HOST", "age"),
+        port=os.getenv("DB_PORT", "5432")
+    )
+    print("Connection to PostgreSQL DB successful")
+    return connection
+
 
 class PostgreSQLConnection:
     def __init__(self):
@@ -11,48 +75,41 @@ class PostgreSQLConnection:
         self.port = os.getenv("DB_PORT", "5432") 
         self.connection = None        
     def connect(self):
+        # borrows a connection from the process-wide pool; close() gives it back
         try:
-            self.connection = psycopg2.connect(
-                dbname=self.dbname,
-                user=self.user,
-                password=self.password,
-                host=self.host,
-                port=self.port
-            )
-            print("Connection to PostgreSQL DB successful")
+            self.connection = get_pool().getconn()
         except Exception as error:
             print(f"Error connecting to PostgreSQL database: {error}")
 
     def close(self):
         if self.connection:
-            self.connection.close()
-            print("PostgreSQL connection closed")
+            get_pool().putconn(self.connection)
+            self.connection = None
         else :
             print("Could not close PostgreSQL connection")
 
 
-    def call_function(self , function_name, *args):
+    def call_function(self , function_name, *args, raw=False):
+        # The value returned by the function, decoded once by psycopg2 (json becomes dicts and lists).
+        # raw=True returns its text as the server sent it instead, e.g. JSON to pass through to a response.
+        # None when the call failed.
 
+        start = time.perf_counter()
+        cursor = None
         try:
             self.connect()
+            if self.connection is None:
+                return None
             cursor = self.connection.cursor()
 
-            query = f"SELECT {function_name}({', '.join(['%s'] * len(args))});"
+            query = f"SELECT {function_name}({', '.join(['%s'] * len(args))}){'::text' if raw else ''};"
 
             cursor.execute(query, args)
-    
-            ####CONVERT TO JSON
-            columns = [desc[0] for desc in cursor.description]
-            rows = cursor.fetchall()
-            results = [dict(zip(columns, row)) for row in rows]
-
-            ########
+            row = cursor.fetchone()
 
             self.connection.commit()
 
-            #result = cursor.fetchone()
-            #return results
-            return json.dumps(results, indent=4)
+            return row[0] if row is not None else None
 
 
         except psycopg2.Error  as error:
@@ -60,5 +117,53 @@ class PostgreSQLConnection:
             print(f"Error calling PostgreSQL function: {error}")
             return None
         finally:
-            cursor.close()
-            self.close()
\ No newline at end of file
+            seconds = time.perf_counter() - start
+            DB_CALL_SECONDS.observe(seconds, function=function_name)
+            record_timing("db", seconds)
+            if cursor is not None:
+                cursor.close()
+            if self.connection is not None:
+                self.close()
+
+    def stream(self, name, query, args=None, batch_size=1000, raw=False):
+        # Yields the rows of the query in lists of at most batch_size, read through the server-side cursor
+        # `name` so that neither Postgres nor this process hold the whole result at once. The pooled
+        # connection stays borrowed until the generator is exhausted or closed.
+        # raw=True leaves json columns as the text the server sent. Errors are raised, since stopping
+        # quietly would look like the end of the rows.
+
+        # time spent in Postgres, not in the consumer between batches
+        seconds = 0.0
+        cursor = None
+        try:
+            start = time.perf_counter()
+            self.connect()
+            if self.connection is None:
+                raise psycopg2.OperationalError("no PostgreSQL connection available")
+            cursor = self.connection.cursor(name=name)
+            if raw:
+                psycopg2.extras.register_default_json(cursor, loads=lambda value: value)
+            cursor.execute(query, args)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                seconds += time.perf_counter() - start
+                if not rows:
+                    break
+                yield rows
+                start = time.perf_counter()
+            self.connection.commit()
+
+        except psycopg2.Error as error:
+            print(error.pgcode)
+            print(f"Error streaming PostgreSQL query {name}: {error}")
+            raise
+        finally:
+            DB_CALL_SECONDS.observe(seconds, function=name)
+            record_timing("db", seconds)
+            if cursor is not None and not cursor.closed:
+                try:
+                    cursor.close()
+                except psycopg2.Error:
+                    pass
+            if self.connection is not None:
+                self.close()
@@ -0,0 +1,194 @@
+import os
+import threading
+import time
+from collections import deque
+
+import psycopg2
+from psycopg2 import extensions
+
+from ..metrics import DB_POOL_WAIT_SECONDS
+
+
+class PoolTimeout(psycopg2.OperationalError):
+    # raised when no connection frees up in time; a psycopg2 error so callers handle it like a failed connect
+    pass
+
+
+class ConnectionPool():
+    # Thread-safe pool of psycopg2 connections. Connections are opened on demand up to max_size and kept
+    # open between calls; a connection idle for longer than check_interval is pinged before it is handed
+    # out, and connections older than max_lifetime are closed and replaced.
+    def __init__(self, connect, min_size=1, max_size=10, timeout=30.0, max_lifetime=1800.0, check_interval=30.0):
+        self.connect = connect
+        self.min_size = min_size
+        self.max_size = max(max_size, 1)
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.check_interval = check_interval
+        # (connection, opened at, returned at), most recently returned last
+        self.idle = deque()
+        # id(connection) -> opened at, for the connections handed out
+        self.in_use = {}
+        # open connections plus the ones being opened
+        self.size = 0
+        self.waiting = 0
+        self.closed = False
+        # a forked worker must open its own connections instead of sharing the parent's sockets
+        self.pid = os.getpid()
+        self.condition = threading.Condition()
+
+        self.acquired = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.timeouts = 0
+        self.opened = 0
+        self.recycled = 0
+        self.discarded = 0
+
+    def open(self):
+        # opens the first min_size connections; a database that is not up yet is reported, not fatal
+        connections = []
+        try:
+            for _ in range(self.min_size):
+                connections.append(self.getconn())
+        except psycopg2.Error as error:
+            print(f"Could not fill the PostgreSQL connection pool: {error}")
+        for connection in connections:
+            self.putconn(connection)
+
+    def getconn(self):
+        start = time.monotonic()
+        deadline = start + self.timeout
+        while True:
+            entry = self.__reserve__(deadline)
+            if entry is None:
+                connection = self.__open_connection__()
+            else:
+                connection = self.__checked__(entry)
+                if connection is None:
+                    continue
+            waited = time.monotonic() - start
+            with self.condition:
+                self.in_use[id(connection)] = entry[1] if entry is not None else time.monotonic()
+                self.acquired += 1
+                self.wait_seconds += waited
+                self.max_wait_seconds = max(self.max_wait_seconds, waited)
+            DB_POOL_WAIT_SECONDS.observe(waited)
+            return connection
+
+    def putconn(self, connection):
+        broken = connection.closed != 0
+        if not broken and connection.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                connection.rollback()
+            except psycopg2.Error:
+                broken = True
+        now = time.monotonic()
+        with self.condition:
+            opened_at = self.in_use.pop(id(connection), now)
+            expired = now - opened_at > self.max_lifetime
+            keep = not (broken or expired or self.closed)
+            if keep:
+                self.idle.append((connection, opened_at, now))
+            else:
+                self.size -= 1
+                if expired and not broken:
+                    self.recycled += 1
+                else:
+                    self.discarded += 1
+            self.condition.notify()
+        if not keep:
+            self.__close_connection__(connection)
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            idle, self.idle = list(self.idle), deque()
+            self.size -= len(idle)
+            self.condition.notify_all()
+        for connection, _, _ in idle:
+            self.__close_connection__(connection)
+
+    def stats(self):
+        with self.condition:
+            return {
+                "size": self.size,
+                "in_use": len(self.in_use),
+                "idle": len(self.idle),
+                "waiting": self.waiting,
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "acquired": self.acquired,
+                "wait_seconds": self.wait_seconds,
+                "max_wait_seconds": self.max_wait_seconds,
+                "timeouts": self.timeouts,
+                "opened": self.opened,
+                "recycled": self.recycled,
+                "discarded": self.discarded,
+            }
+
+    def __reserve__(self, deadline):
+        # an idle entry to check, or None after taking a slot for a new connection
+        with self.condition:
+            while True:
+                if self.closed:
+                    raise psycopg2.InterfaceError("connection pool is closed")
+                if self.idle:
+                    return self.idle.pop()
+                if self.size < self.max_size:
+                    self.size += 1
+                    return None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise PoolTimeout(f"no PostgreSQL connection available within {self.timeout}s "
+                                      f"({self.max_size} in use)")
+                self.waiting += 1
+                try:
+                    self.condition.wait(remaining)
+                finally:
+                    self.waiting -= 1
+
+    def __open_connection__(self):
+        try:
+            connection = self.connect()
+        except BaseException:
+            with self.condition:
+                self.size -= 1
+                self.condition.notify()
+            raise
+        with self.condition:
+            self.opened += 1
+        return connection
+
+    def __checked__(self, entry):
+        # the idle connection if it is still usable, otherwise None after giving its slot back
+        connection, opened_at, returned_at = entry
+        now = time.monotonic()
+        usable = connection.closed == 0
+        expired = now - opened_at > self.max_lifetime
+        if usable and not expired and now - returned_at > self.check_interval:
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+                connection.rollback()
+            except psycopg2.Error as error:
+                print(f"Dropping a broken PostgreSQL connection: {error}")
+                usable = False
+        if usable and not expired:
+            return connection
+        with self.condition:
+            self.size -= 1
+            if usable:
+                self.recycled += 1
+            else:
+                self.discarded += 1
+            self.condition.notify()
+        self.__close_connection__(connection)
+        return None
+
+    def __close_connection__(self, connection):
+        try:
+            connection.close()
+        except psycopg2.Error:
+            pass
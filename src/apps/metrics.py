@@ -0,0 +1,158 @@
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Histogram():
+    # cumulative-bucket histogram per label set, rendered in the Prometheus text format
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (+Inf last), sum]
+        self.series = OrderedDict()
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(label, "")) for label in self.labels)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            series = [(key, list(counts), total) for key, (counts, total) in self.series.items()]
+        for key, counts, total in series:
+            labels = [f'{label}="{escape_label(value)}"' for label, value in zip(self.labels, key)]
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                bucket_labels = ",".join(labels + ['le="' + le + '"'])
+                lines.append(f"{self.name}_bucket{{{bucket_labels}}} {cumulative}")
+            suffix = "{" + ",".join(labels) + "}" if labels else ""
+            lines.append(f"{self.name}_sum{suffix} {total!r}")
+            lines.append(f"{self.name}_count{suffix} {cumulative}")
+        return lines
+
+
+class Gauge():
+    # value read when scraped: callback returns a number, or a list of (label values, number);
+    # metric_type "counter" for totals kept elsewhere
+    def __init__(self, name, help_text, callback, labels=(), metric_type="gauge"):
+        self.name = name
+        self.help_text = help_text
+        self.callback = callback
+        self.labels = tuple(labels)
+        self.metric_type = metric_type
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.metric_type}"]
+        values = self.callback()
+        if values is None:
+            return lines
+        if not self.labels:
+            values = [((), values)]
+        for key, value in values:
+            labels = ",".join(f'{label}="{escape_label(str(item))}"' for label, item in zip(self.labels, key))
+            lines.append(f"{self.name}{{{labels}}} {value!r}" if labels else f"{self.name} {value!r}")
+        return lines
+
+
+def escape_label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class MetricsRegistry():
+    def __init__(self):
+        self.metrics = OrderedDict()
+        self.lock = threading.Lock()
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        with self.lock:
+            if name not in self.metrics:
+                self.metrics[name] = Histogram(name, help_text, labels, buckets)
+            return self.metrics[name]
+
+    def gauge(self, name, help_text, callback, labels=(), metric_type="gauge"):
+        with self.lock:
+            if name not in self.metrics:
+                self.metrics[name] = Gauge(name, help_text, callback, labels, metric_type)
+            return self.metrics[name]
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+
+# metrics are per process: with several server workers every one of them is scraped separately
+registry = MetricsRegistry()
+
+REQUEST_SECONDS = registry.histogram(
+    "xp_request_seconds", "Duration of the API requests", ("method", "endpoint", "status"))
+STAGE_SECONDS = registry.histogram(
+    "xp_stage_seconds", "Duration of the stages of the MDP endpoints", ("stage",))
+DB_CALL_SECONDS = registry.histogram(
+    "xp_db_call_seconds", "Duration of the PostgreSQL function calls", ("function",))
+DB_POOL_WAIT_SECONDS = registry.histogram(
+    "xp_db_pool_wait_seconds", "Time spent waiting for a pooled PostgreSQL connection")
+MDP_CANDIDATES = registry.histogram(
+    "xp_mdp_candidates", "Experiments in the candidate set of an MDP request",
+    buckets=(10, 100, 1000, 10000, 100000, 1000000))
+MDP_SOLVER_ITERATIONS = registry.histogram(
+    "xp_mdp_solver_iterations", "Solver iterations per MDP request (0 when a cached solution was reused)",
+    buckets=(0, 1, 2, 5, 10, 50, 100, 1000, 10000))
+MDP_SOLVER_RESIDUAL = registry.histogram(
+    "xp_mdp_solver_residual", "Largest Bellman residual of the utilities solved from scratch for an MDP request",
+    buckets=(1e-12, 1e-9, 1e-6, 1e-4, 0.001, 0.005, 0.01, 0.1, 1))
+
+# (name, seconds) of the stages run by the current request, for its Server-Timing header
+_request_timings = ContextVar("request_timings", default=None)
+
+
+def start_request_timings():
+    return _request_timings.set([])
+
+
+def stop_request_timings(token):
+    _request_timings.reset(token)
+
+
+def request_timings():
+    return _request_timings.get()
+
+
+def record_timing(name, seconds):
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((name, seconds))
+
+
+@contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        STAGE_SECONDS.observe(seconds, stage=name)
+        record_timing(name, seconds)
+
+
+def server_timing_header(timings):
+    # repeated stages (e.g. one entry per DB call) are summed, in order of first appearance
+    totals = OrderedDict()
+    for name, seconds in timings:
+        totals[name] = totals.get(name, 0.0) + seconds
+    return ", ".join(f"{name};dur={seconds * 1000:.3f}" for name, seconds in totals.items())
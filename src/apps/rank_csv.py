@@ -0,0 +1,201 @@
+"""Rank experiments from CSV exports with the call_mdp model, without going through Postgres.
+
+The CSVs use the KPI1.2/UC*.csv layout: domain, intent, method, algorithm and model columns (title
+optional), every other column being a description. Rows are read in chunks and filtered by the hard
+constraints as they are read; the remaining candidates are ranked once per soft-constraint profile and
+written as JSON lines or CSV, one row per ranked experiment. Profiles can be spread over processes.
+
+    PYTHONPATH=src python -m src.apps.rank_csv KPI1.2/UC5.csv \\
+        --hard-constraints '[{"name": "pu", "type": "categorical", "value": "GPU"}]' \\
+        --profiles profiles.json --limit 10 --workers 4 --output ranking.jsonl
+
+--profiles takes JSON (or a path to a JSON file) in the soft_constraint_profiles format of
+/experiment/call_mdp_batch: a list of soft-constraint lists. --hard-constraints takes a list in the same
+shape as a soft-constraint list, since a CSV has no description_type_id to refer to: each item names a
+CSV column, categorical ones with the value it must equal ({"name", "type": "categorical", "value"}),
+numerical ones with the bounds it must lie within ({"name", "type": "numerical", "min", "max"}, null
+for unbounded).
+"""
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from src.apps.utils import Utils
+from src.apps.api.logics import (calculate_mdp_batch, check_model_architecture, create_dataset_from_experience,
+                                 create_reward_from_soft_constraints, make_soft_constraints,
+                                 typed_description_column, unparsed_numbers)
+
+EXPERIMENT_COLUMNS = ['title', 'domain', 'intent', 'method', 'algorithm', 'model']
+SOURCE_COLUMNS = ['source_file', 'source_row']
+DEFAULT_MODEL_ARCHITECTURE = ['intent', 'algorithm', 'model_id']
+
+# candidates of the worker process, set once by init_worker
+_candidates = None
+
+
+def read_candidates(paths, filters, hard_constraints, chunksize=100000):
+    # filtered rows of every file, typed like create_dataset_from_experience types the database rows
+    chunks = []
+    next_id = 1
+    for path in paths:
+        # data row of the file the chunk starts at
+        file_row = 0
+        for chunk in pd.read_csv(path, dtype=str, keep_default_na=False, chunksize=chunksize):
+            chunk = chunk.replace({'': None, 'NA': None})
+            chunk.insert(0, 'experiment_id', range(next_id, next_id + len(chunk)))
+            chunk['source_file'] = os.path.basename(path)
+            chunk['source_row'] = range(file_row, file_row + len(chunk))
+            next_id += len(chunk)
+            file_row += len(chunk)
+            for column in EXPERIMENT_COLUMNS:
+                if column not in chunk.columns:
+                    chunk[column] = None
+            chunk['title'] = chunk['title'].fillna(chunk['domain'])
+            chunks.append(filter_chunk(chunk, filters, hard_constraints))
+
+    data_frame = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(columns=['experiment_id'])
+    numerical = {}
+    for column in data_frame.columns:
+        if column not in ['experiment_id'] + EXPERIMENT_COLUMNS + SOURCE_COLUMNS:
+            values, type_ = data_frame[column].tolist(), description_type(data_frame[column])
+            data_frame[column] = typed_description_column(values, type_)
+            if type_ == "numerical":
+                numerical[column] = unparsed_numbers(values, data_frame[column].to_numpy())
+    data_frame.attrs['numerical_descriptions'] = numerical
+    data_frame['model'] = data_frame['model'].astype(str)
+    #to avoid duplicate models
+    data_frame['model_id'] = data_frame['model'] + "_" + data_frame['experiment_id'].astype(str)
+    return data_frame
+
+
+def description_type(values):
+    present = values.dropna()
+    if len(present) > 0 and pd.to_numeric(present, errors='coerce').notna().all():
+        return "numerical"
+    return "categorical"
+
+
+def filter_chunk(chunk, filters, hard_constraints):
+    # domain/intent/algorithm/method equality and the hard constraints, as get_filtered_experiments applies them
+    conditions = {column: value for column, value in filters.items() if value is not None}
+    for column, condition in make_soft_constraints(hard_constraints or []).items():
+        if column not in chunk.columns:
+            # a description the rows do not have never matches
+            return chunk.iloc[0:0]
+        if isinstance(condition, tuple):
+            chunk[column] = pd.to_numeric(chunk[column], errors='coerce')
+            conditions[column] = condition
+        else:
+            conditions[column] = str(condition)
+    return Utils.filter_dataFrame(chunk, conditions)
+
+
+def init_worker(candidates):
+    global _candidates
+    _candidates = candidates
+
+
+def rank_profiles(task):
+    # (first profile index, ranked frames) of a group of profiles, solved together like call_mdp_batch
+    start, profiles = task
+    data_frame, selected_df, options = _candidates
+    rankings, _ = calculate_mdp_batch(
+        data_frame, selected_df,
+        [(make_soft_constraints(profile), create_reward_from_soft_constraints(profile)) for profile in profiles],
+        options['model_architecture'],
+        limit=options['limit'],
+        feedback_df=None,
+        modelName=options['model_name'])
+    return start, rankings
+
+
+def write_ranking(output, ranking, profile, output_format, header):
+    ranking = ranking.copy()
+    ranking.insert(0, 'rank', range(1, len(ranking) + 1))
+    ranking.insert(0, 'profile', profile)
+    if output_format == "csv":
+        ranking.to_csv(output, header=header, index=False)
+    elif len(ranking) > 0:
+        lines = ranking.to_json(orient='records', lines=True, double_precision=15)
+        output.write(lines if lines.endswith("\n") else lines + "\n")
+
+
+def load_json_argument(value):
+    if value is None:
+        return None
+    if os.path.exists(value):
+        with open(value) as file:
+            return json.load(file)
+    return json.loads(value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('csv', nargs='+', help='CSV files in the KPI1.2/UC*.csv layout')
+    parser.add_argument('--profiles', required=True, help='JSON list of soft-constraint lists (or a file holding it)')
+    parser.add_argument('--hard-constraints', help='JSON list of hard constraints shaped like soft constraints: name (a CSV column), '
+                             'type, and value (categorical) or min/max (numerical); or a file holding it')
+    for column in ('domain', 'intent', 'algorithm', 'method'):
+        parser.add_argument(f'--{column}')
+    parser.add_argument('--model-architecture', default=','.join(DEFAULT_MODEL_ARCHITECTURE),
+                        help='comma-separated levels ending with model_id')
+    parser.add_argument('--model-name', default='MDP_2')
+    parser.add_argument('--limit', type=int, help='ranked experiments written per profile (default: all)')
+    parser.add_argument('--format', choices=['jsonl', 'csv'], default='jsonl')
+    parser.add_argument('--output', help='output file (default: stdout)')
+    parser.add_argument('--workers', type=int, default=1, help='processes the profiles are spread over')
+    parser.add_argument('--batch-size', type=int, default=16, help='profiles solved together per task')
+    parser.add_argument('--chunksize', type=int, default=100000, help='CSV rows read at a time')
+    args = parser.parse_args(argv)
+
+    profiles = load_json_argument(args.profiles)
+    if not isinstance(profiles, list) or len(profiles) == 0 or \
+        any(not isinstance(profile, list) or len(profile) == 0 for profile in profiles):
+            parser.error("--profiles must be a list of non-empty soft constraint lists")
+    model_architecture = args.model_architecture.split(',')
+    if model_architecture[-1] != 'model_id' or len(set(model_architecture)) != len(model_architecture):
+        parser.error("--model-architecture must be distinct levels ending with model_id")
+
+    filters = {column: getattr(args, column) for column in ('domain', 'intent', 'algorithm', 'method')}
+    data_frame = read_candidates(args.csv, filters, load_json_argument(args.hard_constraints), args.chunksize)
+    if len(data_frame) == 0:
+        print("No experiences found with the given constraints", file=sys.stderr)
+        return 1
+    try:
+        check_model_architecture(data_frame, model_architecture)
+    except ValueError as error:
+        parser.error(str(error))
+    print(f"RANKING {len(data_frame)} EXPERIMENTS FOR {len(profiles)} PROFILES...", file=sys.stderr)
+
+    # offline exports carry no clicks
+    candidates = (data_frame, create_dataset_from_experience([]),
+                  {'model_architecture': model_architecture, 'limit': args.limit, 'model_name': args.model_name})
+    tasks = [(start, profiles[start:start + args.batch_size]) for start in range(0, len(profiles), args.batch_size)]
+
+    executor = None
+    if args.workers > 1 and len(tasks) > 1:
+        executor = ProcessPoolExecutor(min(args.workers, len(tasks)), initializer=init_worker, initargs=(candidates,))
+    else:
+        init_worker(candidates)
+    output = open(args.output, 'w', newline='') if args.output else sys.stdout
+    try:
+        results = executor.map(rank_profiles, tasks) if executor is not None else map(rank_profiles, tasks)
+        # results arrive in profile order and are written as soon as their group is done
+        for start, rankings in results:
+            for k, ranking in enumerate(rankings):
+                write_ranking(output, ranking, start + k, args.format, header=start + k == 0)
+            output.flush()
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+        if output is not sys.stdout:
+            output.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
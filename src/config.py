@@ -6,5 +6,17 @@ class Config:
     JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY")
     PROFILE_FOLDER = os.getenv("PROFILE_FOLDER")
     HASH_SAULT = os.getenv("HASH_SAULT")
+    MDP_EXPORT_FOLDER = os.getenv("MDP_EXPORT_FOLDER")
+    MDP_MODEL_NAME = os.getenv("MDP_MODEL_NAME", "MDP_2")
+    MDP_CACHE_MAX_ENTRIES = int(os.getenv("MDP_CACHE_MAX_ENTRIES", 32))
+    MDP_CACHE_MAX_BYTES = int(os.getenv("MDP_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+    MDP_PARALLEL_WORKERS = int(os.getenv("MDP_PARALLEL_WORKERS", 1))
+    MDP_PARALLEL_MIN_STATES = int(os.getenv("MDP_PARALLEL_MIN_STATES", 200000))
+    MDP_FETCH_BATCH_SIZE = int(os.getenv("MDP_FETCH_BATCH_SIZE", 0))
+    EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", 1000))
+    RESPONSE_CACHE_URL = os.getenv("RESPONSE_CACHE_URL")
+    RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 256))
+    RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+    RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", 3600))
     JWT_ACCESS_TOKEN_EXPIRES = dt.timedelta(days=1)
     JWT_REFRESH_TOKEN_EXPIRES = dt.timedelta(weeks=1)
\ No newline at end of file
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# the app is run from the repository root with src on the path (from src.apps ..., from config ...)
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'src')]
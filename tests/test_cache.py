@@ -0,0 +1,100 @@
+from src.apps.api.cache import LRUCache, RedisCache, ResponseCache
+
+
+class FakeRedis():
+    # the part of the redis client RedisCache uses, over a dict
+    def __init__(self):
+        self.values = {}
+        self.expiries = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, ex=None):
+        self.values[key] = value.encode() if isinstance(value, str) else value
+        self.expiries[key] = ex
+
+    def incr(self, key):
+        self.values[key] = str(int(self.values.get(key, b'0')) + 1).encode()
+        return int(self.values[key])
+
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache(max_entries=2, max_bytes=100)
+    cache.put('a', 1, 10)
+    cache.put('b', 2, 10)
+    assert cache.get('a') == 1
+    cache.put('c', 3, 10)
+    assert cache.get('b') is None and cache.get('a') == 1 and cache.get('c') == 3
+
+    # the byte bound evicts as well, and an entry larger than it is not kept
+    cache.put('d', 4, 95)
+    assert cache.get('a') is None and cache.get('c') is None and cache.get('d') == 4
+    assert not cache.put('e', 5, 101) and cache.get('e') is None
+    stats = cache.stats()
+    assert (stats['entries'], stats['bytes'], stats['evictions']) == (1, 95, 3)
+
+
+def test_lru_counters_are_never_evicted():
+    cache = LRUCache(max_entries=1)
+    cache.incr(ResponseCache.VERSION_KEY)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get_counter(ResponseCache.VERSION_KEY) == 1
+
+
+def check_invalidation(cache):
+    key = cache.make_key('call_mdp', {'domain': 'manufacturing'}, [{'name': 'accuracy'}])
+    cache.put(key, '[1, 2]', {'total': 2})
+    assert cache.get(key) == ('[1, 2]', {'total': 2})
+
+    cache.bump_data_version()
+    new_key = cache.make_key('call_mdp', {'domain': 'manufacturing'}, [{'name': 'accuracy'}])
+    assert new_key != key and cache.get(new_key) is None
+
+
+def test_data_version_invalidates_memory_entries():
+    check_invalidation(ResponseCache(LRUCache()))
+
+
+def test_data_version_invalidates_redis_entries():
+    client = FakeRedis()
+    cache = ResponseCache(RedisCache(client=client, ttl=60))
+    check_invalidation(cache)
+    assert client.values['xp:data_version'] == b'1'
+    assert set(client.expiries.values()) == {60}
+
+
+def test_keys_ignore_the_order_of_request_fields():
+    cache = ResponseCache(LRUCache())
+    key = cache.make_key('call_mdp', {'domain': 'd', 'intent': None, 'limit': 10}, [{'name': 'a', 'type': 'numerical'}])
+    assert key == cache.make_key('call_mdp', {'limit': 10, 'intent': None, 'domain': 'd'}, [{'type': 'numerical', 'name': 'a'}])
+    assert key != cache.make_key('call_mdp', {'domain': 'd', 'intent': None, 'limit': 20}, [{'name': 'a', 'type': 'numerical'}])
+    assert key != cache.make_key('call_mdp_batch', {'domain': 'd', 'intent': None, 'limit': 10}, [{'name': 'a', 'type': 'numerical'}])
+
+
+def test_redis_failures_are_misses():
+    class BrokenRedis():
+        def get(self, *args, **kwargs):
+            raise ConnectionError("down")
+
+        set = incr = get
+
+    cache = ResponseCache(RedisCache(client=BrokenRedis()))
+    key = cache.make_key('call_mdp', {})
+    assert key is None and cache.get(key) is None and not cache.put(key, '[]', {})
+
+
+def test_lru_resize_evicts_to_fit():
+    cache = LRUCache(max_entries=4, max_bytes=100)
+    cache.put('a', 1, 30)
+    cache.put('b', 2, 30)
+    cache.put('c', 3, 30)
+    # 'a' grew after it was put; it is now the most recent, so 'b' and 'c' go
+    assert cache.resize('a', 80)
+    assert cache.get('b') is None and cache.get('c') is None and cache.get('a') == 1
+    assert cache.stats()['bytes'] == 80
+    # an entry that outgrew the bound is dropped, and one that is gone is not resized
+    assert not cache.resize('a', 120) and cache.get('a') is None
+    assert not cache.resize('b', 10)
+    assert cache.stats()['bytes'] == 0
@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.apps.MDP import GraphWorld, PolicyIteration, generate_initial_transition_model
+from src.apps.MDP.initial_transition_generator import encode_level
+
+GAMMA = 0.9
+
+
+def make_graph_world(rows, modelArchitecture, constraints=None, reward_values=None):
+    data = pd.DataFrame(rows)
+    transition_model = generate_initial_transition_model(data, pd.DataFrame(), [], modelArchitecture, modelName="MDP_2")
+    return GraphWorld(data, modelArchitecture, transition_model, constraints or {}, reward_values or {})
+
+
+def test_path_utility_on_shared_algorithm():
+    # algorithm "a" is used under both intents, so it is on the path of leaves of i1 and of i2
+    architecture = ['intent', 'algorithm', 'model_id']
+    graph = make_graph_world({
+        'intent': ['i1', 'i1', 'i2', 'i2'],
+        'algorithm': ['a', 'b', 'a', 'c'],
+        'model_id': ['m1', 'm2', 'm3', 'm4'],
+    }, architecture)
+    rewards = np.zeros(graph.num_states)
+    rewards[graph.inner_node_num:] = [1, 2, 3, 4]
+    solver = PolicyIteration(graph, GAMMA, 0.005, reward_function=rewards)
+    utilities = solver.get_utility_values()
+
+    # leaves keep the probability of their only edge on their self-loop
+    m1, m2, m3, m4 = 1 / (1 - GAMMA * 0.5), 2 / (1 - GAMMA), 3 / (1 - GAMMA * 0.5), 4 / (1 - GAMMA)
+    a, b, c = GAMMA * (m1 + m3) / 2, GAMMA * m2, GAMMA * m4
+    i1, i2 = GAMMA * (a + b) / 2, GAMMA * (a + c) / 2
+    key = graph.get_state_key
+    assert utilities[[key('intent', 'i1'), key('intent', 'i2'), key('algorithm', 'a')]] == pytest.approx([i1, i2, a])
+
+    path_values = solver.path_utility(utilities)
+    assert path_values == pytest.approx([i1 + a + m1, i1 + b + m2, i2 + a + m3, i2 + c + m4])
+
+    # several profiles at once give the same paths column by column
+    matrix = PolicyIteration(graph, GAMMA, 0.005, reward_function=np.column_stack([rewards, 2 * rewards]))
+    path_matrix = matrix.path_utility(matrix.get_utility_values())
+    assert path_matrix[:, 0] == pytest.approx(path_values)
+    assert path_matrix[:, 1] == pytest.approx(2 * path_values)
+
+
+def test_encode_level_of_missing_values():
+    values, codes = encode_level(pd.Series([None, None], dtype=object))
+    assert len(values) == 0 and codes.tolist() == [-1, -1]
+
+    values, codes = encode_level(pd.Series(['b', None, 'A', 'b'], dtype=object))
+    assert values.tolist() == ['A', 'b'] and codes.tolist() == [1, -1, 0, 1]
+
+
+def test_ranking_with_names_shared_across_levels():
+    # "svm" is an intent, an algorithm and a model, "tree" an intent, an algorithm and a model
+    architecture = ['intent', 'algorithm', 'model_id']
+    graph = make_graph_world({
+        'intent': ['svm', 'svm', 'tree'],
+        'algorithm': ['svm', 'tree', 'tree'],
+        'model_id': ['svm', 'forest', 'tree'],
+        'accuracy': [0.9, 0.5, 0.7],
+    }, architecture, constraints={'accuracy': (0.6, None)}, reward_values={'accuracy': (0, 1)})
+
+    # levels are laid out one after the other: intents, algorithms, then the leaves forest, svm, tree
+    assert [graph.get_state_key(level, 'svm') for level in architecture] == [0, 2, 5]
+    assert [graph.get_state_key(level, 'tree') for level in architecture] == [1, 3, 6]
+    assert graph.get_state_key('model_id', 'forest') == 4
+    assert [graph.get_value(key) for key in range(graph.num_states)] == ['svm', 'tree', 'svm', 'tree', 'forest', 'svm', 'tree']
+
+    solver = PolicyIteration(graph, GAMMA, 0.005)
+    utilities = solver.get_utility_values()
+    path_values = solver.path_utility(utilities)
+
+    # leaves: reward 1 when accuracy >= 0.6, kept with the probability of their only edge;
+    # inner states: the discounted average of their children
+    leaf_svm, leaf_forest, leaf_tree = 1 / (1 - GAMMA), 0.0, 1 / (1 - GAMMA * 0.5)
+    algorithm_svm, algorithm_tree = GAMMA * leaf_svm, GAMMA * (leaf_forest + leaf_tree) / 2
+    intent_svm, intent_tree = GAMMA * (algorithm_svm + algorithm_tree) / 2, GAMMA * algorithm_tree
+    assert utilities == pytest.approx([intent_svm, intent_tree, algorithm_svm, algorithm_tree, leaf_forest, leaf_svm, leaf_tree])
+    assert path_values == pytest.approx([intent_svm + algorithm_tree + leaf_forest,
+                                         intent_svm + algorithm_svm + leaf_svm,
+                                         intent_tree + algorithm_tree + leaf_tree])
+
+    # svm (23.42) before forest (5.24) before tree (3.37)
+    ranked = graph.rank_leafs(scores=path_values)
+    assert [graph.get_value(graph.inner_node_num + leaf) for leaf in ranked] == ['svm', 'forest', 'tree']
+    assert graph.data['accuracy'].iloc[graph.leaf_rows[ranked]].tolist() == [0.9, 0.5, 0.7]
@@ -0,0 +1,35 @@
+import json
+
+import numpy as np
+
+from src.apps.api.logics import create_dataset_from_experience, frame_to_json, leafs_to_frame
+
+
+def experiment(experiment_id, ram, accuracy, pu):
+    return {'experiment_id': experiment_id, 'title': 't', 'domain': 'd', 'intent': 'i', 'algorithm': 'a',
+            'method': 'm', 'model': f'model{experiment_id}',
+            'descriptions': [{'name': 'ram', 'value': ram, 'type': 'numerical'},
+                             {'name': 'accuracy', 'value': accuracy, 'type': 'numerical'},
+                             {'name': 'pu', 'value': pu, 'type': 'categorical'}]}
+
+
+def test_numerical_descriptions_are_answered_as_given():
+    data_frame = create_dataset_from_experience([
+        experiment(1, '256', '0.91', 'GPU'),
+        experiment(2, 'x', '1', 'CPU'),
+        experiment(3, None, '-2.5e-1', '16'),
+    ])
+    data_frame['model_id'] = data_frame['model'] + "_" + data_frame['experiment_id'].astype(str)
+    # the rewards work on numbers
+    assert data_frame['ram'].dtype == np.float64 and data_frame['ram'].iloc[0] == 256
+
+    rows = np.array([2, 0, 1])
+    page = leafs_to_frame(data_frame, rows, np.zeros(3), np.zeros(3))
+    records = json.loads(frame_to_json(page))
+    assert [record['ram'] for record in records] == [None, 256, 'x']
+    assert [record['accuracy'] for record in records] == [-0.25, 0.91, 1]
+    assert isinstance(records[1]['ram'], int) and isinstance(records[2]['accuracy'], int)
+    assert [record['pu'] for record in records] == ['16', 'GPU', 'CPU']
+
+    columnar = json.loads(frame_to_json(page, "columnar"))
+    assert columnar['values'][columnar['columns'].index('ram')] == [None, 256, 'x']
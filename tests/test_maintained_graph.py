@@ -0,0 +1,164 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.apps.MDP import GraphWorld, MaintainedGraph, PolicyIteration, generate_initial_transition_model
+
+GAMMA = 0.9
+ARCHITECTURE = ['intent', 'algorithm', 'model_id']
+CONSTRAINTS = {'accuracy': (0.6, None)}
+REWARD_VALUES = {'accuracy': (0, 1)}
+
+
+def candidates():
+    return pd.DataFrame({
+        'experiment_id': [1, 2, 3, 4, 5, 6],
+        'intent': ['i1', 'i1', 'i1', 'i2', 'i2', 'i2'],
+        'algorithm': ['a', 'a', 'b', 'a', 'c', 'c'],
+        'model_id': ['m1', 'm2', 'm3', 'm4', 'm5', 'm6'],
+        'accuracy': [0.9, 0.5, 0.7, 0.8, 0.4, 0.65],
+    })
+
+
+def clicks(data, counts, modelArchitecture=ARCHITECTURE):
+    # selected experiments as build_mdp_frames makes them: experiment_id -> clicks
+    selected = data[data['experiment_id'].isin(counts)].copy()
+    selected['experiment_count'] = selected['experiment_id'].map(counts)
+    return selected[['experiment_id'] + modelArchitecture + ['experiment_count']]
+
+
+def ratings(mean_and_count):
+    # model_id -> (mean rating on 1-5, number of ratings), as create_feedback_from_ratings makes them
+    return pd.DataFrame({
+        'model_id': list(mean_and_count),
+        'feedback': [mean / 5 for mean, _ in mean_and_count.values()],
+        'count': [float(count) for _, count in mean_and_count.values()],
+    })
+
+
+def cold_solve(data, selected, feedback, modelArchitecture=ARCHITECTURE, modelName="MDP_3"):
+    # utilities and path utilities of a graph built from scratch for these clicks and ratings
+    transition_model = generate_initial_transition_model(
+        data, selected, feedback if feedback is not None else [], modelArchitecture, modelName=modelName)
+    graph = GraphWorld(data, modelArchitecture, transition_model, CONSTRAINTS, REWARD_VALUES)
+    solver = PolicyIteration(graph, GAMMA, 0.005)
+    utilities = solver.get_utility_values()
+    return utilities, solver.path_utility(utilities)
+
+
+def incremental_solve(maintained, data, selected, feedback):
+    problem, version = maintained.update(selected, feedback)
+    rewards = problem.get_reward_function(data.iloc[problem.leaf_rows], CONSTRAINTS, REWARD_VALUES)
+    utilities, path_values, iterations, _ = maintained.solve(problem, version, rewards, gamma=GAMMA, theta=0.005)
+    return problem, version, utilities, path_values, iterations
+
+
+def test_incremental_updates_match_a_cold_rebuild():
+    data = candidates()
+    transition_model = generate_initial_transition_model(data, pd.DataFrame(), [], ARCHITECTURE, modelName="MDP_3")
+    maintained = MaintainedGraph(GraphWorld(data, ARCHITECTURE, transition_model, CONSTRAINTS, REWARD_VALUES))
+    first, _, _, first_paths, _ = incremental_solve(maintained, data, pd.DataFrame(), None)
+    first_probabilities = first.transition_model.probabilities.copy()
+
+    steps = [
+        (clicks(data, {1: 2}), None),
+        (clicks(data, {1: 2, 5: 3}), None),
+        (clicks(data, {1: 2, 5: 3}), ratings({'m5': (5, 4), 'm2': (1, 1)})),
+        (clicks(data, {1: 1, 5: 3, 6: 4}), ratings({'m5': (5, 4), 'm2': (2, 3)})),
+    ]
+    for selected, feedback in steps:
+        problem, version, utilities, path_values, iterations = incremental_solve(maintained, data, selected, feedback)
+        cold_utilities, cold_paths = cold_solve(data, selected, feedback)
+        assert utilities == pytest.approx(cold_utilities)
+        assert path_values == pytest.approx(cold_paths)
+        assert problem.rank_leafs(scores=path_values).tolist() == problem.rank_leafs(scores=cold_paths).tolist()
+
+    assert version == len(steps)
+    # nothing new: the same snapshot and its solution are reused
+    _, same_version, _, same_paths, iterations = incremental_solve(maintained, data, *steps[-1])
+    assert same_version == version and iterations == 0 and same_paths == pytest.approx(path_values)
+
+    # the snapshot of the first request was never modified
+    assert np.array_equal(first.transition_model.probabilities, first_probabilities)
+    assert solve_snapshot(first, data) == pytest.approx(first_paths)
+
+
+def solve_snapshot(problem, data):
+    rewards = problem.get_reward_function(data.iloc[problem.leaf_rows], CONSTRAINTS, REWARD_VALUES)
+    solver = PolicyIteration(problem, GAMMA, 0.005, reward_function=rewards)
+    return solver.path_utility(solver.get_utility_values())
+
+
+def test_refresh_only_resolves_what_changed():
+    data = candidates()
+    transition_model = generate_initial_transition_model(data, pd.DataFrame(), [], ARCHITECTURE, modelName="MDP_2")
+    graph = GraphWorld(data, ARCHITECTURE, transition_model, CONSTRAINTS, REWARD_VALUES)
+    utilities = PolicyIteration(graph, GAMMA, 0.005).get_utility_values()
+
+    maintained = MaintainedGraph(graph)
+    problem, version = maintained.update(clicks(data, {6: 5}))
+    changed = maintained.changes[version]
+    refreshed = PolicyIteration(problem, GAMMA, 0.005).refresh_utility_values(utilities, changed)
+    assert refreshed == pytest.approx(PolicyIteration(problem, GAMMA, 0.005).get_utility_values())
+    # the clicks only re-weight the rows of i2 and c, so the utilities under intent i1 are kept
+    for level, value in (('intent', 'i1'), ('algorithm', 'b'), ('model_id', 'm1')):
+        key = problem.get_state_key(level, value)
+        assert refreshed[key] == utilities[key]
+
+
+def test_single_level_architecture_after_clicks():
+    data = candidates()
+    architecture = ['model_id']
+    transition_model = generate_initial_transition_model(data, pd.DataFrame(), [], architecture, modelName="MDP_3")
+    maintained = MaintainedGraph(GraphWorld(data, architecture, transition_model, CONSTRAINTS, REWARD_VALUES))
+    incremental_solve(maintained, data, pd.DataFrame(), None)
+
+    selected = clicks(data, {1: 2, 4: 1}, architecture)
+    feedback = ratings({'m4': (5, 2)})
+    _, version, utilities, path_values, _ = incremental_solve(maintained, data, selected, feedback)
+    cold_utilities, cold_paths = cold_solve(data, selected, feedback, architecture)
+    assert version == 0
+    assert utilities == pytest.approx(cold_utilities)
+    assert path_values == pytest.approx(cold_paths)
+
+
+def test_cached_graph_without_descriptions():
+    data = candidates()
+    data['description'] = ['a long description of experiment %d' % i for i in data['experiment_id']]
+    transition_model = generate_initial_transition_model(data, pd.DataFrame(), [], ARCHITECTURE, modelName="MDP_3")
+    graph = GraphWorld(data, ARCHITECTURE, transition_model, CONSTRAINTS, REWARD_VALUES)
+    maintained = MaintainedGraph(graph.without_descriptions())
+    assert list(maintained.graph_world.data.columns) == ARCHITECTURE
+    assert maintained.graph_world.nbytes < graph.nbytes
+
+    # the rewards come from the request's rows, so the ranking is that of the full graph
+    selected = clicks(data, {1: 2, 5: 3})
+    feedback = ratings({'m5': (5, 4)})
+    _, _, _, path_values, _ = incremental_solve(maintained, data, selected, feedback)
+    _, cold_paths = cold_solve(data, selected, feedback)
+    assert path_values == pytest.approx(cold_paths)
+
+
+def test_maintained_graph_counts_changes_and_solutions():
+    data = candidates()
+    transition_model = generate_initial_transition_model(data, pd.DataFrame(), [], ARCHITECTURE, modelName="MDP_2")
+    maintained = MaintainedGraph(GraphWorld(data, ARCHITECTURE, transition_model, CONSTRAINTS, REWARD_VALUES))
+    empty = maintained.nbytes
+    incremental_solve(maintained, data, pd.DataFrame(), None)
+    solved = maintained.nbytes
+    assert solved > empty
+    incremental_solve(maintained, data, clicks(data, {6: 5}), None)
+    assert maintained.changes and maintained.nbytes > solved
+
+
+def test_solve_reports_the_residual_of_fresh_solutions():
+    data = candidates()
+    transition_model = generate_initial_transition_model(data, pd.DataFrame(), [], ARCHITECTURE, modelName="MDP_2")
+    maintained = MaintainedGraph(GraphWorld(data, ARCHITECTURE, transition_model, CONSTRAINTS, REWARD_VALUES))
+    problem, version = maintained.update(pd.DataFrame())
+    rewards = problem.get_reward_function(data.iloc[problem.leaf_rows], CONSTRAINTS, REWARD_VALUES)
+    *_, iterations, residual = maintained.solve(problem, version, rewards, gamma=GAMMA, theta=0.005, method="jacobi")
+    assert iterations > 1 and 0 <= residual < 0.005
+    # a reused solution was not solved again
+    *_, iterations, residual = maintained.solve(problem, version, rewards, gamma=GAMMA, theta=0.005)
+    assert iterations == 0 and residual is None
@@ -0,0 +1,50 @@
+from src.apps.metrics import (Gauge, Histogram, MetricsRegistry, request_timings, server_timing_header,
+                              stage, start_request_timings, stop_request_timings)
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram("xp_test_seconds", "Test durations", ("stage",), buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 3):
+        histogram.observe(value, stage="solve")
+    lines = histogram.render()
+    assert lines[:2] == ["# HELP xp_test_seconds Test durations", "# TYPE xp_test_seconds histogram"]
+    assert lines[2:] == [
+        'xp_test_seconds_bucket{stage="solve",le="0.1"} 2',
+        'xp_test_seconds_bucket{stage="solve",le="1.0"} 3',
+        'xp_test_seconds_bucket{stage="solve",le="+Inf"} 4',
+        'xp_test_seconds_sum{stage="solve"} 3.65',
+        'xp_test_seconds_count{stage="solve"} 4',
+    ]
+
+
+def test_gauge_escapes_labels_and_skips_missing_values():
+    gauge = Gauge("xp_test_items", "Test items", lambda: [(('a"b',), 2)], ("name",))
+    assert gauge.render()[-1] == 'xp_test_items{name="a\\"b"} 2'
+    assert len(Gauge("xp_test_none", "Nothing yet", lambda: None).render()) == 2
+
+
+def test_registry_keeps_the_first_metric_of_a_name():
+    registry = MetricsRegistry()
+    first = registry.histogram("xp_test", "First")
+    assert registry.histogram("xp_test", "Second") is first
+    assert registry.render().startswith("# HELP xp_test First\n")
+
+
+def test_stages_are_timed_per_request():
+    with stage("outside"):
+        pass
+    token = start_request_timings()
+    try:
+        with stage("db"):
+            pass
+        with stage("solve"):
+            pass
+        with stage("db"):
+            pass
+        timings = list(request_timings())
+    finally:
+        stop_request_timings(token)
+    assert [name for name, _ in timings] == ["db", "solve", "db"]
+    assert request_timings() is None
+    header = server_timing_header([("db", 0.001), ("solve", 0.0025), ("db", 0.002)])
+    assert header == "db;dur=3.000, solve;dur=2.500"
@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.apps.MDP import GraphWorld, PolicyIteration, generate_initial_transition_model
+from src.apps.MDP.parallel_solver import parallel_backward_pass
+
+GAMMA = 0.9
+ARCHITECTURE = ['intent', 'algorithm', 'model_id']
+
+
+def graph_world():
+    # 2 intents x 6 algorithms x 60 models, with clicks on a few of them
+    rng = np.random.default_rng(7)
+    data = pd.DataFrame({
+        'experiment_id': range(60),
+        'intent': ['i%d' % (i % 2) for i in range(60)],
+        'algorithm': ['a%d' % (i % 6) for i in range(60)],
+        'model_id': ['m%d' % i for i in range(60)],
+        'accuracy': rng.random(60),
+    })
+    selected = data.iloc[[3, 8, 21, 40]].copy()
+    selected['experiment_count'] = [1, 4, 2, 3]
+    selected = selected[['experiment_id'] + ARCHITECTURE + ['experiment_count']]
+    transition_model = generate_initial_transition_model(data, selected, [], ARCHITECTURE, modelName="MDP_2")
+    return GraphWorld(data, ARCHITECTURE, transition_model, {'accuracy': (0.5, None)}, {'accuracy': (0, 1)})
+
+
+def test_parallel_solver_matches_the_dag_pass():
+    graph = graph_world()
+    dag = PolicyIteration(graph, GAMMA, 0.005, method="dag").get_utility_values()
+    parallel = PolicyIteration(graph, GAMMA, 0.005, method="parallel", workers=2).get_utility_values()
+    assert parallel == pytest.approx(dag)
+
+
+def test_parallel_chunks_match_the_dag_pass():
+    # chunks this small send every generation with more than one chunk to the worker processes
+    graph = graph_world()
+    model = graph.transition_model
+    rewards = np.column_stack([graph.reward_function, np.arange(graph.num_states, dtype='float64')])
+    dag = PolicyIteration(graph, GAMMA, 0.005, method="dag", reward_function=rewards).get_utility_values()
+    parallel = parallel_backward_pass(model, rewards, model.topological_generations(), GAMMA, workers=2, min_chunk=10)
+    assert parallel.shape == dag.shape
+    assert parallel == pytest.approx(dag)
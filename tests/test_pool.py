@@ -0,0 +1,118 @@
+import os
+
+import psycopg2
+import pytest
+from psycopg2 import extensions
+
+from src.apps.database import connection as database
+from src.apps.database.pool import ConnectionPool, PoolTimeout
+
+
+class FakeCursor():
+    def __init__(self, connection):
+        self.connection = connection
+        self.closed = False
+
+    def execute(self, query, args=None):
+        self.connection.status = extensions.TRANSACTION_STATUS_INTRANS
+        if self.connection.fail:
+            self.connection.status = extensions.TRANSACTION_STATUS_INERROR
+            raise psycopg2.Error("function does not exist")
+
+    def fetchone(self):
+        return (1,)
+
+    def fetchmany(self, size):
+        rows, self.connection.rows = self.connection.rows[:size], self.connection.rows[size:]
+        return rows
+
+    def close(self):
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class FakeConnection():
+    # the part of a psycopg2 connection the pool and PostgreSQLConnection use
+    def __init__(self):
+        self.closed = 0
+        self.status = extensions.TRANSACTION_STATUS_IDLE
+        self.fail = False
+        self.rows = []
+        self.rollbacks = 0
+
+    def cursor(self, name=None):
+        return FakeCursor(self)
+
+    def get_transaction_status(self):
+        return self.status
+
+    def commit(self):
+        self.status = extensions.TRANSACTION_STATUS_IDLE
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.status = extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    pool = ConnectionPool(FakeConnection, min_size=0, max_size=1, timeout=0.05)
+    # the process-wide pool PostgreSQLConnection borrows from
+    monkeypatch.setattr(database, "_pool", pool)
+    assert pool.pid == os.getpid()
+    yield pool
+    pool.close()
+
+
+def test_failed_transaction_is_rolled_back_and_returned(pool):
+    connection = pool.getconn()
+    connection.fail = True
+    with pytest.raises(psycopg2.Error):
+        connection.cursor().execute("SELECT broken()")
+    pool.putconn(connection)
+    assert connection.rollbacks == 1 and connection.closed == 0
+    assert pool.stats()["idle"] == 1 and pool.stats()["in_use"] == 0
+    # the same connection is handed out again, ready for a new transaction
+    assert pool.getconn() is connection
+    assert connection.get_transaction_status() == extensions.TRANSACTION_STATUS_IDLE
+
+
+def test_call_function_returns_the_connection_after_an_error(pool):
+    pool.putconn(pool.getconn())
+    connection = pool.idle[-1][0]
+    connection.fail = True
+    assert database.PostgreSQLConnection().call_function("broken") is None
+    assert connection.rollbacks == 1
+    stats = pool.stats()
+    assert (stats["size"], stats["idle"], stats["in_use"]) == (1, 1, 0)
+
+
+def test_stream_returns_the_connection_when_the_consumer_stops(pool):
+    pool.putconn(pool.getconn())
+    connection = pool.idle[-1][0]
+    connection.rows = [(i,) for i in range(5)]
+    rows = database.PostgreSQLConnection().stream("rows", "SELECT 1", batch_size=2)
+    assert next(rows) == [(0,), (1,)]
+    assert pool.stats()["in_use"] == 1
+    rows.close()
+    assert connection.rollbacks == 1 and pool.stats()["idle"] == 1
+
+
+def test_broken_connections_are_replaced_and_waiting_times_out(pool):
+    connection = pool.getconn()
+    # a full pool makes the next caller wait, then give up
+    with pytest.raises(PoolTimeout):
+        pool.getconn()
+    connection.closed = 2
+    pool.putconn(connection)
+    stats = pool.stats()
+    assert (stats["size"], stats["discarded"], stats["timeouts"]) == (0, 1, 1)
+    assert pool.getconn() is not connection
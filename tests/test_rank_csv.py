@@ -0,0 +1,28 @@
+import os
+
+import pandas as pd
+
+from src.apps.rank_csv import read_candidates
+
+KPI = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'KPI1.2')
+FILTERS = {'domain': None, 'intent': None, 'algorithm': None, 'method': None}
+
+
+def test_source_rows_across_chunks():
+    paths = [os.path.join(KPI, 'UC1.csv'), os.path.join(KPI, 'UC3.csv')]
+    data_frame = read_candidates(paths, FILTERS, None, chunksize=30)
+    for path in paths:
+        rows = data_frame[data_frame['source_file'] == os.path.basename(path)]
+        source = pd.read_csv(path)
+        assert rows['source_row'].tolist() == list(range(len(source)))
+        assert rows['model'].tolist() == source['model'].astype(str).tolist()
+    assert data_frame['experiment_id'].tolist() == list(range(1, len(data_frame) + 1))
+
+
+def test_source_rows_of_filtered_chunks():
+    path = os.path.join(KPI, 'UC1.csv')
+    hard_constraints = [{'name': 'accuracy', 'type': 'numerical', 'min': 0.8, 'max': None}]
+    data_frame = read_candidates([path], FILTERS, hard_constraints, chunksize=30)
+    source = pd.read_csv(path)
+    assert len(data_frame) > 0
+    assert data_frame['accuracy'].tolist() == source['accuracy'].iloc[data_frame['source_row']].tolist()